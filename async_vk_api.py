@@ -0,0 +1,624 @@
+import asyncio
+import http
+from collections import deque
+from datetime import datetime, tzinfo
+from typing import Union, Optional, Sequence, Tuple
+
+import aiohttp
+
+from cache import ResponseCache, MISSING
+from config import DEFAULT_TIMEZONE
+from rate_limit import RateLimiter
+from vk_api import BaseVkAPI, PostWindow, RegistrationScanner, RequestFailed, NoSuchUser, NoSuchGroup
+
+
+class AsyncVkBatch:
+    """
+    Пакет вызовов VK API для AsyncVkAPI, см. VkBatch
+
+    async with vkapi.batch() as batch:
+        friends = batch.call('friends.get', {'user_id': 1})
+    await friends
+    """
+
+    def __init__(self, vkapi: 'AsyncVkAPI'):
+        self.vkapi = vkapi
+        self._queue = []
+        self._flushes = []
+
+    def call(self, method: str, params: dict) -> asyncio.Future:
+        """
+        Добавляет вызов в пакет и возвращает Future с его результатом
+
+        Набравшиеся execute_limit вызовов отправляются сразу, не дожидаясь выхода из with
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((method, params, future))
+        if len(self._queue) >= self.vkapi.execute_limit:
+            self._flushes.append(asyncio.ensure_future(self.flush()))
+        return future
+
+    async def flush(self) -> None:
+        queue, self._queue = self._queue, []
+        if not queue:
+            return
+
+        try:
+            results = await self.vkapi.execute([(method, params) for method, params, _ in queue])
+        except Exception as e:
+            for _, _, future in queue:
+                future.set_exception(e)
+            return
+
+        for (_, _, future), result in zip(queue, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.flush()
+        flushes, self._flushes = self._flushes, []
+        await asyncio.gather(*flushes)
+
+
+class AsyncVkAPI(BaseVkAPI):
+    """
+    Асинхронный клиент VK API на aiohttp
+
+    Методы повторяют VkAPI, но являются корутинами (get_posts - асинхронный генератор).
+    Подготовка запросов и разбор ответов общие с VkAPI (BaseVkAPI)
+
+    async with AsyncVkAPI(token) as vkapi:
+        friends = await vkapi.get_friends('durov', ['city'])
+    """
+
+    def __init__(self, token, *, pool_size: int = 100, keep_alive: bool = True,
+                 timeout: Union[float, Tuple[float, float]] = (5, 30),
+                 api_url: str = 'https://api.vk.com/method/', session: Optional[aiohttp.ClientSession] = None,
+                 execute_limit: int = 25, token_type: str = 'user', rate: Optional[float] = None,
+                 burst: Optional[int] = None, flood_retries: int = 5, rate_limiter: Optional[RateLimiter] = None,
+                 page_workers: int = 4, cache: Optional[ResponseCache] = None,
+                 foaf_url: str = 'https://vk.com/foaf.php'):
+        """
+        Параметры те же, что у VkAPI. Сессия aiohttp создается при первом запросе,
+        тк ей нужен запущенный event loop
+        """
+
+        super().__init__(token, timeout=timeout, api_url=api_url, execute_limit=execute_limit,
+                         token_type=token_type, rate=rate, burst=burst, flood_retries=flood_retries,
+                         rate_limiter=rate_limiter, page_workers=page_workers, cache=cache, foaf_url=foaf_url)
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self._session = session
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            connect, read = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+            connector = aiohttp.TCPConnector(limit=self.pool_size, force_close=not self.keep_alive)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read))
+        return self._session
+
+    async def close(self) -> None:
+        """
+        Закрывает все соединения пула
+        """
+
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _send(self, method, params) -> dict:
+        url = self.api_url + method
+        params = {key: str(value) for key, value in params.items()}
+        if method == 'execute':
+            request = self.session.post(url, data=params)
+        else:
+            request = self.session.get(url, params=params)
+
+        async with request as response:
+            if response.status != http.HTTPStatus.OK:
+                raise RequestFailed('Код ответа: {}'.format(response.status))
+            return await response.json(content_type=None)
+
+    async def _call(self, method, params) -> dict:
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire_async()
+            content = await self._send(method, params)
+
+            delay = self._flood_delay(content, attempt)
+            if delay is None:
+                return content
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _make_request(self, method, params, cached: bool = True) -> Optional[Union[dict, list]]:
+        response = self._cache_get(method, params) if cached else MISSING
+        if response is not MISSING:
+            return response
+
+        content = await self._call(method, self._prepare_params(params))
+        response = self._parse_content(method, params, content)
+        self._cache_set(method, params, response)
+        return response
+
+    # ПАКЕТНЫЕ ЗАПРОСЫ
+    async def execute(self, calls: Sequence[Tuple[str, dict]], cached: bool = True) -> list:
+        """
+        То же, что VkAPI.execute, но куски по execute_limit вызовов отправляются одновременно
+        """
+
+        chunks = await asyncio.gather(*(self._execute_chunk(chunk, cached)
+                                        for chunk in self._chunks(calls, self.execute_limit)))
+        return [result for chunk in chunks for result in chunk]
+
+    async def _execute_chunk(self, calls: Sequence[Tuple[str, dict]], cached: bool = True) -> list:
+        results = [self._cache_get(method, params) if cached else MISSING for method, params in calls]
+        missing = [i for i, result in enumerate(results) if result is MISSING]
+        if missing:
+            fetched = await self._execute_uncached([calls[i] for i in missing], cached)
+            for i, result in zip(missing, fetched):
+                results[i] = result
+                if not isinstance(result, RequestFailed):
+                    self._cache_set(*calls[i], result)
+        return results
+
+    async def _execute_uncached(self, calls: Sequence[Tuple[str, dict]], cached: bool = True) -> list:
+        if len(calls) == 1:
+            method, params = calls[0]
+            try:
+                return [await self._make_request(method, dict(params), cached)]
+            except RequestFailed as e:
+                return [e]
+
+        content = await self._call('execute', self._prepare_params({'code': self._execute_code(calls)}))
+        response = self._parse_content('execute', {}, content)
+        return self._split_execute(calls, response, content.get('execute_errors', []))
+
+    def batch(self) -> AsyncVkBatch:
+        """
+        Возвращает пакет, в который можно складывать вызовы методов, см. VkAPI.batch
+        """
+
+        return AsyncVkBatch(self)
+
+    async def _paginate(self, method, params, page_size: int, items_key: str = 'items'):
+        params = dict(params, count=page_size, offset=params.get('offset', 0))
+        response = await self._make_request(method, dict(params))
+        yield response.get(items_key, [])
+
+        async for result in self._execute_pages(self._page_calls(method, params, page_size, response)):
+            yield result.get(items_key, [])
+
+    async def _execute_pages(self, calls, cached: bool = True):
+        """
+        Выполняет вызовы пачками через execute, не более page_workers пачек одновременно,
+        и отдает результаты по порядку
+        """
+
+        pending = deque()
+        try:
+            for chunk in self._chunks(calls, self.execute_limit):
+                pending.append(asyncio.ensure_future(self._execute_chunk(chunk, cached)))
+                if len(pending) < self.page_workers:
+                    continue
+                for result in await pending.popleft():
+                    if isinstance(result, RequestFailed):
+                        raise result
+                    yield result
+
+            while pending:
+                for result in await pending.popleft():
+                    if isinstance(result, RequestFailed):
+                        raise result
+                    yield result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _collect(self, method, params, page_size: int) -> list:
+        items = []
+        async for page in self._paginate(method, params, page_size):
+            items.extend(page)
+        return items
+
+    async def _get_user_id(self, domain) -> int:
+        user_id = (await self.resolve_user_ids([domain])).get(str(domain))
+        if user_id is None:
+            raise NoSuchUser(f"User name {domain} doesn't exist")
+        return user_id
+
+    async def _get_group_id(self, domain) -> int:
+        group_id = (await self.resolve_group_ids([domain])).get(str(domain))
+        if group_id is None:
+            raise NoSuchGroup(f"Group name {domain} doesn't exist")
+        return group_id
+
+    async def resolve_user_ids(self, domains: Sequence) -> dict:
+        return await self._resolve('user', domains)
+
+    async def resolve_group_ids(self, domains: Sequence) -> dict:
+        return await self._resolve('group', domains)
+
+    async def _resolve(self, kind: str, domains: Sequence) -> dict:
+        chunks, calls = self._resolve_calls(kind, domains)
+        while chunks:
+            chunks = self._match_resolve_results(kind, chunks, await self.execute(calls))
+            calls = [self._resolve_call(kind, chunk) for chunk in chunks]
+        return self._known_ids(kind, domains)
+
+    async def get_user_name(self, domain) -> str:
+        response = await self._make_request('users.get', {'user_ids': domain})
+        return '{last_name} {first_name}'.format(**response[0])
+
+    async def get_group_name(self, domain) -> str:
+        response = await self._make_request('groups.getById', {'group_ids': domain})
+        return response[0]['name']
+
+    # СПИСКИ ПОЛЬЗОВАТЕЛЕЙ
+    async def get_friends(self, domain: str, fields: Sequence[str]) -> list:
+        return [friend async for page in self.iter_friends(domain, fields) for friend in page]
+
+    async def iter_friends(self, domain: str, fields: Sequence[str]):
+        params = {
+            'user_id': await self._get_user_id(domain),
+            'fields': ",".join(fields)
+        }
+        async for page in self._paginate('friends.get', params, 5000):
+            yield page
+
+    async def get_followers(self, domain, fields=''):
+        return [follower async for page in self.iter_followers(domain, fields) for follower in page]
+
+    async def iter_followers(self, domain, fields=''):
+        params = {
+            'user_id': await self._get_user_id(domain),
+            'fields': fields if isinstance(fields, str) else ','.join(fields)
+        }
+        async for page in self._paginate('users.getFollowers', params, 1000):
+            yield page
+
+    async def iter_members(self, domain, fields: Sequence[str] = tuple()):
+        params = {
+            'group_id': await self._get_group_id(domain),
+            'fields': ','.join(fields)
+        }
+        async for page in self._paginate('groups.getMembers', params, 1000):
+            yield page
+
+    async def get_subscriptions(self, domain: str, fields: Sequence[str]) -> Tuple[
+        Sequence[dict], Sequence[dict], Sequence[dict]]:
+        subscriptions = [item async for page in self.iter_subscriptions(domain, fields) for item in page]
+        return self._split_subscriptions(subscriptions)
+
+    async def iter_subscriptions(self, domain: str, fields: Sequence[str]):
+        params = {
+            'user_id': await self._get_user_id(domain),
+            'extended': 1,
+            'fields': ",".join(fields)
+        }
+        async for page in self._paginate('users.getSubscriptions', params, 200):
+            yield page
+
+    async def get_groups(self, domain: str, fields: Sequence[str] = tuple()):
+        params = {
+            'user_id': await self._get_user_id(domain),
+            'extended': 1,
+            'fields': ','.join(fields),
+            'count': 1000,
+            'offset': 0
+        }
+        response = await self._make_request('groups.get', params)
+        return response.get('items', [])
+
+    async def get_likes(self, owner_id, item_id):
+        params = {
+            'owner_id': owner_id,
+            'item_id': item_id,
+            'type': 'post'
+        }
+        return await self._collect('likes.getList', params, 1000)
+
+    # ФОТОГРАФИИ
+    async def get_albums(self, domain):
+        params = {
+            'owner_id': await self._get_user_id(domain),
+            'need_system': 1
+        }
+        response = await self._make_request('photos.getAlbums', params)
+        return [album['id'] for album in response.get('items', [])]
+
+    async def get_urls_from_album(self, domain, album_id):
+        params = {
+            'owner_id': await self._get_user_id(domain),
+            'album_id': album_id
+        }
+        return [self._photo_url(photo) for photo in await self._collect('photos.get', params, 1000)]
+
+    async def get_urls_of_all_photos(self, domain):
+        return [url async for url in self.iter_photo_urls(domain)]
+
+    async def iter_photo_urls(self, domain, jobs: int = 4):
+        """
+        Асинхронный генератор url всех фотографий пользователя или группы, см. VkAPI.iter_photo_urls
+
+        Альбомы перебираются в jobs задачах, страницы складываются в очередь на 2 * jobs штук:
+        если потребитель не успевает, задачи ждут
+        """
+
+        owner_id = await self._get_user_id(domain)
+        albums = iter([album for album in await self.get_albums(owner_id) if album != -9000])
+        pages = asyncio.Queue(maxsize=2 * jobs)
+        done = object()
+
+        async def worker():
+            try:
+                for album_id in albums:
+                    params = {'owner_id': owner_id, 'album_id': album_id}
+                    async for page in self._paginate('photos.get', params, 1000):
+                        await pages.put(page)
+            except Exception as e:
+                await pages.put(e)
+                return
+            await pages.put(done)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(jobs)]
+        try:
+            finished = 0
+            while finished < len(workers):
+                page = await pages.get()
+                if page is done:
+                    finished += 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    for photo in page:
+                        yield self._photo_url(photo)
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def get_photo_urls_from_comments(self, posts, timestamp=False):
+        return [url async for url in self.iter_photo_urls_from_comments(posts, timestamp)]
+
+    async def iter_photo_urls_from_comments(self, posts, timestamp=False):
+        async for comments in self.iter_comments(posts):
+            for url in self._photo_urls(comments, timestamp):
+                yield url
+
+    async def iter_comments(self, posts):
+        """
+        Асинхронный генератор списков комментариев, см. VkAPI.iter_comments
+        """
+
+        pending = deque()
+        try:
+            for calls in self._chunks(self._comment_calls(posts), self.execute_limit):
+                pending.append(asyncio.ensure_future(self._harvest_comments(calls)))
+                if len(pending) >= self.page_workers:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _harvest_comments(self, calls) -> list:
+        comments = []
+        while calls:
+            results = await self.execute(calls)
+            calls = [call for (_, params), result in zip(calls, results)
+                     for call in self._collect_comments(params, result, comments)]
+        return comments
+
+    # ВРЕМЯ
+    async def get_last_seen_time(self, domain, tz: Optional[tzinfo] = DEFAULT_TIMEZONE) -> datetime:
+        params = {
+            'user_ids': domain,
+            'fields': 'last_seen'
+        }
+        response = await self._make_request('users.get', params, cached=False)
+        if not response:
+            raise NoSuchUser(f"User name {domain} doesn't exist")
+        return self._last_seen_time(response[0], tz)
+
+    async def get_registration_time(self, domain) -> str:
+        created = await self._registration_time(await self._get_user_id(domain))
+        if created is None:
+            raise NoSuchUser(f"User name {domain} has no registration date")
+        return created
+
+    async def get_registration_times(self, domains: Sequence, jobs: int = 8, store=None):
+        """
+        То же, что VkAPI.get_registration_times (асинхронный генератор)
+
+        foaf.php запрашиваются окнами по jobs * 4 domain-ов, не более jobs одновременно
+        """
+
+        domains = [str(domain) for domain in domains]
+        ids = await self.resolve_user_ids(domains)
+        known = store.get_many(ids.values()) if store is not None else {}
+        semaphore = asyncio.Semaphore(jobs)
+
+        async def lookup(domain):
+            user_id = ids.get(domain)
+            if user_id is None:
+                return None, None, False
+            if user_id in known:
+                return user_id, known[user_id], False
+            async with semaphore:
+                return user_id, await self._registration_time(user_id), True
+
+        for chunk in self._chunks(domains, jobs * 4):
+            results = await asyncio.gather(*map(lookup, chunk))
+            if store is not None:
+                store.put_many([(user_id, created) for user_id, created, new in results if new])
+            for domain, (_, created, _) in zip(chunk, results):
+                yield domain, created
+
+    async def _registration_time(self, user_id: int) -> Optional[str]:
+        scanner = RegistrationScanner()
+        created = None
+        async with self.session.get(self.foaf_url, params={'id': user_id}) as response:
+            if response.status != http.HTTPStatus.OK:
+                raise RequestFailed('Код ответа: {}'.format(response.status))
+            async for chunk in response.content.iter_chunked(2 ** 12):
+                if created is None:
+                    created = scanner.feed(chunk)
+        return created
+
+    async def get_user(self, domain: str, fields: Sequence[str]):
+        params = {
+            'user_ids': domain,
+            'fields': ",".join(fields)
+        }
+        response = await self._make_request('users.get', params)
+        return response[0]
+
+    async def get_users(self, domains: Sequence, fields: Sequence[str] = tuple(), cached: bool = True) -> list:
+        _max_count = 1000  # максимальное кол-во domain-ов в одном запросе
+
+        domains = [str(domain) for domain in domains]
+        calls = [('users.get', {'user_ids': ','.join(chunk), 'fields': ','.join(fields)})
+                 for chunk in self._chunks(domains, _max_count)]
+
+        users = []
+        for result in await self.execute(calls, cached):
+            if isinstance(result, RequestFailed):
+                raise result
+            users.extend(result)
+        return users
+
+    async def get_extended_info(self, domain, fields=''):
+        response = await self._make_request('users.get', {'user_ids': domain, 'fields': fields})
+        return response[0]
+
+    async def get_gifts(self, domain):
+        params = {
+            'user_id': await self._get_user_id(domain),
+            'count': 100000
+        }
+        response = await self._make_request('gifts.get', params)
+        return response['items']
+
+    async def get_dogs(self, domains):
+        return self._dogs(await self.get_users(domains))
+
+    async def get_common_friends(self, domain_1, domain_2, mode=0):
+        user_id_2 = await self._get_user_id(domain_2)
+        common = (await self.get_mutual_friends(domain_1, [user_id_2])).get(user_id_2, [])
+
+        if mode == 1:
+            common = self._common_friends_info(await self.get_users(common, ('city', 'country', 'education')))
+
+        return common
+
+    async def get_mutual_friends(self, source, targets: Sequence) -> dict:
+        source_id = await self._get_user_id(source)
+        target_ids = list((await self.resolve_user_ids(targets)).values())
+
+        mutual = {}
+        fallback = []
+        calls = self._mutual_calls(source_id, target_ids)
+        for (_, params), result in zip(calls, await self.execute(calls)):
+            chunk = [int(target_id) for target_id in params['target_uids'].split(',')]
+            if isinstance(result, RequestFailed):
+                fallback.extend(chunk)
+            else:
+                mutual.update(self._parse_mutual(chunk, result))
+
+        if fallback:
+            source_friends = set(await self.get_friends(source_id, []))
+            for target_id, friends in zip(fallback, await self.get_friend_ids(fallback)):
+                mutual[target_id] = self._intersect_friends(source_friends, friends)
+
+        return mutual
+
+    async def get_friend_ids(self, user_ids: Sequence[int]) -> list:
+        """
+        Списки id друзей пользователей, см. VkAPI.get_friend_ids
+        """
+
+        calls = [('friends.get', {'user_id': user_id, 'count': 5000, 'offset': 0}) for user_id in user_ids]
+        friend_ids = []
+        for (_, params), result in zip(calls, await self.execute(calls)):
+            if isinstance(result, RequestFailed):
+                friend_ids.append([])
+                continue
+
+            friends = list(result.get('items', []))
+            for page in await self.execute(self._page_calls('friends.get', params, 5000, result)):
+                if not isinstance(page, RequestFailed):
+                    friends.extend(page.get('items', []))
+            friend_ids.append(friends)
+        return friend_ids
+
+    async def get_posts(self, domain, count=None, offset=0, start=None, end=None, cached=True):
+        """
+        Асинхронный генератор списков постов, см. VkAPI.get_posts
+        """
+        _max_count = 100  # максимально кол-во постов за 1 запрос
+
+        params = {
+            'domain': domain,
+            'extended': 1,
+            'offset': offset,
+            'count': _max_count
+        }
+
+        window = PostWindow(count, start, end)
+        if window.done:
+            return
+
+        first = await self._make_request('wall.get', dict(params), cached)
+        posts = window.feed(first['items'])
+        if posts:
+            yield posts
+        if window.done:
+            return
+
+        total = first['count']
+        lo, seek_end = self._post_window_bounds(first, offset, start, end)
+        if seek_end:
+            lo = await self._seek_posts(params, lo, total, lambda post: post['date'] <= end, cached)
+        hi = total
+        if start is not None:
+            hi = await self._seek_posts(params, lo, total, lambda post: post['date'] < start, cached)
+        if window.count is not None:
+            hi = min(hi, lo + window.count)
+
+        stop = min(hi + 1, total)
+        async for result in self._execute_pages(self._post_page_calls(params, lo, stop, _max_count), cached):
+            posts = window.feed(result['items'])
+            if posts:
+                yield posts
+            if window.done:
+                return
+
+        params['offset'] = max(lo, stop)
+        while not window.done:
+            response = await self._make_request('wall.get', dict(params), cached)
+            posts = response['items']
+            params['offset'] += len(posts)
+
+            posts = window.feed(posts)
+            if posts:
+                yield posts
+
+    async def _seek_posts(self, params: dict, lo: int, hi: int, predicate, cached: bool = True) -> int:
+        while lo < hi:
+            offsets, calls = self._probe_calls(params, lo, hi)
+            lo, hi = self._narrow(offsets, await self._execute_chunk(calls, cached), lo, hi, predicate)
+        return lo
@@ -0,0 +1,80 @@
+"""
+Объединение и пересечение списков друзей: множества HashableDict против RecordSet
+
+python -m benchmarks.bench_recordset [кол-во записей в списке] [кол-во списков]
+"""
+
+import random
+import sys
+import time
+
+from records import RecordSet
+
+
+class LegacyHashableDict(dict):
+    """
+    Прежний HashableDict: хеш только по набору ключей
+    """
+
+    def __hash__(self):
+        return hash(frozenset(self.keys()))
+
+
+def make_lists(size: int, count: int) -> list:
+    rng = random.Random(0)
+    universe = range(size * 2)
+    return [[{"id": user_id, "first_name": "Имя", "last_name": "Фамилия", "city": {"id": user_id % 100}}
+             for user_id in sorted(rng.sample(universe, size))]
+            for _ in range(count)]
+
+
+def bench(name: str, fold, lists) -> float:
+    start = time.perf_counter()
+    result = fold(lists)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {elapsed:8.3f} с  ({len(result)} записей)")
+    return elapsed
+
+
+def legacy_join(lists):
+    result = set(LegacyHashableDict(record) for record in lists[0])
+    for records in lists[1:]:
+        result |= set(LegacyHashableDict(record) for record in records)
+    return result
+
+
+def legacy_intersection(lists):
+    result = set(LegacyHashableDict(record) for record in lists[0])
+    for records in lists[1:]:
+        result &= set(LegacyHashableDict(record) for record in records)
+    return result
+
+
+def recordset_join(lists):
+    result = RecordSet(lists[0])
+    for records in lists[1:]:
+        result |= records
+    return result
+
+
+def recordset_intersection(lists):
+    result = RecordSet(lists[0])
+    for records in lists[1:]:
+        result &= records
+    return result
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    lists = make_lists(size, count)
+
+    print(f"{count} списка по {size} записей")
+    bench("HashableDict, объединение", legacy_join, lists)
+    bench("RecordSet, объединение", recordset_join, lists)
+    bench("HashableDict, пересечение", legacy_intersection, lists)
+    bench("RecordSet, пересечение", recordset_intersection, lists)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Сравнение запросов через requests.get и через пул соединений VkAPI
+
+python -m benchmarks.bench_session [кол-во запросов]
+"""
+
+import sys
+import time
+
+import requests
+
+from benchmarks.mock_server import MockVkServer
+from vk_api import VkAPI
+
+
+def bench_bare(api_url: str, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        requests.get(api_url + 'friends.get', params={'count': 1, 'total': 1}).json()
+    return n / (time.perf_counter() - start)
+
+
+def bench_pooled(api_url: str, n: int) -> float:
+    # без ограничения темпа: сравниваются только соединения
+    vkapi = VkAPI('token', api_url=api_url, rate=10 ** 6)
+    start = time.perf_counter()
+    for _ in range(n):
+        vkapi._make_request('friends.get', {'count': 1, 'total': 1})
+    rps = n / (time.perf_counter() - start)
+    vkapi.close()
+    return rps
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with MockVkServer() as server:
+        bare = bench_bare(server.api_url, n)
+        pooled = bench_pooled(server.api_url, n)
+
+    print(f'requests.get: {bare:.1f} запросов/с')
+    print(f'VkAPI (пул):  {pooled:.1f} запросов/с')
+    print(f'ускорение:    x{pooled / bare:.2f}')
+
+
+if __name__ == '__main__':
+    main()
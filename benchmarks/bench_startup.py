@@ -0,0 +1,93 @@
+"""
+Время холодного запуска CLI по командам
+
+Для каждой команды запускается отдельный процесс python main.py:
+--help (без токена) и короткая настоящая команда против локальной заглушки VK API
+(адреса подменяются через VK_API_URL и VK_FOAF_URL). Печатается медиана по нескольким запускам
+и кол-во модулей, загруженных при --help
+
+python -m benchmarks.bench_startup [кол-во запусков]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.mock_server import MockVkServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+
+# команда -> аргументы короткого запуска (None - только --help: заглушка не умеет нужные методы)
+COMMANDS = {
+    'friends': ['friends', '-I', '1'],
+    'subs': None,
+    'groups': None,
+    'followers': ['followers', '1'],
+    'mutual': ['mutual', '1', '2'],
+    'crawl': ['crawl', '-d', '1', '-o', '{tmp}/edges.tsv', '1'],
+    'dogs': ['dogs', '{tmp}/ids.txt'],
+    'graph': ['graph', '-a', '{tmp}/edges.tsv'],
+    'wall': ['wall', '-s', '{tmp}/posts.sqlite3', '1'],
+    'user': ['user', '1'],
+    'lastseen': ['lastseen', '1'],
+    # хранилище в памяти, чтобы каждый запуск скачивал даты заново
+    'registered': ['registered', '-s', ':memory:', *map(str, range(1, 51))],
+}
+
+# запускает main.py с --help в том же процессе и печатает в stderr размер sys.modules
+COUNT_MODULES = ('import sys, runpy; sys.argv = [{main!r}, {command!r}, "--help"]\n'
+                 'try:\n    runpy.run_path({main!r}, run_name="__main__")\n'
+                 'except SystemExit:\n    pass\n'
+                 'sys.stderr.write(str(len(sys.modules)))')
+
+
+def run(args, env) -> float:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + args, env=env, cwd=ROOT, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f'{" ".join(args)}: {result.stderr.decode(errors="replace")}')
+    return elapsed
+
+
+def median_ms(args, env, n: int) -> float:
+    return statistics.median(run(args, env) for _ in range(n)) * 1000
+
+
+def count_modules(command: str, env) -> int:
+    code = COUNT_MODULES.format(main=MAIN, command=command)
+    result = subprocess.run([sys.executable, '-c', code], env=env, cwd=ROOT, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE)
+    return int(result.stderr.decode().strip().splitlines()[-1])
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    bare_env = {key: value for key, value in os.environ.items() if not key.startswith('VK_')}
+
+    with MockVkServer(wall_size=200) as server, tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'ids.txt'), 'w') as f:
+            f.write('\n'.join(map(str, range(1, 2001))))
+        env = dict(bare_env, VK_TOKEN='token', VK_TOKEN_TYPE='service', VK_API_URL=server.api_url,
+                   VK_FOAF_URL=server.foaf_url, VK_POSTS=os.path.join(tmp, 'posts.sqlite3'))
+
+        interpreter = median_ms(['-c', 'pass'], bare_env, n)
+        print(f'интерпретатор без модулей: {interpreter:.0f} мс')
+        print(f'{"команда":<12} {"--help, мс":>11} {"модулей":>8} {"запуск, мс":>11}')
+        for command, args in COMMANDS.items():
+            help_ms = median_ms([MAIN, command, '--help'], bare_env, n)
+            modules = count_modules(command, bare_env)
+            if args is None:
+                run_ms = '-'
+            else:
+                run_ms = f'{median_ms([MAIN] + [arg.format(tmp=tmp) for arg in args], env, n):.0f}'
+            print(f'{command:<12} {help_ms:>11.0f} {modules:>8} {run_ms:>11}')
+
+
+if __name__ == '__main__':
+    main()
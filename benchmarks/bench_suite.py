@@ -0,0 +1,252 @@
+"""
+Набор бенчмарков против локальной заглушки VK API
+
+Для каждого сценария меряются время и пропускная способность (записей и запросов в секунду),
+перцентили задержки HTTP-запросов (до получения заголовков ответа) и пиковая память
+(tracemalloc, отдельным прогоном, чтобы не замедлять замеры времени). Заглушка работает
+в отдельном процессе, чтобы не делить с клиентом GIL и не попадать в замер памяти.
+Результат - JSON, который удобно сохранять и сравнивать между версиями
+
+python -m benchmarks.bench_suite [-o results.json] [--latency 0.02] [--rate-limit 20] [--flood-rate 0.01]
+                                 [--size 100000] [--repeat 3] [сценарии...]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import requests
+
+from benchmarks.mock_server import MockVkServer
+from vk_api import VkAPI, make_session
+
+FIELDS = ('sex', 'city', 'country', 'last_seen')
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Probe:
+    """
+    Подключается к сессии requests и запоминает задержку каждого ответа
+    """
+
+    def __init__(self, session):
+        self.latencies = []
+        session.hooks['response'].append(self._record)
+
+    def _record(self, response, *args, **kwargs):
+        self.latencies.append(response.elapsed.total_seconds())
+
+
+def _serve(options: dict, urls) -> None:
+    with MockVkServer(**options) as server:
+        urls.put(server.httpd.config['base_url'])
+        threading.Event().wait()
+
+
+class ServerProcess:
+    """
+    MockVkServer в отдельном процессе
+    """
+
+    def __init__(self, **options):
+        urls = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_serve, args=(options, urls), daemon=True)
+        self.process.start()
+        self.base_url = urls.get(timeout=10)
+        self.api_url = self.base_url + '/method/'
+
+    @property
+    def stats(self) -> dict:
+        return requests.get(self.base_url + '/stats').json()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.join()
+
+
+def friends(vkapi, server, args, tmp) -> int:
+    return len(vkapi.get_friends('1', FIELDS))
+
+
+def followers(vkapi, server, args, tmp) -> int:
+    return len(vkapi.get_followers('1', FIELDS))
+
+
+def subscriptions(vkapi, server, args, tmp) -> int:
+    _, _, subs = vkapi.get_subscriptions('1', ())
+    return len(subs)
+
+
+def posts(vkapi, server, args, tmp) -> int:
+    return sum(len(page) for page in vkapi.get_posts('1', cached=False))
+
+
+def _friends_sets(join: bool):
+    def scenario(vkapi, server, args, tmp) -> int:
+        import handlers
+
+        user_ids = [str(user_id) for user_id in range(1, args.users + 1)]
+        output = os.path.join(tmp, 'friends.ndjson')
+        get_vkapi = handlers.get_vkapi
+        handlers.get_vkapi = lambda: vkapi
+        try:
+            handlers.friends_handler(id_only=False, fields=','.join(FIELDS), human=False, user_ids=user_ids,
+                                     join=join, intersection=not join, output=output, stat=(), top=None, jobs=4,
+                                     fmt='ndjson')
+        finally:
+            handlers.get_vkapi = get_vkapi
+
+        # записей в результате объединения или пересечения
+        with open(output, 'rb') as f:
+            return sum(1 for _ in f)
+
+    return scenario
+
+
+def downloader(vkapi, server, args, tmp) -> int:
+    from downloader import Downloader
+
+    directory = tempfile.mkdtemp(dir=tmp)
+    loader = Downloader(directory, jobs=args.download_jobs, session=vkapi.session, dedup=False)
+    urls = (f'{server.base_url}/photos/bench_{i}.jpg' for i in range(args.photos))
+    return sum(result.status == 'downloaded' for result in loader.download_all(urls))
+
+
+SCENARIOS = {
+    'get_friends': friends,
+    'get_followers': followers,
+    'get_subscriptions': subscriptions,
+    'get_posts': posts,
+    'friends_join': _friends_sets(join=True),
+    'friends_intersection': _friends_sets(join=False),
+    'downloader': downloader,
+}
+
+
+def make_client(server, args) -> VkAPI:
+    session = make_session(pool_size=max(10, args.download_jobs))
+    return VkAPI('token', api_url=server.api_url, session=session, token_type='service', rate=args.client_rate)
+
+
+def run_scenario(name, server, args, tmp) -> dict:
+    scenario = SCENARIOS[name]
+    timings, latencies, items = [], [], 0
+    server_before = server.stats
+    for _ in range(args.repeat):
+        vkapi = make_client(server, args)
+        probe = Probe(vkapi.session)
+        start = time.perf_counter()
+        items = scenario(vkapi, server, args, tmp)
+        timings.append(time.perf_counter() - start)
+        latencies.extend(probe.latencies)
+        vkapi.close()
+    server_after = server.stats
+
+    peak = None
+    if args.memory:
+        vkapi = make_client(server, args)
+        tracemalloc.start()
+        scenario(vkapi, server, args, tmp)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        vkapi.close()
+
+    seconds = statistics.median(timings)
+    requests_per_run = len(latencies) / args.repeat
+    return {
+        'name': name,
+        'items': items,
+        'seconds': round(seconds, 4),
+        'seconds_all': [round(t, 4) for t in timings],
+        'items_per_second': round(items / seconds, 1) if seconds else None,
+        'requests': requests_per_run,
+        'requests_per_second': round(requests_per_run / seconds, 1) if seconds else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.5) * 1000, 2),
+            'p90': round(percentile(latencies, 0.9) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'max': round(max(latencies, default=0) * 1000, 2),
+        },
+        'peak_memory_mb': round(peak / 2 ** 20, 2) if peak is not None else None,
+        'server': {key: (server_after[key] - server_before[key]) / args.repeat for key in server_after},
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарки против локальной заглушки VK API')
+    parser.add_argument('scenarios', nargs='*', help=f'Сценарии: {", ".join(SCENARIOS)} (по умолчанию все)')
+    parser.add_argument('-o', '--output', help='Файл для JSON с результатами (по умолчанию stdout)')
+    parser.add_argument('--repeat', type=int, default=3, help='Сколько раз прогонять сценарий для замера времени')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='Не замерять пиковую память')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа заглушки, с')
+    parser.add_argument('--rate-limit', type=int, default=None, help='Лимит заглушки, запросов к API в секунду')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='Доля ответов с ошибкой 6')
+    parser.add_argument('--client-rate', type=float, default=None,
+                        help='Лимит клиента, запросов в секунду (по умолчанию - как у сервисного токена)')
+    parser.add_argument('--size', type=int, default=100000, help='Размер списков друзей, подписчиков и подписок')
+    parser.add_argument('--wall-size', type=int, default=20000, help='Кол-во постов на стене')
+    parser.add_argument('--users', type=int, default=4, help='Кол-во пользователей для join/intersection')
+    parser.add_argument('--photos', type=int, default=500, help='Кол-во фотографий для загрузчика')
+    parser.add_argument('--photo-size', type=int, default=2 ** 16, help='Размер фотографии, байт')
+    parser.add_argument('--download-jobs', type=int, default=8, help='Кол-во одновременных загрузок')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'неизвестные сценарии: {", ".join(unknown)}')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = args.scenarios or list(SCENARIOS)
+
+    server = ServerProcess(latency=args.latency, rate_limit=args.rate_limit, flood_rate=args.flood_rate,
+                           collection_size=args.size, friends_shift=args.size // 10, wall_size=args.wall_size,
+                           photo_size=args.photo_size)
+    results = []
+    with server, tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            result = run_scenario(name, server, args, tmp)
+            results.append(result)
+            latency = result['latency_ms']
+            memory = f"{result['peak_memory_mb']:.1f} МБ" if result['peak_memory_mb'] is not None else "-"
+            sys.stderr.write(f"{name:<22} {result['seconds']:8.3f} с {result['items_per_second'] or 0:>10.0f} зап./с  "
+                             f"{result['requests']:>6.0f} запр.  p50 {latency['p50']:.1f} мс  "
+                             f"p99 {latency['p99']:.1f} мс  память {memory}\n")
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'options': {key: value for key, value in vars(args).items() if key not in ('scenarios', 'output')},
+        },
+        'results': results,
+    }
+    data = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+"""
+Локальная заглушка VK API для бенчмарков
+
+Отвечает на запросы вида /method/<метод> синтетическими данными. Можно задать
+задержку ответа, лимит запросов в секунду и долю ответов с ошибкой 6 (как у VK
+при превышении лимита), а также размер списков друзей, подписчиков и подписок
+"""
+
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+
+def _friends_get(params):
+    """
+    Список из collection_size id подряд; у разных пользователей он сдвинут на (user_id % 10) * friends_shift
+    """
+
+    config = params['_config']
+    total = int(params.get('total', config['collection_size']))
+    offset = int(params.get('offset', 0))
+    count = int(params.get('count', 5000))
+    shift = int(params.get('user_id', 0) or 0) % 10 * config['friends_shift']
+    ids = range(offset + 1 + shift, min(offset + count, total) + 1 + shift)
+    if not params.get('fields'):
+        return {'count': total, 'items': list(ids)}
+    items = [{'id': i, 'first_name': 'Имя', 'last_name': 'Фамилия', 'sex': i % 3,
+              'city': {'id': i % 50 + 1, 'title': f'Город {i % 50 + 1}'},
+              'country': {'id': 1, 'title': 'Россия'},
+              'last_seen': {'time': 1600000000 + i, 'platform': i % 7 + 1},
+              'can_access_closed': True, 'is_closed': False}
+             for i in ids]
+    return {'count': total, 'items': items}
+
+
+FOAF_START = 1160000000  # страница с id N зарегистрирована в FOAF_START + N минут
+PRESENCE_PERIOD = 2  # онлайн пользователей меняется раз в 2 секунды
+
+
+def _user_id(domain: str) -> int:
+    """
+    Числовые domain-ы и idNNN - это сами id, остальные имена получают стабильный id
+    """
+
+    domain = domain[2:] if domain.startswith('id') and domain[2:].isdigit() else domain
+    return int(domain) if domain.isdigit() else zlib.crc32(domain.encode()) % 10 ** 8 + 1
+
+
+def _users_get(params):
+    ids = [_user_id(user_id) for user_id in str(params.get('user_ids', '1')).split(',') if user_id]
+    fields = str(params.get('fields', '')).split(',')
+    return [{'id': user_id, 'first_name': 'Имя', 'last_name': 'Фамилия',
+             **({'deactivated': 'deleted'} if user_id % 10 == 0 else
+                {'deactivated': 'banned'} if user_id % 25 == 1 else
+                _presence(user_id) if 'online' in fields or 'last_seen' in fields else {})}
+            for user_id in ids]
+
+
+def _presence(user_id: int) -> dict:
+    """
+    Онлайн меняется раз в PRESENCE_PERIOD секунд: пользователь в сети каждый пятый период
+    """
+
+    tick = int(time.time() // PRESENCE_PERIOD)
+    phase = (user_id + tick) % 5
+    return {'online': int(phase == 0),
+            'last_seen': {'time': (tick - phase) * PRESENCE_PERIOD + user_id % PRESENCE_PERIOD,
+                          'platform': user_id % 7 + 1}}
+
+
+def _users_get_subscriptions(params):
+    """
+    Подписки вперемешку: каждая третья - пользователь, остальные - сообщества
+    """
+
+    config = params['_config']
+    total = config['collection_size']
+    offset = int(params.get('offset', 0))
+    count = int(params.get('count', 20))
+    items = []
+    for i in range(offset + 1, min(offset + count, total) + 1):
+        if i % 3 == 0:
+            items.append({'id': i, 'type': 'profile', 'first_name': 'Имя', 'last_name': 'Фамилия'})
+        else:
+            items.append({'id': i, 'type': 'page', 'name': f'Сообщество {i}', 'screen_name': f'club{i}',
+                          'activity': f'Тематика {i % 20}'})
+    return {'count': total, 'items': items}
+
+
+def _friends_get_mutual(params):
+    """
+    Общие друзья - id, которые делятся и на source_uid, и на цель
+    """
+
+    source = int(params.get('source_uid', 1))
+    targets = [int(target) for target in str(params.get('target_uids', '')).split(',') if target]
+    return [{'id': target, 'common_friends': [i for i in range(1, 1001) if i % source == 0 and i % target == 0]}
+            for target in targets]
+
+
+def _groups_get_by_id(params):
+    ids = str(params.get('group_ids', params.get('group_id', '1'))).split(',')
+    return [{'id': _user_id(group_id), 'name': 'Сообщество', 'screen_name': group_id, 'type': 'page'}
+            for group_id in ids if group_id]
+
+
+def _photos_get_albums(params):
+    config = params['_config']
+    items = [{'id': -9000, 'title': 'Фотографии с пользователем'}]
+    items += [{'id': album_id, 'title': f'Альбом {album_id}', 'size': config['album_size']}
+              for album_id in range(1, config['albums'] + 1)]
+    return {'count': len(items), 'items': items}
+
+
+def _photos_get(params):
+    config = params['_config']
+    owner_id, album_id = params.get('owner_id', 1), params.get('album_id', 1)
+    offset = int(params.get('offset', 0))
+    count = int(params.get('count', 50))
+    ids = range(offset, min(offset + count, config['album_size']))
+    items = [{'id': i, 'owner_id': owner_id, 'album_id': album_id,
+              'sizes': [{'type': 'z', 'url': f"{config['base_url']}/photos/{owner_id}_{album_id}_{i}.jpg?size=z"}]}
+             for i in ids]
+    return {'count': config['album_size'], 'items': items}
+
+
+WALL_START = 1500000000  # пост с id N опубликован в WALL_START + N * WALL_INTERVAL
+WALL_INTERVAL = 600  # посты идут раз в 10 минут
+
+
+def _wall_get(params):
+    """
+    Стена из wall_size постов (id от 2 до wall_size + 1) по убыванию даты;
+    если pinned, первым идет закрепленный самый старый пост с id 1
+    """
+
+    config = params['_config']
+    offset = int(params.get('offset', 0))
+    count = int(params.get('count', 20))
+    total = config['wall_size'] + bool(config['pinned'])
+
+    items = []
+    for i in range(offset, min(offset + count, total)):
+        if config['pinned'] and i == 0:
+            items.append({'id': 1, 'date': WALL_START + WALL_INTERVAL, 'is_pinned': 1, 'text': 'Закреп'})
+            continue
+        post_id = config['wall_size'] + 1 - (i - bool(config['pinned']))
+        items.append({'id': post_id, 'date': WALL_START + post_id * WALL_INTERVAL, 'text': f'Пост {post_id}',
+                      'likes': {'count': config['likes']}, 'attachments': []})
+
+    response = {'count': total, 'items': items}
+    if params.get('extended'):
+        response.update(profiles=[], groups=[])
+    return response
+
+
+class _ApiError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def _comment(owner_id, post_id, comment_id, date):
+    attachments = []
+    if comment_id % 4 == 0:
+        attachments.append({'type': 'photo', 'photo': {'id': comment_id, 'date': date, 'sizes': [
+            {'type': 'z', 'url': f'https://example.com/photos/{owner_id}_{post_id}_{comment_id}.jpg'}]}})
+    return {'id': comment_id, 'owner_id': owner_id, 'post_id': post_id, 'date': date,
+            'text': f'Комментарий {comment_id}', 'attachments': attachments}
+
+
+def _wall_get_comments(params):
+    """
+    У поста N - (N % 7) * 60 комментариев, у комментария M - M % 25 ответов.
+    Комментарии к постам с id, кратным 13, закрыты (ошибка 212)
+    """
+
+    owner_id, post_id = int(params.get('owner_id', 1)), int(params['post_id'])
+    offset, count = int(params.get('offset', 0)), int(params.get('count', 10))
+    if post_id % 13 == 0:
+        raise _ApiError(212, 'Access to post comments denied')
+
+    if 'comment_id' in params:
+        parent = int(params['comment_id'])
+        replies = parent % 25
+        items = [_comment(owner_id, post_id, parent * 100 + i, WALL_START + i)
+                 for i in range(offset, min(offset + count, replies))]
+        return {'count': replies, 'current_level_count': replies, 'items': items}
+
+    total = post_id % 7 * 60
+    thread_items = int(params.get('thread_items_count', 0))
+    items = []
+    for i in range(offset, min(offset + count, total)):
+        comment = _comment(owner_id, post_id, post_id * 1000 + i + 1, WALL_START + i)
+        replies = comment['id'] % 25
+        thread = [_comment(owner_id, post_id, comment['id'] * 100 + j, WALL_START + j)
+                  for j in range(min(thread_items, replies))]
+        comment['thread'] = {'count': replies, 'items': thread}
+        items.append(comment)
+    return {'count': total + sum(item['id'] % 25 for item in items), 'current_level_count': total, 'items': items}
+
+
+METHODS = {
+    'friends.get': _friends_get,
+    'users.getFollowers': _friends_get,
+    'users.get': _users_get,
+    'users.getSubscriptions': _users_get_subscriptions,
+    'groups.getMembers': _friends_get,
+    'groups.getById': _groups_get_by_id,
+    'friends.getMutual': _friends_get_mutual,
+    'photos.getAlbums': _photos_get_albums,
+    'photos.get': _photos_get,
+    'wall.get': _wall_get,
+    'wall.getComments': _wall_get_comments,
+}
+
+_EXECUTE_CALL = re.compile(r'API\.([\w.]+)\((\{[^{}]*\})\)')
+
+
+def _execute(params):
+    """
+    Понимает только код вида return [API.method({...}), ...];
+    """
+
+    response, errors = [], []
+    for method, args in _EXECUTE_CALL.findall(params.get('code', '')):
+        handler = METHODS.get(method)
+        if handler is None:
+            response.append(False)
+            errors.append({'method': method, 'error_code': 3, 'error_msg': 'Unknown method passed'})
+        else:
+            try:
+                response.append(handler(dict(json.loads(args), _config=params['_config'])))
+            except _ApiError as e:
+                response.append(False)
+                errors.append({'method': method, 'error_code': e.code, 'error_msg': e.message})
+    return response, errors
+
+
+class _Throttle:
+    """
+    Лимит запросов в секунду (скользящее окно) и случайные ошибки 6
+    """
+
+    def __init__(self, rate_limit: Optional[int], flood_rate: float, seed: int):
+        self.rate_limit = rate_limit
+        self.flood_rate = flood_rate
+        self._random = random.Random(seed)
+        self._recent = deque()
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'rate_limited': 0, 'injected': 0}
+
+    def check(self) -> Optional[_ApiError]:
+        now = time.monotonic()
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.rate_limit:
+                while self._recent and now - self._recent[0] >= 1:
+                    self._recent.popleft()
+                if len(self._recent) >= self.rate_limit:
+                    self.stats['rate_limited'] += 1
+                    return _ApiError(6, 'Too many requests per second')
+                self._recent.append(now)
+            if self.flood_rate and self._random.random() < self.flood_rate:
+                self.stats['injected'] += 1
+                return _ApiError(6, 'Too many requests per second')
+        return None
+
+
+class MockVkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith('/photos/'):
+            self._photo(url.path)
+        elif url.path == '/foaf.php':
+            self._foaf(int(parse_qs(url.query).get('id', ['1'])[-1]))
+        elif url.path == '/stats':
+            self._send_json(self.server.throttle.stats)
+        else:
+            self._respond(url.path.rsplit('/', 1)[-1], parse_qs(url.query))
+
+    def _photo(self, path):
+        """
+        Фотография - псевдослучайные байты, зависящие только от пути; Range поддерживается
+        """
+
+        config = self.server.config
+        if config['latency']:
+            time.sleep(config['latency'])
+        size = config['photo_size']
+        body = (zlib.crc32(path.encode()).to_bytes(4, 'little') * (size // 4 + 1))[:size]
+        start = 0
+        if 'Range' in self.headers:
+            start = int(self.headers['Range'].split('=', 1)[1].split('-', 1)[0])
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def _foaf(self, user_id: int):
+        """
+        FOAF-профиль размером около 6 КБ, дата регистрации в середине; у удаленных страниц ее нет
+        """
+
+        created = time.strftime('%Y-%m-%dT%H:%M:%S+03:00', time.gmtime(FOAF_START + user_id * 60))
+        padding = ''.join(f'  <foaf:interest>Интерес {i}</foaf:interest>\n' for i in range(40))
+        body = ('<?xml version="1.0" encoding="windows-1251"?>\n<rdf:RDF>\n <foaf:Person>\n'
+                f'  <ya:publicAccess>allowed</ya:publicAccess>\n{padding}'
+                + (f'  <ya:created dc:date="{created}"/>\n' if user_id % 10 else '')
+                + f'{padding} </foaf:Person>\n</rdf:RDF>\n').encode('cp1251')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rdf+xml; charset=windows-1251')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        query = parse_qs(self.rfile.read(length).decode())
+        self._respond(urlparse(self.path).path.rsplit('/', 1)[-1], query)
+
+    def _respond(self, method, query):
+        params = {key: values[-1] for key, values in query.items()}
+        params['_config'] = config = self.server.config
+        if config['latency']:
+            time.sleep(config['latency'])
+
+        error = self.server.throttle.check()
+        if error is not None:
+            content = {'error': {'error_code': error.code, 'error_msg': error.message}}
+        elif method == 'execute':
+            response, errors = _execute(params)
+            content = {'response': response}
+            if errors:
+                content['execute_errors'] = errors
+        elif method in METHODS:
+            try:
+                content = {'response': METHODS[method](params)}
+            except _ApiError as e:
+                content = {'error': {'error_code': e.code, 'error_msg': e.message}}
+        else:
+            content = {'error': {'error_code': 3, 'error_msg': 'Unknown method passed'}}
+
+        self._send_json(content)
+
+    def _send_json(self, content):
+        body = json.dumps(content, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockVkServer:
+    """
+    Запускает заглушку в фоновом потоке
+
+    with MockVkServer() as server:
+        VkAPI('token', api_url=server.api_url)
+
+    latency - задержка каждого ответа в секундах (API и фотографии)
+    rate_limit - сколько запросов к API в секунду обслуживать, остальным - ошибка 6
+    flood_rate - доля запросов к API, на которые случайно отвечать ошибкой 6
+    collection_size - размер списков друзей, подписчиков, участников и подписок
+    friends_shift - на сколько сдвигать списки друзей разных пользователей
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, albums: int = 8, album_size: int = 300,
+                 photo_size: int = 2 ** 14, wall_size: int = 10000, pinned: bool = True, latency: float = 0.0,
+                 rate_limit: Optional[int] = None, flood_rate: float = 0.0, collection_size: int = 10000,
+                 friends_shift: int = 0, seed: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), MockVkHandler)
+        self.httpd.daemon_threads = True
+        host, port = self.httpd.server_address[:2]
+        self.httpd.config = {
+            'base_url': f'http://{host}:{port}',
+            'albums': albums,
+            'album_size': album_size,
+            'photo_size': photo_size,
+            'wall_size': wall_size,
+            'pinned': pinned,
+            'likes': 0,
+            'latency': latency,
+            'collection_size': collection_size,
+            'friends_shift': friends_shift,
+        }
+        self.httpd.throttle = _Throttle(rate_limit, flood_rate, seed)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/method/'
+
+    @property
+    def foaf_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/foaf.php'
+
+    @property
+    def stats(self) -> dict:
+        """
+        Счетчики запросов к API: всего, отклоненных по лимиту, с подмешанной ошибкой 6 (они же - GET /stats)
+        """
+
+        return dict(self.httpd.throttle.stats)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, Tuple
+
+from config import CACHE_TTL, CACHE_DEFAULT_TTL, CACHE_MAX_SIZE
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "vk-tools", "cache.sqlite3")
+
+# Возвращается из ResponseCache.get, если ответа нет в кеше
+MISSING = object()
+
+
+def open_db(path: str) -> Tuple[sqlite3.Connection, threading.Lock]:
+    """
+    Открывает базу SQLite для хранилищ (кеш ответов, посты, даты регистрации)
+
+    Каталог создается при необходимости. Соединение общее для потоков, поэтому
+    возвращается вместе с блокировкой, под которой нужно к нему обращаться.
+    Транзакции - явные (BEGIN/COMMIT), журнал - WAL
+    """
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db, threading.Lock()
+
+
+class ResponseCache:
+    """
+    Кеш ответов VK API в SQLite
+
+    Ключ - метод и параметры запроса (без access_token). Время жизни задается
+    для каждого метода (ttl, по умолчанию config.CACHE_TTL), при превышении
+    max_size байт удаляются записи, к которым дольше всего не обращались.
+    Бессрочные записи (ttl=None) в max_size не входят и не вытесняются,
+    а ответ, который один больше 90% max_size, не кешируется
+
+    refresh - не читать из кеша, а только обновлять его свежими ответами
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, ttl: Optional[Dict[str, Optional[int]]] = None,
+                 default_ttl: Optional[int] = CACHE_DEFAULT_TTL, max_size: int = CACHE_MAX_SIZE,
+                 refresh: bool = False):
+        self.path = path
+        self.ttl = dict(CACHE_TTL, **(ttl or {}))
+        self.default_ttl = default_ttl
+        self.max_size = max_size
+        self.refresh = refresh
+
+        self._db, self._lock = open_db(path)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                method TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires REAL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._size = self._transient_size()
+
+    def _transient_size(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses WHERE expires IS NOT NULL").fetchone()[0]
+
+    @staticmethod
+    def key(method: str, params: dict) -> str:
+        normalized = {str(key): str(value) for key, value in params.items() if key != "access_token"}
+        raw = method + "?" + json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get(self, method: str, params: dict) -> Any:
+        if self.refresh:
+            return MISSING
+
+        key = self.key(method, params)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires, size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return MISSING
+
+            value, expires, size = row
+            if expires is not None and expires < now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size -= size
+                return MISSING
+
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+
+        return json.loads(value)
+
+    def set(self, method: str, params: dict, value: Any) -> None:
+        ttl = self.ttl.get(method, self.default_ttl)
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+
+        key = self.key(method, params)
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data)
+
+        with self._lock:
+            row = self._db.execute("SELECT size, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] is not None:
+                self._size -= row[0]
+
+            if expires is not None and size > self.max_size * 0.9:
+                # такой ответ вытеснил бы весь кеш и был бы вытеснен сам при следующей записи
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return
+
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, method, data, size, expires, now))
+            if expires is not None:
+                self._size += size
+                if self._size > self.max_size:
+                    self._evict()
+
+    def _evict(self) -> None:
+        """
+        Удаляет просроченные записи, а затем самые старые по обращению,
+        пока кеш не станет меньше 90% от max_size. Бессрочные записи не трогает
+        """
+
+        self._db.execute("DELETE FROM responses WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+        self._size = self._transient_size()
+
+        target = self.max_size * 0.9
+        while self._size > target:
+            rows = self._db.execute("SELECT key, size FROM responses WHERE expires IS NOT NULL "
+                                    "ORDER BY accessed LIMIT 100").fetchall()
+            if not rows:
+                break
+            self._db.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key, _ in rows])
+            self._size -= sum(size for _, size in rows)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._size = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -1,12 +1,19 @@
 import click
 
 from fields import *
-from handlers import friends_handler, subscriptions_handler, groups_handler, lastseen_handler, user_handler
+
+# handlers (а с ним requests и клиент VK API) импортируется только при запуске команды,
+# чтобы --help и разбор аргументов не тратили на это время и работали без токена
 
 
 @click.group()
-def cli():
-    pass
+@click.option('--cache/--no-cache', help="Кешировать ответы VK API на диске (путь можно задать в VK_CACHE)",
+              default=False)
+@click.option('--refresh', help="Не брать ответы из кеша, а обновить их", is_flag=True, flag_value=True)
+def cli(cache, refresh):
+    if cache or refresh:
+        from handlers import configure_cache
+        configure_cache(refresh=refresh)
 
 
 @cli.command(name="friends")
@@ -18,10 +25,16 @@ def cli():
               help="Список общих друзей для все пользователей (по дефолту для 2х и более пользаков)", is_flag=True,
               flag_value=True, default=True)
 @click.option('-o', '--output', help="Выходной файл (по дефолту stdout)", default=None)
-@click.option('-s', '--stat', help="Статистика по друзьям", default=None,
-              type=click.Choice(["city", "c", "country", "co", "university", "u", "school", "s"]))
+@click.option('-s', '--stat', help="Статистика по друзьям: city (c), country (co), university (u), school (s) или путь "
+                                   "к полю (occupation.name, schools[].name); несколько через запятую, "
+                                   "перекрестная таблица через + (city+university)", multiple=True)
+@click.option('-t', '--top', help="Кол-во самых частых значений в статистике", default=None, type=click.IntRange(1))
+@click.option('-F', '--format', 'fmt', help="Формат вывода: JSON целиком или по записи в строке (NDJSON)",
+              default="json", type=click.Choice(["json", "ndjson"]))
+@click.option('--jobs', help="Кол-во пользователей, загружаемых одновременно", default=4, type=click.IntRange(1))
 @click.argument('user-ids', nargs=-1, required=True)
 def handler(*args, **kwargs):
+    from handlers import friends_handler
     friends_handler(*args, **kwargs)
 
 
@@ -33,8 +46,15 @@ def handler(*args, **kwargs):
               flag_value=True, default=True)
 @click.option('-h', '--human', help="Человекочитаемый JSON", is_flag=True, flag_value=True)
 @click.option('-o', '--output', help="Выходной файл (по дефолту stdout)", default=None)
+@click.option('-s', '--stat', help="Статистика по подпискам: путь к полю (activity, city.title, type); несколько "
+                                   "через запятую, перекрестная таблица через + (type+activity)", multiple=True)
+@click.option('-t', '--top', help="Кол-во самых частых значений в статистике", default=None, type=click.IntRange(1))
+@click.option('-F', '--format', 'fmt', help="Формат вывода: JSON целиком или по записи в строке (NDJSON)",
+              default="json", type=click.Choice(["json", "ndjson"]))
+@click.option('--jobs', help="Кол-во пользователей, загружаемых одновременно", default=4, type=click.IntRange(1))
 @click.argument('user-ids', nargs=-1, required=True)
 def handler(*args, **kwargs):
+    from handlers import subscriptions_handler
     subscriptions_handler(*args, **kwargs)
 
 
@@ -46,11 +66,107 @@ def handler(*args, **kwargs):
               flag_value=True, default=True)
 @click.option('-h', '--human', help="Человекочитаемый JSON", is_flag=True, flag_value=True)
 @click.option('-o', '--output', help="Выходной файл (по дефолту stdout)", default=None)
+@click.option('-s', '--stat', help="Статистика по группам: путь к полю (activity, city.title, type); несколько "
+                                   "через запятую, перекрестная таблица через + (type+activity)", multiple=True)
+@click.option('-t', '--top', help="Кол-во самых частых значений в статистике", default=None, type=click.IntRange(1))
+@click.option('-F', '--format', 'fmt', help="Формат вывода: JSON целиком или по записи в строке (NDJSON)",
+              default="json", type=click.Choice(["json", "ndjson"]))
+@click.option('--jobs', help="Кол-во пользователей, загружаемых одновременно", default=4, type=click.IntRange(1))
 @click.argument('user-ids', nargs=-1, required=True)
 def handler(*args, **kwargs):
+    from handlers import groups_handler
     groups_handler(*args, **kwargs)
 
 
+@cli.command(name="followers")
+@click.option('-g', '--group', help="Участники сообщества вместо подписчиков пользователя", is_flag=True,
+              flag_value=True)
+@click.option('-f', '--fields', help="Список параметров", default=",".join(followers_default_fields))
+@click.option('-h', '--human', help="Человекочитаемый JSON", is_flag=True, flag_value=True)
+@click.option('-o', '--output', help="Выходной файл (по дефолту stdout)", default=None)
+@click.option('-s', '--stat', help="Статистика по подписчикам: city (c), country (co), university (u), school (s) "
+                                   "или путь к полю (sex, last_seen.platform); несколько через запятую, "
+                                   "перекрестная таблица через + (city+sex)", multiple=True)
+@click.option('-t', '--top', help="Кол-во самых частых значений в статистике", default=None, type=click.IntRange(1))
+@click.option('-F', '--format', 'fmt', help="Формат вывода: JSON целиком или по записи в строке (NDJSON)",
+              default="json", type=click.Choice(["json", "ndjson"]))
+@click.argument('domain')
+def handler(*args, **kwargs):
+    from handlers import followers_handler
+    followers_handler(*args, **kwargs)
+
+
+@cli.command(name="mutual")
+@click.option('-o', '--output', help="Выходной файл (по дефолту stdout)", default=None)
+@click.option('-F', '--format', 'fmt', help="Формат вывода: JSON целиком или по записи в строке (NDJSON)",
+              default="json", type=click.Choice(["json", "ndjson"]))
+@click.argument('source')
+@click.argument('targets', nargs=-1, required=True)
+def handler(*args, **kwargs):
+    from handlers import mutual_handler
+    mutual_handler(*args, **kwargs)
+
+
+@cli.command(name="crawl")
+@click.option('-d', '--depth', help="Глубина обхода (кол-во шагов от исходных пользователей)", default=2,
+              type=click.IntRange(1))
+@click.option('--jobs', help="Кол-во пачек пользователей, загружаемых одновременно", default=4,
+              type=click.IntRange(1))
+@click.option('-o', '--output', help="Файл с ребрами графа (id<TAB>id друга)", required=True)
+@click.option('-c', '--checkpoint', help="Файл для сохранения состояния обхода", default=None)
+@click.option('-r', '--resume', help="Продолжить обход из checkpoint", is_flag=True, flag_value=True)
+@click.argument('seeds', nargs=-1, required=True)
+def handler(*args, **kwargs):
+    from handlers import crawl_handler
+    crawl_handler(*args, **kwargs)
+
+
+@cli.command(name="dogs")
+@click.option('-o', '--output', help="Файл для найденных страниц: id<TAB>deleted|banned (по дефолту stdout)",
+              default=None)
+@click.option('--jobs', help="Кол-во запросов execute (до 25000 id каждый), выполняемых одновременно", default=4,
+              type=click.IntRange(1))
+@click.option('-c', '--checkpoint', help="Файл для сохранения состояния проверки", default=None)
+@click.option('-r', '--resume', help="Продолжить проверку из checkpoint (вход должен быть тем же)", is_flag=True,
+              flag_value=True)
+@click.argument('input', type=click.File('r'), default='-')
+def handler(*args, **kwargs):
+    from handlers import dogs_handler
+    dogs_handler(*args, **kwargs)
+
+
+@cli.command(name="graph")
+@click.option('-o', '--output', help="Файл для экспорта графа", default=None)
+@click.option('-F', '--format', 'fmt', help="Формат экспорта: CSR (.npz), двоичный список ребер или GraphML",
+              default="npz", type=click.Choice(["npz", "edges", "graphml"]))
+@click.option('-a', '--analyze', help="Статистика графа: степени вершин и компоненты связности", is_flag=True,
+              flag_value=True)
+@click.option('-s', '--suggest', help="Пользователи с наибольшим кол-вом общих друзей с данным (id)", default=None,
+              type=int)
+@click.option('-t', '--top', help="Кол-во записей в топах", default=10, type=click.IntRange(1))
+@click.argument('edges')
+def handler(*args, **kwargs):
+    from handlers import graph_handler
+    graph_handler(*args, **kwargs)
+
+
+@cli.command(name="wall")
+@click.option('-s', '--store', help="Файл хранилища постов (по дефолту VK_POSTS или ~/.cache/vk-tools/posts.sqlite3)",
+              default=None)
+@click.option('-w', '--watch', help="Повторять синхронизацию каждые N секунд", default=None,
+              type=click.FloatRange(min=1))
+@click.option('--refresh-age', help="Насколько свежие посты (в секундах) перечитывать, чтобы подхватить правки и "
+                                    "лайки", default=24 * 3600, type=click.IntRange(0))
+@click.option('--refresh-every', help="Как часто (в секундах) перечитывать свежие посты", default=3600,
+              type=click.IntRange(0))
+@click.option('-o', '--output', help="Выходной файл для новых и изменившихся постов, NDJSON (по дефолту stdout)",
+              default=None)
+@click.argument('domains', nargs=-1, required=True)
+def handler(*args, **kwargs):
+    from handlers import wall_handler
+    wall_handler(*args, **kwargs)
+
+
 @cli.command(name="user")
 @click.option('-f', '--fields', help="Список параметров", default=",".join(friends_get_default_fields))
 @click.option('-h', '--human', help="Человекочитаемый JSON", is_flag=True, flag_value=True)
@@ -58,13 +174,38 @@ def handler(*args, **kwargs):
 @click.option('-s', '--save-pics', help="Сохранить фотографии пользователя", is_flag=True, flag_value=True)
 @click.option('-o', '--output', help="Выходной файл (по дефолту stdout)", default=None)
 @click.option('-p', '--picture-path', help="Папка с фотографиями со страницы", default=None)
+@click.option('--download-jobs', help="Кол-во фотографий, скачиваемых одновременно", default=8,
+              type=click.IntRange(1))
 @click.argument('user-id')
 def handler(*args, **kwargs):
+    from handlers import user_handler
     user_handler(*args, **kwargs)
 
 
 @cli.command(name="lastseen")
-@click.argument("user-id")
+@click.option('-i', '--input', help="Файл со списком id (несколько в строке через пробел или запятую)", default=None,
+              type=click.File('r'))
+@click.option('-w', '--watch', help="Следить за онлайном, опрашивая пользователей каждые N секунд", default=None,
+              type=click.FloatRange(min=1))
+@click.option('-o', '--output', help="Выходной файл; с --watch - журнал переходов, дописывается (по дефолту stdout)",
+              default=None)
+@click.option('--tz', help="Часовой пояс: смещение (+3, -04:30), UTC, имя (Europe/Moscow) или local", default="+3")
+@click.argument("user-ids", nargs=-1)
 def handler(*args, **kwargs):
+    from handlers import lastseen_handler
     lastseen_handler(*args, **kwargs)
 
+
+@cli.command(name="registered")
+@click.option('-i', '--input', help="Файл со списком id (несколько в строке через пробел или запятую)", default=None,
+              type=click.File('r'))
+@click.option('-o', '--output', help="Выходной файл: id<TAB>дата регистрации (по дефолту stdout)", default=None)
+@click.option('-s', '--store', help="Файл хранилища дат (по дефолту VK_REGISTRATIONS или "
+                                    "~/.cache/vk-tools/registrations.sqlite3)", default=None)
+@click.option('--jobs', help="Кол-во страниц foaf.php, загружаемых одновременно (не больше 10 - размера пула)",
+              default=8, type=click.IntRange(1, 10))
+@click.argument("user-ids", nargs=-1)
+def handler(*args, **kwargs):
+    from handlers import registered_handler
+    registered_handler(*args, **kwargs)
+
@@ -0,0 +1,38 @@
+from datetime import timedelta, timezone
+
+# Ограничения VK API на кол-во запросов в секунду для разных типов токенов
+# https://vk.com/dev/api_requests
+RATE_LIMITS = {
+    "user": 3,
+    "group": 20,
+    "service": 20,
+}
+
+# Коды ошибок VK API, после которых запрос нужно повторить, сбавив темп
+# 6 - слишком много запросов в секунду, 9 - слишком много однотипных действий
+FLOOD_ERROR_CODES = (6, 9)
+
+# Время жизни закешированных ответов VK API в секундах (None - хранить бессрочно)
+CACHE_DEFAULT_TTL = 60 * 60
+CACHE_TTL = {
+    "friends.get": 6 * 60 * 60,
+    "users.getFollowers": 6 * 60 * 60,
+    "users.getSubscriptions": 6 * 60 * 60,
+    "groups.get": 6 * 60 * 60,
+    "photos.getAlbums": 6 * 60 * 60,
+    "photos.get": 6 * 60 * 60,
+    "likes.getList": 10 * 60,
+    "wall.get": 5 * 60,
+    "wall.getComments": 5 * 60,
+    "users.get": 10 * 60,
+    # неизменяемые данные
+    "resolve.user": None,
+    "resolve.group": None,
+}
+CACHE_MAX_SIZE = 256 * 2 ** 20
+
+# Сколько секунд помнить, что у страницы нет даты регистрации (удалена или не существует)
+REGISTRATION_MISS_TTL = 7 * 24 * 60 * 60
+
+# Часовой пояс для времени последнего посещения, если не задан другой (Москва, UTC+3)
+DEFAULT_TIMEZONE = timezone(timedelta(hours=3))
@@ -0,0 +1,168 @@
+import time
+from array import array
+from bisect import bisect_left
+from typing import BinaryIO, Iterable, Optional, Sequence, TextIO, Tuple
+
+from resumable import Resumable
+from utils import map_concurrently
+
+
+class IdSet:
+    """
+    Компактное множество целых id
+
+    Основная часть хранится в отсортированном array('q') (8 байт на id),
+    новые id сначала копятся в обычном set и вливаются в массив пачками
+    """
+
+    def __init__(self, ids: Iterable[int] = (), buffer_size: int = 2 ** 16):
+        self._sorted = array("q")
+        self._buffer = set()
+        self.buffer_size = buffer_size
+        for user_id in ids:
+            self.add(user_id)
+
+    def add(self, user_id: int) -> None:
+        if user_id in self:
+            return
+        self._buffer.add(user_id)
+        if len(self._buffer) >= self.buffer_size:
+            self._merge()
+
+    def _merge(self) -> None:
+        """
+        Вливает буфер в массив за один линейный проход
+
+        Массив идет окнами по buffer_size id, каждое окно сортируется вместе с попавшими в него
+        новыми id (timsort сливает два готовых отрезка за линейное время). Обычными числами Python
+        в памяти бывает только одно окно, а не весь массив
+        """
+
+        if not self._buffer:
+            return
+
+        new_ids = sorted(self._buffer)
+        old = self._sorted
+        merged = array("q")
+        taken = 0  # сколько новых id уже влито
+        for start in range(0, len(old), self.buffer_size):
+            end = min(start + self.buffer_size, len(old))
+            until = bisect_left(new_ids, old[end], taken) if end < len(old) else len(new_ids)
+            window = old[start:end].tolist()
+            window.extend(new_ids[taken:until])
+            window.sort()
+            merged.fromlist(window)
+            taken = until
+        merged.fromlist(new_ids[taken:])
+
+        self._sorted = merged
+        self._buffer.clear()
+
+    def __contains__(self, user_id: int) -> bool:
+        if user_id in self._buffer:
+            return True
+        i = bisect_left(self._sorted, user_id)
+        return i < len(self._sorted) and self._sorted[i] == user_id
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._buffer)
+
+    def __getstate__(self):
+        self._merge()
+        return {"sorted": self._sorted, "buffer_size": self.buffer_size}
+
+    def __setstate__(self, state):
+        self._sorted = state["sorted"]
+        self._buffer = set()
+        self.buffer_size = state["buffer_size"]
+
+
+class FriendCrawler(Resumable):
+    """
+    Обход графа друзей в ширину от seeds на depth шагов
+
+    Ребра пишутся в output строками "id<TAB>id друга". Дружба взаимна, поэтому
+    ребро между двумя раскрытыми пользователями встречается в выводе дважды.
+    Друзья пользователей запрашиваются пачками через execute, до jobs пачек
+    одновременно. Состояние обхода раз в checkpoint_every секунд и при
+    прерывании сохраняется в checkpoint, откуда обход можно продолжить (resume)
+    """
+
+    # атрибуты, сохраняемые в checkpoint
+    _state = ("depth", "visited", "level", "frontier", "position", "next_frontier", "edges")
+
+    def __init__(self, vkapi, seeds: Sequence, depth: int = 2, jobs: int = 4, checkpoint: Optional[str] = None,
+                 checkpoint_every: float = 60):
+        self.vkapi = vkapi
+        self.depth = depth
+        self.jobs = jobs
+        self._init_checkpoint(checkpoint, checkpoint_every)
+
+        seed_ids = list(vkapi.resolve_user_ids(seeds).values())
+        self.visited = IdSet(seed_ids)
+        self.level = 0  # номер текущего шага
+        self.frontier = array("q", seed_ids)  # пользователи, друзей которых нужно получить на этом шаге
+        self.position = 0  # сколько пользователей frontier уже раскрыто
+        self.next_frontier = array("q")
+        self.edges = 0
+
+    @classmethod
+    def resume(cls, vkapi, checkpoint: str, jobs: int = 4, checkpoint_every: float = 60) -> 'FriendCrawler':
+        # seeds не разрешаются заново: все состояние обхода берется из checkpoint
+        crawler = cls.__new__(cls)
+        crawler.vkapi = vkapi
+        crawler.jobs = jobs
+        crawler._init_checkpoint(checkpoint, checkpoint_every)
+        crawler.load()
+        return crawler
+
+    def run(self, output: BinaryIO, progress: Optional[TextIO] = None) -> None:
+        """
+        Выполняет (или продолжает) обход, дописывая ребра в output
+
+        output - файл, открытый на дозапись в двоичном режиме ("ab"): при продолжении он обрезается
+        до размера на момент последнего сохранения, чтобы не было повторов
+        """
+
+        started = time.monotonic()
+        expanded = 0
+        with self._checkpointing(output):
+            while self.level < self.depth and self.frontier:
+                batch_size = self.vkapi.execute_limit
+                batches = [self.frontier[start:start + batch_size]
+                           for start in range(self.position, len(self.frontier), batch_size)]
+
+                for batch, friend_lists in map_concurrently(self._fetch, batches, self.jobs):
+                    self._consistent = False
+                    for user_id, friends in zip(batch, friend_lists):
+                        self._expand(user_id, friends, output)
+                    self.position += len(batch)
+                    self._consistent = True
+                    expanded += len(batch)
+
+                    if self._checkpoint_due():
+                        self._checkpoint(output)
+                        if progress:
+                            rate = expanded / (time.monotonic() - started)
+                            progress.write(f"шаг {self.level + 1}/{self.depth}: {self.position}/{len(self.frontier)}, "
+                                           f"всего {len(self.visited)} пользователей, "
+                                           f"{self.edges} ребер, {rate:.1f} польз./с\n")
+
+                self.level += 1
+                self.frontier, self.next_frontier = self.next_frontier, array("q")
+                self.position = 0
+
+    def _fetch(self, batch: Sequence[int]) -> Tuple[Sequence[int], list]:
+        return batch, self.vkapi.get_friend_ids(list(batch))
+
+    def _expand(self, user_id: int, friends: Sequence[int], output: BinaryIO) -> None:
+        output.write("".join(f"{user_id}\t{friend}\n" for friend in friends).encode())
+        self.edges += len(friends)
+
+        # друзья последнего шага уже не раскрываются, копить их незачем
+        last_level = self.level + 1 >= self.depth
+        for friend in friends:
+            if friend not in self.visited:
+                self.visited.add(friend)
+                if not last_level:
+                    self.next_frontier.append(friend)
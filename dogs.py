@@ -0,0 +1,88 @@
+import time
+from itertools import islice
+from typing import BinaryIO, Iterable, Iterator, List, Optional, TextIO
+
+from resumable import Resumable
+from utils import map_concurrently
+from vk_api import RequestFailed
+
+
+def batches(ids: Iterable[str], size: int) -> Iterator[List[str]]:
+    ids = iter(ids)
+    while True:
+        batch = list(islice(ids, size))
+        if not batch:
+            return
+        yield batch
+
+
+class DogScanner(Resumable):
+    """
+    Поиск удаленных и заблокированных страниц ("собак") в потоке id
+
+    id проверяются через users.get по 1000 штук, до execute_limit таких вызовов
+    в одном execute и до jobs execute одновременно. Найденные страницы пишутся
+    в output строками "id<TAB>deleted|banned". Состояние (сколько id входа проверено)
+    раз в checkpoint_every секунд и при прерывании сохраняется в checkpoint,
+    откуда проверку можно продолжить на том же входе (resume)
+    """
+
+    # атрибуты, сохраняемые в checkpoint
+    _state = ("position", "found")
+
+    users_per_call = 1000  # максимум id в одном users.get
+
+    def __init__(self, vkapi, jobs: int = 4, checkpoint: Optional[str] = None, checkpoint_every: float = 60):
+        self.vkapi = vkapi
+        self.jobs = jobs
+        self._init_checkpoint(checkpoint, checkpoint_every)
+
+        self.position = 0  # сколько id входа уже проверено
+        self.found = 0
+
+        self.checked = 0  # проверено за этот запуск
+        self._started = time.monotonic()
+
+    @classmethod
+    def resume(cls, vkapi, checkpoint: str, jobs: int = 4, checkpoint_every: float = 60) -> 'DogScanner':
+        scanner = cls(vkapi, jobs=jobs, checkpoint=checkpoint, checkpoint_every=checkpoint_every)
+        scanner.load()
+        return scanner
+
+    def run(self, ids: Iterable[str], output: BinaryIO, progress: Optional[TextIO] = None) -> None:
+        """
+        Проверяет ids (уже проверенные при прошлом запуске пропускаются), дописывая найденных в output
+
+        output - двоичный файл; если задан checkpoint, при продолжении он обрезается
+        до размера на момент последнего сохранения, чтобы не было повторов
+        """
+
+        ids = islice(ids, self.position, None)
+        execute_batches = batches(ids, self.users_per_call * self.vkapi.execute_limit)
+        with self._checkpointing(output):
+            for batch, dogs in map_concurrently(self._check, execute_batches, self.jobs):
+                self._consistent = False
+                output.write("".join(f"{user_id}\t{reason}\n" for user_id, reason in dogs).encode())
+                self.position += len(batch)
+                self.found += len(dogs)
+                self._consistent = True
+                self.checked += len(batch)
+
+                if self._checkpoint_due():
+                    self._checkpoint(output)
+                    if progress:
+                        progress.write(self.summary() + "\n")
+
+    def _check(self, batch: List[str]):
+        calls = [("users.get", {"user_ids": ",".join(chunk)}) for chunk in batches(batch, self.users_per_call)]
+        dogs = []
+        for result in self.vkapi.execute(calls):
+            if isinstance(result, RequestFailed):
+                raise result
+            dogs.extend((user["id"], user["deactivated"]) for user in result if user.get("deactivated"))
+        return batch, dogs
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self._started
+        rate = self.checked / elapsed if elapsed else 0
+        return f"проверено: {self.position}, найдено: {self.found}, {rate:.0f} id/с"
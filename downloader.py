@@ -0,0 +1,239 @@
+import hashlib
+import http
+import os
+import sys
+import threading
+import time
+from typing import Iterable, Iterator, NamedTuple, Optional, TextIO
+from urllib.parse import urlparse
+
+import requests
+
+from utils import map_concurrently
+from vk_api import make_session
+
+PART_SUFFIX = ".part"
+INDEX_NAME = ".hashes"
+
+
+class DownloadResult(NamedTuple):
+    url: str
+    path: str
+    status: str  # downloaded, resumed, exists, duplicate, failed
+    size: int = 0
+    error: Optional[str] = None
+
+
+def file_name(url: str) -> str:
+    """
+    Имя файла по url фотографии (последний сегмент пути, по умолчанию с расширением .jpg)
+    """
+
+    name = os.path.basename(urlparse(url).path) or "photo"
+    if not os.path.splitext(name)[1]:
+        name += ".jpg"
+    return name
+
+
+class Downloader:
+    """
+    Параллельное скачивание файлов в папку directory
+
+    - до jobs загрузок одновременно через одну сессию с пулом соединений;
+    - файл пишется во временный name.part и переименовывается только целиком скачанным;
+    - оборванная загрузка продолжается с места обрыва (заголовок Range), в т.ч. после перезапуска;
+    - уже скачанные файлы (по имени) не запрашиваются повторно, а файлы с уже
+      встречавшимся содержимым (sha1, индекс в directory/.hashes) не сохраняются;
+    - ответ с ошибкой HTTP файлом не становится.
+
+    Рабочая папка процесса не меняется, поэтому загрузчиками можно пользоваться из нескольких потоков
+    """
+
+    def __init__(self, directory: str, *, jobs: int = 8, session: Optional[requests.Session] = None,
+                 timeout=(5, 60), retries: int = 3, chunk_size: int = 2 ** 16, dedup: bool = True,
+                 progress: Optional[TextIO] = None, progress_every: float = 5):
+        self.directory = directory
+        self.jobs = jobs
+        self.session = session if session is not None else make_session(pool_size=jobs)
+        self.timeout = timeout
+        self.retries = retries
+        self.chunk_size = chunk_size
+        self.dedup = dedup
+        self.progress = progress
+        self.progress_every = progress_every
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._active = set()  # имена файлов, которые качаются прямо сейчас
+        self._hashes = self._load_index() if dedup else {}
+
+        self.counts = dict.fromkeys(("downloaded", "resumed", "exists", "duplicate", "failed"), 0)
+        self.bytes = 0
+        self._started = None
+        self.first_file = None  # через сколько секунд после начала готов первый файл
+        self._reported_at = 0
+
+    def _load_index(self) -> dict:
+        hashes = {}
+        path = os.path.join(self.directory, INDEX_NAME)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    digest, _, name = line.rstrip("\n").partition("\t")
+                    if os.path.exists(os.path.join(self.directory, name)):
+                        hashes[digest] = name
+        return hashes
+
+    def _remember(self, digest: str, name: str) -> Optional[str]:
+        """
+        Запоминает хеш содержимого; если такой уже есть, возвращает имя файла с ним
+        """
+
+        with self._lock:
+            if digest in self._hashes:
+                return self._hashes[digest]
+            self._hashes[digest] = name
+            with open(os.path.join(self.directory, INDEX_NAME), "a", encoding="utf-8") as f:
+                f.write(f"{digest}\t{name}\n")
+        return None
+
+    def download(self, url: str, name: Optional[str] = None) -> DownloadResult:
+        name = name or file_name(url)
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            return self._done(DownloadResult(url, path, "exists"))
+
+        with self._lock:
+            if name in self._active:
+                # тот же файл уже качается в другом потоке
+                return self._done(DownloadResult(url, path, "exists"))
+            self._active.add(name)
+
+        try:
+            return self._done(self._download(url, name, path))
+        finally:
+            with self._lock:
+                self._active.discard(name)
+
+    def _download(self, url: str, name: str, path: str) -> DownloadResult:
+        part = path + PART_SUFFIX
+        resumed = False
+        for attempt in range(self.retries + 1):
+            try:
+                size, digest, offset = self._fetch(url, part)
+                resumed = resumed or bool(offset)
+                break
+            except requests.HTTPError as e:
+                # ответ с ошибкой не повторяем и не храним
+                return DownloadResult(url, path, "failed", error=str(e))
+            except requests.RequestException as e:
+                # следующая попытка продолжит с уже скачанного
+                error = str(e)
+                if attempt < self.retries:
+                    time.sleep(min(2 ** attempt, 10))
+        else:
+            return DownloadResult(url, path, "failed", error=error)
+
+        if self.dedup:
+            original = self._remember(digest, name)
+            if original is not None and original != name:
+                os.remove(part)
+                return DownloadResult(url, os.path.join(self.directory, original), "duplicate", size)
+
+        os.replace(part, path)
+        return DownloadResult(url, path, "resumed" if resumed else "downloaded", size)
+
+    def _fetch(self, url: str, part: str):
+        """
+        Докачивает url в part, возвращает (размер, sha1, с какого байта продолжена загрузка)
+        """
+
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE and offset:
+                # part уже скачан целиком
+                return offset, self._hash_file(part).hexdigest(), offset
+            if response.status_code != http.HTTPStatus.PARTIAL_CONTENT:
+                # сервер не умеет Range или файл изменился - качаем заново
+                offset = 0
+                try:
+                    response.raise_for_status()
+                except requests.HTTPError:
+                    if os.path.exists(part):
+                        os.remove(part)
+                    raise
+
+            digest = self._hash_file(part) if offset and self.dedup else hashlib.sha1()
+            with open(part, "ab" if offset else "wb") as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    self._add_bytes(len(chunk))
+                size = f.tell()
+
+        return size, digest.hexdigest(), offset
+
+    def _hash_file(self, path: str):
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                digest.update(chunk)
+        return digest
+
+    def _add_bytes(self, size: int) -> None:
+        with self._lock:
+            self.bytes += size
+
+    def _done(self, result: DownloadResult) -> DownloadResult:
+        with self._lock:
+            self.counts[result.status] += 1
+            if self.first_file is None and self._started is not None:
+                self.first_file = time.monotonic() - self._started
+        if self.progress and time.monotonic() - self._reported_at >= self.progress_every:
+            self._reported_at = time.monotonic()
+            self.progress.write(self.summary() + "\n")
+        return result
+
+    def download_all(self, urls: Iterable[str]) -> Iterator[DownloadResult]:
+        """
+        Скачивает url из потока urls, результаты отдаются в том же порядке
+        """
+
+        if self._started is None:
+            self._started = time.monotonic()
+        yield from map_concurrently(self.download, urls, self.jobs)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started if self._started is not None else 0.0
+
+    def summary(self) -> str:
+        counts = self.counts
+        elapsed = self.elapsed
+        speed = self.bytes / elapsed if elapsed else 0
+        return (f"скачано: {counts['downloaded'] + counts['resumed']} (докачано {counts['resumed']}), "
+                f"уже были: {counts['exists']}, дубликаты: {counts['duplicate']}, ошибки: {counts['failed']}; "
+                f"{self.bytes / 2 ** 20:.1f} МБ за {elapsed:.1f} с ({speed / 2 ** 20:.2f} МБ/с), "
+                f"первый файл через {self.first_file or 0:.1f} с")
+
+
+def save_pictures(vkapi, user_id, path, jobs: int = 8, album_jobs: int = 4,
+                  progress: Optional[TextIO] = sys.stderr) -> bool:
+    """
+    Скачивает все фотографии пользователя в папку path (по умолчанию - папка с именем user_id)
+
+    Альбомы перебираются в album_jobs потоков, скачивание начинается с первой
+    полученной страницы фотографий. Возвращает True, если скачаны все файлы
+    """
+
+    downloader = Downloader(path or str(user_id), jobs=jobs, progress=progress)
+    failed = [result for result in downloader.download_all(vkapi.iter_photo_urls(user_id, album_jobs))
+              if result.status == "failed"]
+
+    if progress:
+        for result in failed:
+            progress.write(f"Загрузка провалилась: {result.url} ({result.error})\n")
+        progress.write(downloader.summary() + "\n")
+    return not failed
@@ -44,3 +44,10 @@ friends_get_default_fields = [
     "universities"
 ]
 
+
+followers_default_fields = [
+    "sex",
+    "city",
+    "country",
+    "last_seen"
+]
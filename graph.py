@@ -0,0 +1,210 @@
+"""
+Граф дружбы в виде разреженной матрицы смежности (CSR) и аналитика по нему
+
+Требует numpy
+"""
+
+from typing import Dict, Optional, TextIO
+
+import numpy as np
+
+
+class FriendGraph:
+    """
+    Неориентированный граф без петель и кратных ребер в формате CSR
+
+    ids - отсортированные id пользователей, вершина i соответствует ids[i];
+    соседи вершины i - indices[indptr[i]:indptr[i + 1]] (отсортированы)
+    """
+
+    def __init__(self, ids: np.ndarray, indptr: np.ndarray, indices: np.ndarray):
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def from_edges(cls, src: np.ndarray, dst: np.ndarray) -> 'FriendGraph':
+        """
+        Строит граф по парам id; направление, повторы и петли не важны
+        """
+
+        ids, inverse = np.unique(np.concatenate((src, dst)), return_inverse=True)
+        a, b = inverse[:len(src)], inverse[len(src):]
+
+        keep = a != b
+        a, b = a[keep], b[keep]
+        n = len(ids)
+        # ребро в обе стороны, кодируем пару одним числом: unique и дедуплицирует, и сортирует
+        keys = np.unique(np.concatenate((a * n + b, b * n + a)))
+        rows, cols = np.divmod(keys, n)
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        index_type = np.int32 if n < 2 ** 31 else np.int64
+        return cls(ids, indptr, cols.astype(index_type))
+
+    @classmethod
+    def from_tsv(cls, path: str) -> 'FriendGraph':
+        """
+        Читает ребра в формате crawl ("id<TAB>id друга" в строке)
+        """
+
+        pairs = np.fromfile(path, dtype=np.int64, sep=" ")
+        if len(pairs) % 2:
+            raise ValueError(f"{path}: нечетное кол-во id в списке ребер")
+        return cls.from_edges(pairs[0::2], pairs[1::2])
+
+    @classmethod
+    def load(cls, path: str) -> 'FriendGraph':
+        """
+        Загружает граф из .npz (см. save_npz) или списка ребер
+        """
+
+        if path.endswith(".npz"):
+            with np.load(path) as data:
+                return cls(data["ids"], data["indptr"], data["indices"])
+        return cls.from_tsv(path)
+
+    @property
+    def node_count(self) -> int:
+        return len(self.ids)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.indices) // 2
+
+    def degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def neighbours(self, node: int) -> np.ndarray:
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def node(self, user_id: int) -> int:
+        """
+        Номер вершины по id пользователя
+        """
+
+        i = np.searchsorted(self.ids, user_id)
+        if i == len(self.ids) or self.ids[i] != user_id:
+            raise KeyError(user_id)
+        return int(i)
+
+    def _edge_pairs(self):
+        """
+        Каждое ребро один раз: (i, j), i < j
+        """
+
+        rows = np.repeat(np.arange(self.node_count, dtype=self.indices.dtype), self.degrees())
+        upper = rows < self.indices
+        return rows[upper], self.indices[upper]
+
+    def save_npz(self, path: str, compressed: bool = True) -> None:
+        save = np.savez_compressed if compressed else np.savez
+        save(path, ids=self.ids, indptr=self.indptr, indices=self.indices)
+
+    def save_edges(self, path: str) -> None:
+        """
+        Двоичный список ребер: пары int64 (little-endian) id пользователей, каждое ребро один раз
+        """
+
+        rows, cols = self._edge_pairs()
+        np.column_stack((self.ids[rows], self.ids[cols])).astype("<i8").tofile(path)
+
+    def save_graphml(self, f: TextIO, chunk_size: int = 2 ** 16) -> None:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+                '<key id="vk_id" for="node" attr.name="vk_id" attr.type="long"/>\n'
+                '<graph id="friends" edgedefault="undirected">\n')
+
+        for start in range(0, self.node_count, chunk_size):
+            f.write("".join(f'<node id="n{i}"><data key="vk_id">{user_id}</data></node>\n'
+                            for i, user_id in enumerate(self.ids[start:start + chunk_size].tolist(), start)))
+
+        rows, cols = self._edge_pairs()
+        for start in range(0, len(rows), chunk_size):
+            f.write("".join(f'<edge source="n{i}" target="n{j}"/>\n'
+                            for i, j in zip(rows[start:start + chunk_size].tolist(),
+                                            cols[start:start + chunk_size].tolist())))
+
+        f.write("</graph>\n</graphml>\n")
+
+    def degree_distribution(self) -> Dict[int, int]:
+        """
+        {степень: кол-во вершин с такой степенью}
+        """
+
+        counts = np.bincount(self.degrees())
+        degrees = np.flatnonzero(counts)
+        return dict(zip(degrees.tolist(), counts[degrees].tolist()))
+
+    def common_neighbours(self, node: int) -> np.ndarray:
+        """
+        Кол-во общих соседей вершины node с каждой вершиной графа
+        """
+
+        friends = self.neighbours(node)
+        starts = self.indptr[friends]
+        lengths = self.indptr[friends + 1] - starts
+        # индексы всех соседей соседей одним массивом, без цикла по друзьям
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        friends_of_friends = self.indices[offsets + np.arange(lengths.sum())]
+        return np.bincount(friends_of_friends, minlength=self.node_count)
+
+    def suggest_friends(self, user_id: int, top: int = 10) -> Dict[int, int]:
+        """
+        {id: кол-во общих друзей} для top пользователей, еще не друживших с user_id
+        """
+
+        node = self.node(user_id)
+        common = self.common_neighbours(node)
+        common[node] = 0
+        common[self.neighbours(node)] = 0
+
+        candidates = np.flatnonzero(common)
+        if len(candidates) > top:
+            candidates = candidates[np.argpartition(-common[candidates], top - 1)[:top]]
+        candidates = candidates[np.argsort(-common[candidates], kind="stable")]
+        return dict(zip(self.ids[candidates].tolist(), common[candidates].tolist()))
+
+    def connected_components(self) -> np.ndarray:
+        """
+        Номер компоненты связности для каждой вершины (0 - самая большая)
+
+        Подвешивание корней по ребрам и сжатие путей целыми массивами, без обхода по вершинам
+        """
+
+        labels = np.arange(self.node_count, dtype=np.int64)
+        rows, cols = self._edge_pairs()
+        while True:
+            a, b = labels[rows], labels[cols]
+            differ = a != b
+            if not differ.any():
+                break
+            a, b = a[differ], b[differ]
+            # корень с большим номером подвешивается к меньшему, циклов не бывает
+            labels[np.maximum(a, b)] = np.minimum(a, b)
+            while True:
+                parents = labels[labels]
+                if np.array_equal(parents, labels):
+                    break
+                labels = parents
+
+        _, components, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+        order = np.argsort(-sizes, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        return rank[components]
+
+    def summary(self, top: Optional[int] = 10) -> dict:
+        degrees = self.degrees()
+        components = self.connected_components()
+        sizes = np.bincount(components)
+        return {
+            "nodes": self.node_count,
+            "edges": self.edge_count,
+            "max_degree": int(degrees.max(initial=0)),
+            "mean_degree": float(degrees.mean()) if self.node_count else 0.0,
+            "degree_distribution": self.degree_distribution(),
+            "components": len(sizes),
+            "largest_components": sizes[:top].tolist(),
+        }
@@ -1,170 +1,378 @@
-import json
-from collections import defaultdict
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Iterable, Optional, Union
 
 import click
 
 from fields import *
+from records import RecordSet, UserSet
+from stats import Stats
 from utils import *
-from vk_api import VkAPI
 
-vkapi = VkAPI(os.environ["VK_TOKEN"])
+# Модули с запросами к VK (requests и т.д.) и отдельных команд импортируются
+# внутри обработчиков, а клиент создается при первом обращении (get_vkapi):
+# --help и команды без запросов к VK запускаются быстро и без токена
 
+_vkapi = None
+_cache_options = None  # параметры кеша ответов из configure_cache
 
-def friends_handler(*, id_only, fields, human, user_ids, join, intersection, output, stat):
-    if len(user_ids) == 1:
-        user_list = [user for user in vkapi.get_friends(user_ids[0], fields.split(","))]
-        for user_info in user_list:
-            clear_empty(user_info)
-    else:
-        if id_only:
-            friends_list = [set(user_info for user_info in vkapi.get_friends(user_id, fields.split(",")))
-                            for user_id in user_ids]
-        else:
-            friends_list = [set(HashableDict(user_info)
-                                for user_info in vkapi.get_friends(user_id, fields.split(",")))
-                            for user_id in user_ids]
-            for users in friends_list:
-                for user in users:
-                    clear_empty(user)
-                    dict_exclude(user, exclude_fields)
-
-        user_list = friends_list[0]
-        if join:
-            for i in range(1, len(friends_list)):
-                user_list |= friends_list[i]
+
+def get_vkapi():
+    """
+    Общий клиент VK API, создается при первом вызове
+
+    Токен берется из VK_TOKEN, тип токена - из VK_TOKEN_TYPE, адреса API и foaf.php можно подменить
+    через VK_API_URL и VK_FOAF_URL
+    """
+
+    global _vkapi
+    if _vkapi is None:
+        from vk_api import VkAPI
+
+        if "VK_TOKEN" not in os.environ:
+            raise click.ClickException("Не задан токен: переменная окружения VK_TOKEN")
+        urls = {"api_url": "VK_API_URL", "foaf_url": "VK_FOAF_URL"}
+        options = {option: os.environ[name] for option, name in urls.items() if os.environ.get(name)}
+        _vkapi = VkAPI(os.environ["VK_TOKEN"], token_type=os.environ.get("VK_TOKEN_TYPE", "user"), **options)
+        if _cache_options is not None:
+            from cache import ResponseCache, DEFAULT_PATH
+
+            _vkapi.cache = ResponseCache(os.environ.get("VK_CACHE", DEFAULT_PATH), **_cache_options)
+    return _vkapi
+
+
+def configure_cache(*, refresh):
+    """
+    Включает кеш ответов; он подключится к клиенту при его создании
+    """
+
+    global _cache_options
+    _cache_options = {"refresh": refresh}
+
+
+def fold_sets(sets: Iterable[Union[RecordSet, UserSet]], join: bool, intersection: bool) -> Union[RecordSet, UserSet]:
+    """
+    Объединяет или пересекает множества по мере их поступления
+    """
+
+    result = None
+    for items in sets:
+        if result is None:
+            result = items
+        elif join:
+            result |= items
         elif intersection:
-            for i in range(1, len(friends_list)):
-                user_list &= friends_list[i]
-        user_list = list(user_list)
-
-    if stat:
-        stat_dict = defaultdict(lambda: 0)
-        if stat in ("city", "c"):
-            for user in user_list:
-                stat_dict[user.get("city", {}).get("title", "Неизвестно")] += 1
-
-        if stat in ("university", "u"):
-            for user in user_list:
-                stat_dict[user.get("university_name", "Неизвестно")] += 1
-
-        if stat in ("country", "co"):
-            for user in user_list:
-                stat_dict[user.get("country", {}).get("title", "Неизвестно")] += 1
-
-        if stat in ("school", "s"):
-            for user in user_list:
-                for school in user.get("schools", []):
-                    stat_dict[school.get("name", "Неизвестно")] += 1
-
-        sorted_dict = {}
-        for key in (key for key, _ in sorted(list(stat_dict.items()), key=lambda x: x[1], reverse=True)):
-            sorted_dict[key] = stat_dict[key]
-
-        result = json.dumps(sorted_dict, indent=3, ensure_ascii=False)
-    else:
-        if not id_only:
-            for user in user_list:
-                dict_exclude(user, exclude_fields)
+            result &= items
+    return result
 
-        if human:
-            for user in user_list:
-                human_readable_user(user)
 
-        result = json.dumps(user_list, indent=3, ensure_ascii=False)
+def prepare_user(user: dict, human: bool) -> dict:
+    clear_empty(user)
+    dict_exclude(user, exclude_fields)
+    if human:
+        human_readable_user(user)
+    return user
+
+
+def with_stat_fields(fields: str, stats: Optional[Stats]) -> list:
+    """
+    Дополняет список полей теми, что нужны для подсчета статистики
+    """
+
+    fields = fields.split(",") if fields else []
+    if stats:
+        fields += sorted(stats.fields - set(fields))
+    return fields
+
+
+def write_stats(stats: Stats, output, fmt):
+    with open_output(output) as f:
+        write_records(stats.rows() if fmt == "ndjson" else stats.result(), f, fmt)
+
+
+def start_or_resume(task_class, *, output: Optional[str], checkpoint: Optional[str], resume: bool, jobs: int,
+                    **options):
+    """
+    Продолжает долгую операцию (FriendCrawler, DogScanner) из checkpoint или начинает новую
+
+    Новая операция начинается с пустого файла output
+    """
+
+    vkapi = get_vkapi()
+    if resume and checkpoint and os.path.exists(checkpoint):
+        return task_class.resume(vkapi, checkpoint, jobs=jobs)
 
     if output:
-        with open(output, "w") as f:
-            f.write(result)
-    else:
-        click.echo(result)
+        open(output, "wb").close()
+    return task_class(vkapi, jobs=jobs, checkpoint=checkpoint, **options)
+
+
+def run_resumable(run, output: Optional[str], checkpoint: Optional[str]) -> None:
+    """
+    Вызывает run(f), где f - output, открытый на дозапись, или stdout
 
+    При Ctrl+C сообщает, сохранено ли состояние, и завершает программу с кодом 130
+    """
+
+    f = open(output, "ab") if output else sys.stdout.buffer
+    try:
+        run(f)
+    except KeyboardInterrupt:
+        click.echo(f"Прервано, состояние сохранено в {checkpoint}" if checkpoint else "Прервано", err=True)
+        sys.exit(130)
+    finally:
+        if output:
+            f.close()
+
+
+def friends_handler(*, id_only, fields, human, user_ids, join, intersection, output, stat, top, jobs, fmt):
+    vkapi = get_vkapi()
+    stats = Stats.from_options(stat, top) if stat else None
+    if id_only and not stats:
+        # без полей friends.get возвращает только id
+        fields = ""
+    fields = with_stat_fields(fields, stats)
 
-def subscriptions_handler(*, fields, user_ids, join, intersection, output, human):
     if len(user_ids) == 1:
-        _, _, subs = vkapi.get_subscriptions(user_ids[0], fields.split(","))
+        pages = vkapi.iter_friends(user_ids[0], fields)
+        if stats:
+            for page in pages:
+                stats.update(page)
+            write_stats(stats, output, fmt)
+        else:
+            with open_output(output) as f:
+                write_pages(pages, f, fmt, None if id_only else lambda user: prepare_user(user, human))
+        return
+
+    vkapi.resolve_user_ids(user_ids)
+
+    def fetch(user_id):
+        # без полей друзья - голые id, им компактное хранилище не нужно
+        users = UserSet() if fields else RecordSet()
+        for page in vkapi.iter_friends(user_id, fields):
+            for user_info in page:
+                if isinstance(user_info, dict):
+                    clear_empty(user_info)
+                    dict_exclude(user_info, exclude_fields)
+                users.add(user_info)
+        return users
+
+    user_list = fold_sets(map_concurrently(fetch, user_ids, jobs), join, intersection)
+
+    if stats:
+        stats.update(user_list)
+        write_stats(stats, output, fmt)
+        return
+
+    with open_output(output) as f:
+        write_records(user_list if id_only else (prepare_user(user, human) for user in user_list), f, fmt)
+
+
+def subscriptions_handler(*, fields, user_ids, join, intersection, output, human, stat, top, jobs, fmt):
+    vkapi = get_vkapi()
+    stats = Stats.from_options(stat, top) if stat else None
+    fields = with_stat_fields(fields, stats)
+
+    def prepare(sub):
+        clear_empty(sub)
+        if human:
+            human_readable_sub(sub)
+        return sub
+
+    if len(user_ids) == 1:
+        pages = vkapi.iter_subscriptions(user_ids[0], fields)
+        if stats:
+            for page in pages:
+                stats.update(page)
+            write_stats(stats, output, fmt)
+        else:
+            with open_output(output) as f:
+                write_pages(pages, f, fmt, prepare)
+        return
+
+    vkapi.resolve_user_ids(user_ids)
+
+    def fetch(user_id):
+        _, _, subs = vkapi.get_subscriptions(user_id, fields)
         for sub in subs:
             clear_empty(sub)
-    else:
-        subs_list = []
-        for user_id in user_ids:
-            _, _, subs = vkapi.get_subscriptions(user_id, fields.split(","))
-            subs_list.append(set(HashableDict(sub) for sub in subs))
-
-        for subs in subs_list:
-            for sub in subs:
-                clear_empty(sub)
-
-        subs = subs_list[0]
-        if join:
-            for i in range(1, len(subs_list)):
-                subs |= subs_list[i]
-        elif intersection:
-            for i in range(1, len(subs_list)):
-                subs &= subs_list[i]
+        return UserSet(subs)
 
-        subs = list(subs)
-        for sub in subs:
-            dict_exclude(sub, exclude_fields)
+    subs = fold_sets(map_concurrently(fetch, user_ids, jobs), join, intersection)
+    if stats:
+        stats.update(subs)
+        write_stats(stats, output, fmt)
+        return
 
-    if human:
-        for sub in subs:
-            human_readable_sub(sub)
+    def prepare_folded(sub):
+        dict_exclude(sub, exclude_fields)
+        return prepare(sub)
 
-    result = json.dumps(subs, indent=3, ensure_ascii=False)
+    with open_output(output) as f:
+        write_records(map(prepare_folded, subs), f, fmt)
 
-    if output:
-        with open(output, "w") as f:
-            f.write(result)
-    else:
-        click.echo(result)
 
+def groups_handler(*, fields, human, user_ids, join, intersection, output, stat, top, jobs, fmt):
+    vkapi = get_vkapi()
+    stats = Stats.from_options(stat, top) if stat else None
+    fields = with_stat_fields(fields, stats)
 
-def groups_handler(*, fields, human, user_ids, join, intersection, output):
     if len(user_ids) == 1:
-        groups = vkapi.get_groups(user_ids[0], fields.split(","))
+        groups = vkapi.get_groups(user_ids[0], fields)
         for group in groups:
             clear_empty(group)
     else:
-        groups_list = [set(HashableDict(group)
-                           for group in vkapi.get_groups(user_id, fields.split(",")))
-                       for user_id in user_ids]
-        for groups in groups_list:
+        vkapi.resolve_user_ids(user_ids)
+
+        def fetch(user_id):
+            groups = vkapi.get_groups(user_id, fields)
             for group in groups:
                 clear_empty(group)
+            return UserSet(groups)
 
-        groups = groups_list[0]
-        if join:
-            for i in range(1, len(groups_list)):
-                groups |= groups_list[i]
-        elif intersection:
-            for i in range(1, len(groups_list)):
-                groups &= groups_list[i]
-
-        for group in groups:
+        def prepare(group):
             dict_exclude(group, exclude_fields)
-
-        if human:
-            for group in groups:
+            if human:
                 human_readable_group(group)
-        groups = tuple(groups)
+            return group
 
-    result = json.dumps(groups, indent=3, ensure_ascii=False)
+        groups = fold_sets(map_concurrently(fetch, user_ids, jobs), join, intersection)
+        if not stats:
+            groups = map(prepare, groups)
 
-    if output:
-        with open(output, "w") as f:
-            f.write(result)
-    else:
-        click.echo(result)
+    if stats:
+        stats.update(groups)
+        write_stats(stats, output, fmt)
+        return
+
+    with open_output(output) as f:
+        write_records(groups, f, fmt)
+
+
+def followers_handler(*, domain, group, fields, human, output, stat, top, fmt):
+    vkapi = get_vkapi()
+    stats = Stats.from_options(stat, top) if stat else None
+    fields = with_stat_fields(fields, stats)
+    pages = vkapi.iter_members(domain, fields) if group else vkapi.iter_followers(domain, fields)
+
+    if stats:
+        for page in pages:
+            stats.update(page)
+        write_stats(stats, output, fmt)
+        return
 
+    with open_output(output) as f:
+        write_pages(pages, f, fmt, lambda user: prepare_user(user, human))
 
-def user_handler(*, user_id, fields, output, human, group_list, save_pics, picture_path):
+
+def mutual_handler(*, source, targets, output, fmt):
+    vkapi = get_vkapi()
+    target_ids = vkapi.resolve_user_ids(targets)
+    mutual = vkapi.get_mutual_friends(source, list(target_ids.values()))
+
+    records = [{"target": domain, "id": target_id, "common_friends": mutual.get(target_id, [])}
+               for domain, target_id in target_ids.items()]
+
+    with open_output(output) as f:
+        write_records(records, f, fmt)
+
+
+def crawl_handler(*, seeds, depth, jobs, output, checkpoint, resume):
+    from crawler import FriendCrawler
+
+    crawler = start_or_resume(FriendCrawler, output=output, checkpoint=checkpoint, resume=resume, jobs=jobs,
+                              seeds=seeds, depth=depth)
+    started = time.monotonic()
+    run_resumable(lambda f: crawler.run(f, progress=sys.stderr), output, checkpoint)
+
+    elapsed = time.monotonic() - started
+    click.echo(f"Пользователей: {len(crawler.visited)}, ребер: {crawler.edges}, время: {elapsed:.1f} с", err=True)
+
+
+def dogs_handler(*, input, output, jobs, checkpoint, resume):
+    from dogs import DogScanner
+
+    if checkpoint and not output:
+        raise click.UsageError("Для --checkpoint нужен выходной файл (--output)")
+
+    scanner = start_or_resume(DogScanner, output=output, checkpoint=checkpoint, resume=resume, jobs=jobs)
+    run_resumable(lambda f: scanner.run(read_ids(input), f, progress=sys.stderr), output, checkpoint)
+
+    click.echo(scanner.summary(), err=True)
+
+
+def graph_handler(*, edges, output, fmt, analyze, suggest, top):
+    try:
+        from graph import FriendGraph
+    except ImportError:
+        raise click.ClickException("Для работы с графом нужен numpy (pip install numpy)")
+
+    started = time.monotonic()
+    graph = FriendGraph.load(edges)
+    click.echo(f"Граф загружен: {graph.node_count} вершин, {graph.edge_count} ребер, "
+               f"{time.monotonic() - started:.1f} с", err=True)
+
+    if output:
+        if fmt == "npz":
+            graph.save_npz(output)
+        elif fmt == "edges":
+            graph.save_edges(output)
+        else:
+            with open(output, "w", encoding="utf-8") as f:
+                graph.save_graphml(f)
+
+    report = {}
+    if analyze or not (output or suggest):
+        report.update(graph.summary(top))
+    if suggest:
+        try:
+            report["suggestions"] = graph.suggest_friends(suggest, top)
+        except KeyError:
+            raise click.ClickException(f"Пользователя {suggest} нет в графе")
+
+    if report:
+        write_records(report, sys.stdout)
+
+
+def wall_handler(*, domains, store, watch, refresh_age, refresh_every, output):
+    from wall_sync import PostStore, WallSync, DEFAULT_PATH as POSTS_PATH
+
+    vkapi = get_vkapi()
+    sync = WallSync(vkapi, PostStore(store or os.environ.get("VK_POSTS", POSTS_PATH)),
+                    refresh_age=refresh_age, refresh_every=refresh_every)
+
+    with open_output(output) as f:
+        try:
+            while True:
+                started = time.monotonic()
+                for domain in domains:
+                    new, updated = sync.sync(domain)
+                    write_records([{"domain": domain, "status": "new", "post": post} for post in new] +
+                                  [{"domain": domain, "status": "updated", "post": post} for post in updated],
+                                  f, "ndjson")
+                    f.flush()
+                    click.echo(f"{domain}: новых постов {len(new)}, изменившихся {len(updated)}", err=True)
+
+                if not watch:
+                    break
+                time.sleep(max(0.0, watch - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            sys.exit(130)
+
+
+def user_handler(*, user_id, fields, output, human, group_list, save_pics, picture_path, download_jobs):
+    from downloader import save_pictures
+
+    vkapi = get_vkapi()
     # if group_list:
     #     groups = vkapi.get_groups(user_id, fields.split(","))
     #     print(groups[0])
     # else:
     #     pass
-    if save_pics:
-        save_pictures(vkapi, user_id, picture_path)
+    if save_pics and not save_pictures(vkapi, user_id, picture_path, jobs=download_jobs):
+        click.echo("Скачаны не все файлы, повторный запуск докачает остальные", err=True)
 
     user_info = vkapi.get_user(user_id, fields.split(","))
     clear_empty(user_info)
@@ -172,18 +380,79 @@ def user_handler(*, user_id, fields, output, human, group_list, save_pics, pictu
     if human:
         human_readable_user(user_info)
 
-    result = json.dumps(user_info, indent=3, ensure_ascii=False)
-
-    if output:
-        with open(output, "w") as f:
-            f.write(result)
-    else:
-        click.echo(result)
-
-
-def lastseen_handler(user_id):
-    last_seen = vkapi.get_last_seen_time(user_id)
-    click.echo(last_seen.strftime('%H:%M:%S %d.%m.%Y'))
+    with open_output(output) as f:
+        write_records(user_info, f)
+
+
+def lastseen_handler(*, user_ids, input, watch, output, tz):
+    from presence import PresenceMonitor
+
+    try:
+        tz = parse_timezone(tz)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--tz")
+
+    user_ids = list(user_ids) + (list(read_ids(input)) if input else [])
+    if not user_ids:
+        raise click.UsageError("Не заданы пользователи")
+
+    vkapi = get_vkapi()
+
+    def last_seen(user: dict) -> str:
+        # у удаленных и заблокированных - deactivated, у скрывших время - "скрыто"
+        if user.get("last_seen"):
+            return datetime.fromtimestamp(user["last_seen"]["time"], tz).strftime('%H:%M:%S %d.%m.%Y')
+        return user.get("deactivated", "скрыто")
+
+    if not watch:
+        users = vkapi.get_users(user_ids, PresenceMonitor.fields, cached=False)
+        if len(user_ids) == 1:
+            if not users:
+                raise click.ClickException(f"Пользователь {user_ids[0]} не найден")
+            click.echo(last_seen(users[0]))
+            return
+        with open_output(output) as f:
+            for user in users:
+                f.write(f"{user['id']}\t{last_seen(user)}\n")
+        return
+
+    monitor = PresenceMonitor(vkapi, user_ids, interval=watch, tz=tz)
+    f = open(output, "a", encoding="utf-8") if output else sys.stdout
+    try:
+        monitor.watch(f, progress=sys.stderr)
+    except KeyboardInterrupt:
+        click.echo(monitor.summary(), err=True)
+        sys.exit(130)
+    finally:
+        if output:
+            f.close()
+
+
+def registered_handler(*, user_ids, input, output, store, jobs):
+    from registrations import RegistrationStore, DEFAULT_PATH as REGISTRATIONS_PATH
+
+    user_ids = list(user_ids) + (list(read_ids(input)) if input else [])
+    if not user_ids:
+        raise click.UsageError("Не заданы пользователи")
+
+    vkapi = get_vkapi()
+
+    store = RegistrationStore(store or os.environ.get("VK_REGISTRATIONS", REGISTRATIONS_PATH))
+    stored = len(store)
+    started = time.monotonic()
+    found = 0
+    try:
+        with open_output(output) as f:
+            for user_id, created in vkapi.get_registration_times(user_ids, jobs=jobs, store=store):
+                f.write(f"{user_id}\t{created or '-'}\n")
+                found += created is not None
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        fetched = len(store) - stored
+        store.close()
+        click.echo(f"дат регистрации: {found} из {len(user_ids)}, новых: {fetched}, "
+                   f"{time.monotonic() - started:.1f} с", err=True)
 
 
 def full_handler(**kwargs):
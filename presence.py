@@ -0,0 +1,143 @@
+import time
+from datetime import datetime, tzinfo
+from typing import Dict, Iterable, List, NamedTuple, Optional, TextIO
+
+from config import DEFAULT_TIMEZONE
+
+# https://vk.com/dev/using_lastseen
+PLATFORMS = {
+    1: "mobile",
+    2: "iphone",
+    3: "ipad",
+    4: "android",
+    5: "wphone",
+    6: "windows",
+    7: "web",
+}
+
+
+class Presence(NamedTuple):
+    online: bool
+    last_seen: Optional[int]  # timestamp, None - скрыто
+    platform: Optional[int]
+
+    @classmethod
+    def from_user(cls, user: dict) -> Optional['Presence']:
+        """
+        Состояние из ответа users.get (fields=online,last_seen); у удаленных и заблокированных - None
+        """
+
+        if user.get("deactivated"):
+            return None
+        last_seen = user.get("last_seen") or {}
+        return cls(bool(user.get("online")), last_seen.get("time"), last_seen.get("platform"))
+
+
+class Transition(NamedTuple):
+    user_id: int
+    event: str  # online, offline, seen (зашел и вышел между опросами)
+    time: int  # timestamp
+    platform: Optional[int]
+
+
+def transition(user_id: int, old: Optional[Presence], new: Presence, now: float) -> Optional[Transition]:
+    """
+    Переход между двумя опросами или None, если ничего не изменилось
+
+    Первое состояние пользователя (old=None) тоже считается переходом - это точка отсчета в журнале
+    """
+
+    if old is None or old.online != new.online:
+        event = "online" if new.online else "offline"
+    elif not new.online and new.last_seen != old.last_seen:
+        event = "seen"
+    else:
+        return None
+    return Transition(user_id, event, new.last_seen or int(now), new.platform)
+
+
+class PresenceMonitor:
+    """
+    Отслеживание онлайна многих пользователей
+
+    Каждый опрос - users.get по 1000 id, до execute_limit таких вызовов в одном execute
+    (мимо кеша ответов). В журнал пишутся только переходы строками
+    "время<TAB>id<TAB>online|offline|seen<TAB>платформа", время - в часовом поясе tz.
+
+    Опросы идут по расписанию раз в interval секунд. Если опрос затянулся, следующий
+    начинается сразу, а если отставание превысило interval - пропущенные опросы не
+    догоняются, а считаются в missed
+    """
+
+    fields = ("online", "last_seen")
+
+    def __init__(self, vkapi, user_ids: Iterable, interval: float = 60, tz: Optional[tzinfo] = DEFAULT_TIMEZONE):
+        self.vkapi = vkapi
+        self.user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+        self.interval = interval
+        self.tz = tz
+
+        self.state: Dict[int, Presence] = {}
+        self.polls = 0
+        self.changes = 0
+        self.missed = 0
+        self.lag = 0.0  # на сколько последний опрос начался позже расписания
+        self.max_lag = 0.0
+        self.duration = 0.0  # длительность последнего опроса
+
+    def poll(self) -> List[Transition]:
+        now = time.time()
+        transitions = []
+        for user in self.vkapi.get_users(self.user_ids, self.fields, cached=False):
+            presence = Presence.from_user(user)
+            if presence is None:
+                continue
+            change = transition(user["id"], self.state.get(user["id"]), presence, now)
+            self.state[user["id"]] = presence
+            if change:
+                transitions.append(change)
+
+        self.polls += 1
+        self.changes += len(transitions)
+        return transitions
+
+    def format(self, change: Transition) -> str:
+        moment = datetime.fromtimestamp(change.time, self.tz).astimezone(self.tz).isoformat(timespec="seconds")
+        return f"{moment}\t{change.user_id}\t{change.event}\t{PLATFORMS.get(change.platform, '')}\n"
+
+    def watch(self, log: TextIO, progress: Optional[TextIO] = None, count: Optional[int] = None) -> None:
+        """
+        Опрашивает пользователей по расписанию (count раз или бесконечно), дописывая переходы в log
+        """
+
+        started = time.monotonic()
+        slot = 0
+        while count is None or self.polls < count:
+            scheduled = started + slot * self.interval
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            begin = time.monotonic()
+            self.lag = begin - scheduled
+            self.max_lag = max(self.max_lag, self.lag)
+            transitions = self.poll()
+            log.write("".join(map(self.format, transitions)))
+            log.flush()
+            self.duration = time.monotonic() - begin
+            if progress:
+                progress.write(self.summary(len(transitions)) + "\n")
+
+            slot += 1
+            behind = time.monotonic() - (started + slot * self.interval)
+            if behind > self.interval:
+                skipped = int(behind // self.interval)
+                slot += skipped
+                self.missed += skipped
+
+    def summary(self, changes: Optional[int] = None) -> str:
+        online = sum(presence.online for presence in self.state.values())
+        changes = self.changes if changes is None else changes
+        return (f"опрос {self.polls}: пользователей {len(self.state)} (онлайн {online}), изменений {changes}; "
+                f"опрос занял {self.duration:.1f} с, отставание {self.lag:.1f} с (макс. {self.max_lag:.1f} с), "
+                f"пропущено опросов {self.missed}")
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Token bucket, общий для всех потоков и корутин, работающих с одним токеном
+
+    rate - кол-во запросов в секунду
+    burst - сколько запросов можно сделать подряд без ожидания
+
+    После ошибки "слишком много запросов" (penalize) темп снижается вдвое,
+    а после каждого успешного запроса (reward) плавно возвращается к rate
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None, min_rate: float = 0.5, recovery: float = 0.05):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.recovery = recovery
+        self.burst = burst if burst is not None else max(1, int(rate))
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """
+        Забирает один токен и возвращает, сколько секунд нужно подождать до его появления
+
+        Кол-во токенов может уйти в минус: так ждущие выстраиваются в очередь
+        и не толпятся в момент пополнения корзины
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self) -> None:
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def penalize(self) -> None:
+        """
+        Снижает темп после ответа VK о превышении лимита
+        """
+
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+
+    def reward(self) -> None:
+        """
+        Постепенно возвращает темп к исходному после успешного запроса
+        """
+
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * self.recovery)
@@ -0,0 +1,296 @@
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, Union
+
+Record = Union[dict, int]
+
+
+def record_key(record: Record) -> int:
+    """
+    Возвращает ключ записи VK: id пользователя или -id сообщества
+
+    Как и в owner_id у VK, сообщества получают отрицательный ключ, чтобы
+    не путаться с пользователями в смешанных списках (например, в подписках).
+    Голые id (списки без полей) являются ключами сами по себе
+    """
+
+    if not isinstance(record, dict):
+        return record
+    if record.get("type", "profile") == "profile":
+        return record["id"]
+    return -record["id"]
+
+
+def merge_record(target: dict, source: dict) -> dict:
+    """
+    Дополняет target полями из source
+
+    Поля, которые уже есть в target, не перезаписываются: побеждает запись,
+    пришедшая первой
+    """
+
+    for key, value in source.items():
+        target.setdefault(key, value)
+    return target
+
+
+class RecordSet:
+    """
+    Множество пользователей или сообществ, где запись определяется своим id
+
+    Поддерживает |= (объединение) и &= (пересечение) за линейное время.
+    Записи с одинаковым id сливаются через merge_record, порядок записей -
+    порядок их первого появления
+    """
+
+    def __init__(self, records: Iterable[Record] = ()):
+        self._records = {}
+        self.update(records)
+
+    def add(self, record: Record) -> None:
+        key = record_key(record)
+        existing = self._records.get(key)
+        if existing is None:
+            self._records[key] = record
+        elif isinstance(existing, dict) and isinstance(record, dict):
+            merge_record(existing, record)
+
+    def update(self, records: Iterable[Record]) -> None:
+        for record in records:
+            self.add(record)
+
+    def intersection_update(self, records: Iterable[Record]) -> None:
+        other = records if isinstance(records, RecordSet) else RecordSet(records)
+        kept = {}
+        for key, record in self._records.items():
+            match = other._records.get(key)
+            if match is None:
+                continue
+            if isinstance(record, dict) and isinstance(match, dict):
+                merge_record(record, match)
+            kept[key] = record
+        self._records = kept
+
+    def __ior__(self, other: Iterable[Record]) -> 'RecordSet':
+        self.update(other)
+        return self
+
+    def __iand__(self, other: Iterable[Record]) -> 'RecordSet':
+        self.intersection_update(other)
+        return self
+
+    def __contains__(self, record: Record) -> bool:
+        return record_key(record) in self._records
+
+    def __iter__(self) -> Iterator[Record]:
+        return iter(self._records.values())
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+class StringTable:
+    """
+    Интернированные строки: каждая уникальная строка хранится один раз,
+    а в колонках лежит только ее номер (0 - строки нет)
+    """
+
+    def __init__(self):
+        self._strings = [None]
+        self._index = {}
+
+    def add(self, string) -> int:
+        if string is None:
+            return 0
+        index = self._index.get(string)
+        if index is None:
+            index = self._index[string] = len(self._strings)
+            self._strings.append(sys.intern(string) if isinstance(string, str) else string)
+        return index
+
+    def __getitem__(self, index: int):
+        return self._strings[index]
+
+
+class UserStore:
+    """
+    Компактное хранилище пользователей (и сообществ) VK по колонкам
+
+    Частые поля (id, имя, пол, город, страна, last_seen, а у сообществ - название,
+    screen_name и тип) лежат в массивах array и таблицах интернированных строк,
+    поэтому на запись уходят десятки байт, а не килобайты, как у словаря ответа. Остальные поля
+    хранятся как есть, только у тех записей, где они есть.
+    Словари собираются заново лишь при обходе (to_dict, __iter__)
+    """
+
+    _missing = -1  # значение колонок с флагами для отсутствующего поля
+
+    def __init__(self, records: Iterable[dict] = ()):
+        self.ids = array("q")
+        self.first_names = array("l")
+        self.last_names = array("l")
+        self.sex = array("b")
+        self.city = array("l")
+        self.country = array("l")
+        self.last_seen = array("q")
+        self.platform = array("b")
+        self.is_closed = array("b")
+        self.can_access_closed = array("b")
+        self.deactivated = array("l")
+        self.group_names = array("l")
+        self.screen_names = array("l")
+        self.types = array("l")
+
+        self.names = StringTable()
+        self.places = {}  # (city|country, id) -> название
+        # прочие поля: номер записи -> (набор ключей, *значения); наборы ключей общие для всех записей
+        self.extra = {}
+        self._shapes = {}
+
+        self.extend(records)
+
+    def append(self, record: Union[dict, int]) -> None:
+        if not isinstance(record, dict):
+            record = {"id": record}
+        record = dict(record)
+
+        self.ids.append(record.pop("id"))
+        self.first_names.append(self.names.add(record.pop("first_name", None)))
+        self.last_names.append(self.names.add(record.pop("last_name", None)))
+        self.sex.append(record.pop("sex", self._missing))
+        self.city.append(self._add_place("city", record.pop("city", None)))
+        self.country.append(self._add_place("country", record.pop("country", None)))
+
+        last_seen = record.pop("last_seen", None) or {}
+        self.last_seen.append(last_seen.get("time", 0))
+        self.platform.append(last_seen.get("platform", 0))
+
+        self.is_closed.append(self._flag(record.pop("is_closed", None)))
+        self.can_access_closed.append(self._flag(record.pop("can_access_closed", None)))
+        self.deactivated.append(self.names.add(record.pop("deactivated", None)))
+        self.group_names.append(self.names.add(record.pop("name", None)))
+        self.screen_names.append(self.names.add(record.pop("screen_name", None)))
+        self.types.append(self.names.add(record.pop("type", None)))
+
+        if record:
+            shape = tuple(record)
+            shape = self._shapes.setdefault(shape, shape)
+            values = (sys.intern(value) if isinstance(value, str) else value for value in record.values())
+            self.extra[len(self.ids) - 1] = (shape, *values)
+
+    def extend(self, records: Iterable[dict]) -> None:
+        for record in records:
+            self.append(record)
+
+    def _add_place(self, kind: str, place) -> int:
+        if not place:
+            return 0
+        self.places[(kind, place["id"])] = sys.intern(place.get("title", ""))
+        return place["id"]
+
+    def _flag(self, value) -> int:
+        return self._missing if value is None else int(value)
+
+    def to_dict(self, index: int) -> dict:
+        record = {"id": self.ids[index]}
+        if self.first_names[index]:
+            record["first_name"] = self.names[self.first_names[index]]
+        if self.last_names[index]:
+            record["last_name"] = self.names[self.last_names[index]]
+        if self.group_names[index]:
+            record["name"] = self.names[self.group_names[index]]
+        if self.screen_names[index]:
+            record["screen_name"] = self.names[self.screen_names[index]]
+        if self.types[index]:
+            record["type"] = self.names[self.types[index]]
+        if self.deactivated[index]:
+            record["deactivated"] = self.names[self.deactivated[index]]
+        if self.sex[index] != self._missing:
+            record["sex"] = self.sex[index]
+        for kind, column in (("city", self.city), ("country", self.country)):
+            if column[index]:
+                record[kind] = {"id": column[index], "title": self.places[(kind, column[index])]}
+        if self.last_seen[index]:
+            record["last_seen"] = {"time": self.last_seen[index], "platform": self.platform[index]}
+        if self.is_closed[index] != self._missing:
+            # у пользователей is_closed - bool, у сообществ - 0, 1 или 2
+            is_group = record.get("type", "profile") != "profile"
+            record["is_closed"] = self.is_closed[index] if is_group else bool(self.is_closed[index])
+        if self.can_access_closed[index] != self._missing:
+            record["can_access_closed"] = bool(self.can_access_closed[index])
+        extra = self.extra.get(index)
+        if extra is not None:
+            record.update(zip(extra[0], extra[1:]))
+        return record
+
+    def __getitem__(self, index: int) -> dict:
+        return self.to_dict(index)
+
+    def __iter__(self) -> Iterator[dict]:
+        return (self.to_dict(index) for index in range(len(self.ids)))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class UserSet:
+    """
+    То же, что RecordSet, но записи лежат в компактном UserStore
+
+    Для объединения и пересечения больших списков: в памяти держатся колонки
+    UserStore и словарь ключ -> номер записи, а не словари ответов. Записи
+    с одинаковым ключом не сливаются, остается пришедшая первой: складываемые
+    списки запрошены с одними и теми же полями
+    """
+
+    def __init__(self, records: Iterable[dict] = ()):
+        self.store = UserStore()
+        self._rows: Dict[int, int] = {}  # ключ записи (record_key) -> номер в store
+        self.update(records)
+
+    def add(self, record: dict) -> None:
+        key = record_key(record)
+        if key not in self._rows:
+            self._rows[key] = len(self.store)
+            self.store.append(record)
+
+    def update(self, records: Iterable[dict]) -> None:
+        if isinstance(records, UserSet):
+            # записи берутся из чужого store, только если их еще нет
+            for key, row in records._rows.items():
+                if key not in self._rows:
+                    self._rows[key] = len(self.store)
+                    self.store.append(records.store.to_dict(row))
+            return
+
+        for record in records:
+            self.add(record)
+
+    def intersection_update(self, records: Iterable[dict]) -> None:
+        other = records if isinstance(records, UserSet) else UserSet(records)
+        self._rows = {key: row for key, row in self._rows.items() if key in other._rows}
+
+        # после сильного сужения выброшенные записи занимают большую часть store
+        if len(self._rows) < len(self.store) // 2:
+            store = UserStore()
+            for key, row in self._rows.items():
+                self._rows[key] = len(store)
+                store.append(self.store.to_dict(row))
+            self.store = store
+
+    def __ior__(self, other: Iterable[dict]) -> 'UserSet':
+        self.update(other)
+        return self
+
+    def __iand__(self, other: Iterable[dict]) -> 'UserSet':
+        self.intersection_update(other)
+        return self
+
+    def __contains__(self, record: dict) -> bool:
+        return record_key(record) in self._rows
+
+    def __iter__(self) -> Iterator[dict]:
+        return (self.store.to_dict(row) for row in self._rows.values())
+
+    def __len__(self) -> int:
+        return len(self._rows)
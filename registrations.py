@@ -0,0 +1,73 @@
+import os
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from cache import open_db
+from config import REGISTRATION_MISS_TTL
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "vk-tools", "registrations.sqlite3")
+
+
+class RegistrationStore:
+    """
+    Постоянное хранилище дат регистрации в SQLite
+
+    Дата регистрации страницы не меняется, поэтому записи не устаревают и не вытесняются
+    (в отличие от кеша ответов): каждую дату достаточно скачать один раз.
+    Страницы без даты (удаленные, несуществующие) тоже запоминаются, но только
+    на miss_ttl секунд - страницу могут восстановить
+    """
+
+    _max_variables = 500  # id в одном SELECT ... IN (...)
+
+    def __init__(self, path: str = DEFAULT_PATH, miss_ttl: float = REGISTRATION_MISS_TTL):
+        self.path = path
+        self.miss_ttl = miss_ttl
+        self._db, self._lock = open_db(path)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS registrations (
+                id INTEGER PRIMARY KEY,
+                created TEXT,
+                checked REAL NOT NULL
+            )
+        """)
+
+    def get_many(self, user_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        """
+        Известные даты регистрации {id: дата или None}; id, которых нет в хранилище, в словаре не будет
+        """
+
+        user_ids = list(dict.fromkeys(user_ids))
+        checked_after = time.time() - self.miss_ttl
+        found = {}
+        with self._lock:
+            for i in range(0, len(user_ids), self._max_variables):
+                chunk = user_ids[i:i + self._max_variables]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(self._db.execute(f"SELECT id, created FROM registrations WHERE id IN ({placeholders}) "
+                                              f"AND (created IS NOT NULL OR checked > ?)",
+                                              (*chunk, checked_after)).fetchall())
+        return found
+
+    def put_many(self, items: Iterable[Tuple[int, Optional[str]]]) -> None:
+        now = time.time()
+        items = [(user_id, created, now) for user_id, created in items]
+        if not items:
+            return
+
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany("INSERT OR REPLACE INTO registrations VALUES (?, ?, ?)", items)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM registrations WHERE created IS NOT NULL").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,81 @@
+import os
+import pickle
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Optional
+
+
+class Resumable:
+    """
+    Долгая операция с выводом в файл, состояние которой можно сохранить и продолжить
+
+    Наследник перечисляет сохраняемые атрибуты в _state и вызывает _init_checkpoint
+    в __init__. Вместе с состоянием сохраняется размер вывода (output_size): при
+    продолжении вывод обрезается до него, чтобы не было повторов
+    """
+
+    # атрибуты, сохраняемые в checkpoint (кроме output_size)
+    _state = ()
+
+    def _init_checkpoint(self, checkpoint: Optional[str], checkpoint_every: float) -> None:
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.output_size = 0  # размер вывода на момент сохранения состояния
+        self._saved_at = time.monotonic()
+        self._consistent = True  # False, пока пачка применена к состоянию частично
+
+    def load(self) -> None:
+        """
+        Восстанавливает состояние из checkpoint
+        """
+
+        with open(self.checkpoint, "rb") as f:
+            self.__dict__.update(pickle.load(f))
+        self._saved_at = time.monotonic()
+
+    def save(self) -> None:
+        """
+        Атомарно сохраняет состояние в checkpoint
+        """
+
+        if not self.checkpoint:
+            return
+
+        state = {key: getattr(self, key) for key in self._state + ("output_size",)}
+        tmp = self.checkpoint + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.checkpoint)
+        self._saved_at = time.monotonic()
+
+    def _checkpoint_due(self) -> bool:
+        return time.monotonic() - self._saved_at >= self.checkpoint_every
+
+    def _checkpoint(self, output: BinaryIO) -> None:
+        output.flush()
+        if self.checkpoint:
+            self.output_size = output.tell()
+        self.save()
+
+    @contextmanager
+    def _checkpointing(self, output: BinaryIO):
+        """
+        Обрезает output до сохраненного размера, а по выходу (и при Ctrl+C) сохраняет состояние
+
+        Без checkpoint вывод не обрезается и не перематывается: это может быть stdout.
+        Если прерывание пришло, пока _consistent=False, состояние не сохраняется:
+        останется прошлое, а лишний вывод будет обрезан при продолжении
+        """
+
+        if self.checkpoint:
+            output.truncate(self.output_size)
+            output.seek(self.output_size)
+
+        self._consistent = True
+        try:
+            yield
+        except KeyboardInterrupt:
+            if self._consistent:
+                self._checkpoint(output)
+            raise
+        self._checkpoint(output)
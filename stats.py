@@ -0,0 +1,159 @@
+from collections import Counter
+from itertools import product
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+UNKNOWN = "Неизвестно"
+
+# короткие имена разрезов: (путь к значению, поле VK API, без которого значения не будет)
+STAT_ALIASES = {
+    "city": ("city.title", "city"),
+    "c": ("city.title", "city"),
+    "country": ("country.title", "country"),
+    "co": ("country.title", "country"),
+    "university": ("university_name", "education"),
+    "u": ("university_name", "education"),
+    "school": ("schools[].name", "schools"),
+    "s": ("schools[].name", "schools"),
+}
+
+# разделитель измерений перекрестной таблицы: "city+university"
+CROSS_SEPARATOR = "+"
+
+
+def parse_path(path: str) -> List[Tuple[str, bool]]:
+    """
+    Разбирает путь вида "schools[].name" в [("schools", True), ("name", False)]
+
+    Второй элемент - является ли значение списком, по элементам которого нужно пройтись
+    """
+
+    steps = []
+    for part in path.split("."):
+        many = part.endswith("[]")
+        steps.append((part[:-2] if many else part, many))
+    return steps
+
+
+def extract(record: dict, steps: Sequence[Tuple[str, bool]]) -> list:
+    """
+    Значения записи по разобранному пути
+
+    Отсутствующее или пустое значение дает UNKNOWN, пустой список - ни одного значения
+    """
+
+    values = [record]
+    for key, many in steps:
+        found = []
+        for value in values:
+            value = value.get(key) if isinstance(value, dict) else None
+            if many:
+                found.extend(value or ())
+            else:
+                found.append(value)
+        values = found
+
+    return [UNKNOWN if value is None or value == "" else _hashable(value) for value in values]
+
+
+def _hashable(value):
+    if isinstance(value, dict):
+        return value.get("title", value.get("name", str(value)))
+    if isinstance(value, list):
+        return tuple(map(_hashable, value))
+    return value
+
+
+class Dimension:
+    """
+    Разрез статистики: одно поле или перекрестная таблица из нескольких
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.paths = []
+        self.fields = set()
+        for part in name.split(CROSS_SEPARATOR):
+            path, field = STAT_ALIASES.get(part, (part, None))
+            steps = parse_path(path)
+            self.paths.append(steps)
+            self.fields.add(field or steps[0][0])
+
+        self.counter = Counter()
+
+    @property
+    def is_cross(self) -> bool:
+        return len(self.paths) > 1
+
+    def add(self, record: dict) -> None:
+        if self.is_cross:
+            self.counter.update(product(*(extract(record, steps) for steps in self.paths)))
+        else:
+            self.counter.update(extract(record, self.paths[0]))
+
+    def top(self, k: Optional[int] = None) -> List[tuple]:
+        return self.counter.most_common(k)
+
+
+class Stats:
+    """
+    Статистика по нескольким разрезам за один проход по записям
+
+    dimensions - имена из STAT_ALIASES, пути к полям ("occupation.name", "schools[].name")
+    или их перекрестные таблицы через "+" ("city+university")
+    """
+
+    def __init__(self, dimensions: Iterable[str], top: Optional[int] = None):
+        self.dimensions = [Dimension(name) for name in dict.fromkeys(dimensions)]
+        self.top = top
+        self.total = 0
+
+    @classmethod
+    def from_options(cls, stat: Iterable[str], top: Optional[int] = None) -> 'Stats':
+        """
+        Из значений опции --stat: каждое может содержать несколько разрезов через запятую
+        """
+
+        return cls((name.strip() for option in stat for name in option.split(",") if name.strip()), top)
+
+    @property
+    def fields(self) -> set:
+        """
+        Поля VK API, которые нужно запросить для подсчета
+        """
+
+        return set().union(*(dimension.fields for dimension in self.dimensions))
+
+    def add(self, record) -> None:
+        if isinstance(record, dict):
+            for dimension in self.dimensions:
+                dimension.add(record)
+        self.total += 1
+
+    def update(self, records: Iterable) -> None:
+        for record in records:
+            self.add(record)
+
+    def result(self) -> Dict[str, Dict]:
+        """
+        {разрез: {значение: кол-во}} по убыванию кол-ва; ключи перекрестных таблиц склеиваются через " × "
+
+        Для единственного разреза возвращается сразу {значение: кол-во}, как раньше
+        """
+
+        result = {}
+        for dimension in self.dimensions:
+            result[dimension.name] = {(" × ".join(map(str, value)) if dimension.is_cross else value): count
+                                      for value, count in dimension.top(self.top)}
+
+        if len(result) == 1:
+            return next(iter(result.values()))
+        return result
+
+    def rows(self) -> Iterator[dict]:
+        """
+        Построчный вид для NDJSON: {"stat", "value", "count"}; у перекрестных таблиц value - список
+        """
+
+        for dimension in self.dimensions:
+            for value, count in dimension.top(self.top):
+                yield {"stat": dimension.name, "value": list(value) if dimension.is_cross else value, "count": count}
@@ -1,15 +1,13 @@
-import http
-import os
+import json
+import queue
+import re
+import sys
+import threading
+from collections import deque
+from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
-from typing import Sequence
-
-import requests
-
-
-class HashableDict(dict):
-    def __hash__(self):
-        return hash(frozenset(self.keys()))
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Sequence, Optional, Callable, Iterable, Iterator, TextIO
 
 
 def clear_empty(d: dict) -> None:
@@ -89,35 +87,174 @@ def human_readable_user(d: dict) -> None:
                 d["universities"][-1]["faculty_name"] = university["faculty_name"]
 
 
-def download(url: str, path: str) -> bool:
-    response = requests.get(url, stream=True)
-    with open(path, "wb") as f:
-        for chunk in response.iter_content(chunk_size=64 * 2 ** 20):
-            f.write(chunk)
-    return response.status_code == http.HTTPStatus.OK
-
-
-def save_pictures(vkapi, user_id, path):
-    def save_pic(url):
-        name = url.split("/")[-1].split("?")[0] + ".jpg"
-        result = download(url, name)
-        if result:
-            print(f"Скачал: {url}")
-        else:
-            print(f"Загрузка провалилась: {url}")
-        return result
-
-    if path is None:
-        path = user_id
-
-    urls = vkapi.get_urls_of_all_photos(user_id)
-    if not os.path.exists(path):
-        os.makedirs(path)
-    os.chdir(path)
-    with ThreadPoolExecutor(max_workers=4) as ex:
-        results = ex.map(save_pic, urls)
-    os.chdir("../")
-
-    if not all(results):
-        print("Скачаны не все файлы. Смотреть в логах сверху")
-    print("Все скачано")
+def parse_timezone(value: str) -> Optional[tzinfo]:
+    """
+    Часовой пояс из строки: смещение от UTC ("+3", "-04:30", "UTC+5"), "UTC",
+    имя из базы IANA ("Europe/Moscow") или "local" (None - локальный пояс системы)
+    """
+
+    if value.lower() == "local":
+        return None
+    if value.upper() == "UTC":
+        return timezone.utc
+
+    match = re.fullmatch(r"(?:UTC)?([+-])(\d{1,2})(?::?(\d{2}))?", value, re.IGNORECASE)
+    if match:
+        sign, hours, minutes = match.groups()
+        offset = timedelta(hours=int(hours), minutes=int(minutes or 0))
+        return timezone(-offset if sign == "-" else offset)
+
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+    try:
+        return ZoneInfo(value)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Неизвестный часовой пояс: {value}") from None
+
+
+def read_ids(f: TextIO) -> Iterator[str]:
+    """
+    Читает id из файла построчно: в строке может быть несколько id через пробел или запятую
+    """
+
+    for line in f:
+        for user_id in line.replace(",", " ").split():
+            yield user_id
+
+
+@contextmanager
+def open_output(output: Optional[str]) -> Iterator[TextIO]:
+    """
+    Открывает выходной файл или отдает stdout, если файл не задан
+    """
+
+    if output:
+        with open(output, "w") as f:
+            yield f
+    else:
+        yield sys.stdout
+
+
+def write_records(records, f: TextIO, fmt: str = "json") -> None:
+    """
+    Записывает записи в f
+
+    json - один JSON-документ с отступами
+    ndjson - по одной записи в строке
+    """
+
+    if fmt == "ndjson":
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write("\n")
+    elif isinstance(records, (list, tuple, dict)):
+        json.dump(records, f, indent=3, ensure_ascii=False)
+        f.write("\n")
+    else:
+        # JSON-массив из потока записей: вывод тот же, что у json.dump,
+        # но весь список не собирается в памяти
+        separator = "["
+        for record in records:
+            f.write(separator)
+            f.write("\n   " + json.dumps(record, indent=3, ensure_ascii=False).replace("\n", "\n   "))
+            separator = ","
+        f.write("[]\n" if separator == "[" else "\n]\n")
+
+
+def write_pages(pages: Iterable[list], f: TextIO, fmt: str = "json", prepare: Optional[Callable] = None) -> None:
+    """
+    Записывает записи из потока страниц
+
+    В формате ndjson каждая страница пишется сразу после получения,
+    поэтому в памяти держится не больше одной страницы
+    """
+
+    if fmt == "ndjson":
+        for page in pages:
+            write_records(map(prepare, page) if prepare else page, f, fmt)
+            f.flush()
+    else:
+        records = (record for page in pages for record in page)
+        write_records(map(prepare, records) if prepare else records, f, fmt)
+
+
+def map_concurrently(func: Callable, items: Iterable, jobs: int = 4) -> Iterator:
+    """
+    Применяет func к items в jobs потоках
+
+    Результаты отдаются в порядке items по мере готовности: следующий
+    отдается, как только готов он сам и все предыдущие. Вперед забегает
+    не более 2 * jobs задач, поэтому items может быть и бесконечным потоком
+    """
+
+    if jobs <= 1:
+        yield from map(func, items)
+        return
+
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(ex.submit(func, item))
+                if len(pending) >= 2 * jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def merge_concurrently(func: Callable[..., Iterable], items: Iterable, jobs: int = 4, buffer: int = 16) -> Iterator:
+    """
+    Перебирает итераторы func(item) для items в jobs потоках и отдает их элементы по мере поступления
+
+    Потоки складывают элементы в очередь на buffer штук и ждут, если потребитель
+    не успевает. Порядок между элементами разных items не сохраняется.
+    Исключение в любом потоке пробрасывается потребителю и останавливает остальные
+    """
+
+    results = queue.Queue(maxsize=buffer)
+    stop = threading.Event()
+    items = iter(items)
+    items_lock = threading.Lock()
+
+    def put(kind, value=None) -> bool:
+        while not stop.is_set():
+            try:
+                results.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            while not stop.is_set():
+                with items_lock:
+                    item = next(items, stop)
+                if item is stop:
+                    break
+                for value in func(item):
+                    if not put("item", value):
+                        return
+        except BaseException as e:
+            put("error", e)
+        finally:
+            put("done")
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(jobs)]
+    for thread in threads:
+        thread.start()
+
+    finished = 0
+    try:
+        while finished < len(threads):
+            kind, value = results.get()
+            if kind == "item":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                finished += 1
+    finally:
+        stop.set()
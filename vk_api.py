@@ -1,9 +1,19 @@
 import http
-from datetime import datetime, timezone, timedelta
-from typing import Union, Optional, Sequence, Tuple
+import json
+import re
+import time
+from concurrent.futures import Future
+from functools import partial
+from datetime import datetime, tzinfo
+from typing import Iterator, Union, Optional, Sequence, Tuple
 
 import requests
-from bs4 import BeautifulSoup as bs
+from requests.adapters import HTTPAdapter
+
+from cache import ResponseCache, MISSING
+from config import RATE_LIMITS, FLOOD_ERROR_CODES, DEFAULT_TIMEZONE
+from rate_limit import RateLimiter
+from utils import map_concurrently, merge_concurrently
 
 
 class VkAPIException(Exception):
@@ -11,25 +21,136 @@ class VkAPIException(Exception):
 
 
 class RequestFailed(VkAPIException):
-    pass
+    def __init__(self, message='', code: Optional[int] = None):
+        super().__init__(message)
+        self.code = code
 
 
 class NoSuchUser(VkAPIException):
     pass
 
 
-class VkAPI():
-    def __init__(self, token):
-        self.token = token
+class NoSuchGroup(VkAPIException):
+    pass
+
+
+def make_session(pool_size: int = 10, keep_alive: bool = True, retries: int = 0) -> requests.Session:
+    """
+    Создает HTTP-сессию с пулом соединений
+
+    pool_size - максимальное кол-во одновременно открытых соединений к одному хосту
+    keep_alive - переиспользовать ли соединения между запросами
+    retries - кол-во повторов при ошибках соединения
+    """
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
 
-    def _make_request(self, method, params) -> Optional[Union[dict, list]]:
+
+class PostWindow:
+    """
+    Отбирает посты, попадающие в отрезок [start; end] по дате, но не более count штук
+
+    Стена отсортирована по убыванию даты (кроме закрепленного поста), поэтому
+    как только встречается пост старше start, дальше можно не идти (done)
+    """
+
+    def __init__(self, count: Optional[int] = None, start: Optional[int] = None, end: Optional[int] = None):
+        self.count = count
+        self.start = start
+        self.end = end
+        self.done = count == 0
+
+    def feed(self, posts: list) -> list:
+        """
+        Принимает очередную страницу стены и возвращает подходящие посты
         """
-        Совершает запрос к заданному методу VK API с переданными параметрами 
-        
-        method - название метода VK API [str] (подробнее на сайте https://vk.com/dev/methods)
-        params - данные, передаваемые в запросе [dict]
 
-        В случаем неудачного запроса поднимает RequestFailed
+        if not posts:
+            self.done = True
+            return []
+
+        selected = []
+        for post in posts:
+            if self.start is not None and post['date'] < self.start:
+                if post.get('is_pinned'):
+                    continue
+                self.done = True
+                break
+            if self.end is not None and post['date'] > self.end:
+                continue
+            selected.append(post)
+
+        if self.count is not None:
+            selected = selected[:self.count]
+            self.count -= len(selected)
+            if self.count <= 0:
+                self.done = True
+
+        return selected
+
+
+class RegistrationScanner:
+    """
+    Достает дату регистрации из foaf.php по мере скачивания, не разбирая документ целиком
+
+    Нужен только атрибут <ya:created dc:date="...">, поэтому куски ответа просматриваются
+    регулярным выражением, и загрузку можно прервать, как только дата найдена.
+    Между кусками хранится хвост, чтобы не пропустить тег на их стыке
+    """
+
+    _CREATED = re.compile(rb'<ya:created\s[^>]*?dc:date="([^"]+)"')
+    _TAIL = 256
+
+    def __init__(self):
+        self._buffer = b''
+
+    def feed(self, chunk: bytes) -> Optional[str]:
+        """
+        Возвращает дату ("2006-09-23 20:27:12+03:00"), если она нашлась, иначе None
+        """
+
+        self._buffer = self._buffer[-self._TAIL:] + chunk
+        match = self._CREATED.search(self._buffer)
+        if match:
+            return match.group(1).decode().replace('T', ' ')
+        return None
+
+
+class BaseVkAPI:
+    """
+    Общая часть синхронного (VkAPI) и асинхронного (AsyncVkAPI) клиентов
+
+    Здесь собраны настройки, подготовка запросов и разбор ответов,
+    а ввод-вывод реализуют наследники
+    """
+
+    def __init__(self, token, *, timeout: Union[float, Tuple[float, float]] = (5, 30),
+                 api_url: str = 'https://api.vk.com/method/', execute_limit: int = 25, token_type: str = 'user',
+                 rate: Optional[float] = None, burst: Optional[int] = None, flood_retries: int = 5,
+                 rate_limiter: Optional[RateLimiter] = None, page_workers: int = 4,
+                 cache: Optional[ResponseCache] = None, foaf_url: str = 'https://vk.com/foaf.php'):
+        self.token = token
+        self.foaf_url = foaf_url
+        self.page_workers = page_workers
+        self.cache = cache
+        self._resolved_ids = {'user': {}, 'group': {}}
+        self.timeout = timeout
+        self.api_url = api_url
+        self.execute_limit = execute_limit
+        self.flood_retries = flood_retries
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(rate if rate is not None else RATE_LIMITS[token_type], burst)
+        self.rate_limiter = rate_limiter
+
+    def _prepare_params(self, params: dict) -> dict:
+        """
+        Дополняет параметры запроса токеном, версией API и языком
         """
 
         params['access_token'] = self.token
@@ -43,31 +164,660 @@ class VkAPI():
         except:
             params['lang'] = 'ru'
 
-        url = 'https://api.vk.com/method/{}'.format(method)
-        response = requests.get(url, params=params)
+        return params
+
+    def _cache_get(self, method, params):
+        """
+        Возвращает закешированный ответ или MISSING
+        """
+
+        if self.cache is None:
+            return MISSING
+        return self.cache.get(method, self._prepare_params(dict(params)))
+
+    def _cache_set(self, method, params, value) -> None:
+        if self.cache is not None:
+            self.cache.set(method, self._prepare_params(dict(params)), value)
+
+    def _flood_delay(self, content: dict, attempt: int) -> Optional[float]:
+        """
+        Решает, нужно ли повторить запрос после ответа content
+
+        Возвращает None, если повторять не нужно, иначе - сколько секунд подождать
+        (кроме ожидания в rate_limiter, темп которого при этом снижается)
+        """
+
+        error_code = content.get('error', {}).get('error_code')
+        if error_code not in FLOOD_ERROR_CODES or attempt >= self.flood_retries:
+            if 'error' not in content:
+                self.rate_limiter.reward()
+            return None
+
+        self.rate_limiter.penalize()
+        return 2 ** attempt if error_code == 9 else 0
+
+    @staticmethod
+    def _parse_content(method, params, content: dict) -> Optional[Union[dict, list]]:
+        """
+        Достает из ответа VK API поле response
+
+        В случаем ошибки поднимает RequestFailed
+        """
+
+        if 'response' in content.keys():
+            content = content['response']
+        else:
+            error_code = content['error']['error_code']
+            error_msg = content['error']['error_msg']
+            raise RequestFailed(
+                    f'VK API: method: {method} | params: {params} | code: {error_code} | msg: {error_msg}',
+                    code=error_code)
+
+        return content
+
+    @staticmethod
+    def _execute_code(calls: Sequence[Tuple[str, dict]]) -> str:
+        return 'return [{}];'.format(','.join(
+            'API.{}({})'.format(method, json.dumps(params, ensure_ascii=False)) for method, params in calls))
+
+    @staticmethod
+    def _chunks(sequence: Sequence, size: int) -> list:
+        return [sequence[start:start + size] for start in range(0, len(sequence), size)]
+
+    @staticmethod
+    def _split_execute(calls, response, errors) -> list:
+        """
+        Раскладывает ответ execute по вызовам
+
+        Неудачные вызовы в ответе отмечены false, а их ошибки идут
+        в execute_errors в том же порядке
+        """
+
+        errors = iter(errors)
+        results = []
+        for (method, params), result in zip(calls, response):
+            if result is False:
+                error = next(errors, {})
+                error_code = error.get('error_code')
+                error_msg = error.get('error_msg', 'неизвестная ошибка')
+                result = RequestFailed(
+                    f'VK API: method: {method} | params: {params} | code: {error_code} | msg: {error_msg}',
+                    code=error_code)
+            results.append(result)
+        return results
+
+    @staticmethod
+    def _page_calls(method, params: dict, page_size: int, first: dict) -> list:
+        """
+        Возвращает вызовы для всех страниц, следующих за первой
+
+        params - параметры первой страницы
+        first - ответ на запрос первой страницы (из него берется count)
+        """
+
+        total = first.get('count', 0)
+        offsets = range(params['offset'] + page_size, total, page_size)
+        return [(method, dict(params, offset=offset)) for offset in offsets]
+
+    def _resolved(self, kind: str, domain) -> Union[int, object]:
+        """
+        Возвращает уже известный id пользователя (kind='user') или группы (kind='group')
+
+        id берется из самого domain (id123, club123, 123), из памяти клиента или из кеша.
+        Если id неизвестен, возвращает MISSING, а если известно, что такого domain-а нет, - None
+        """
+
+        domain = str(domain)
+        prefixes = ("id",) if kind == "user" else ("club", "public", "event")
+        if domain.isdigit():
+            return int(domain)
+        for prefix in prefixes:
+            if domain.startswith(prefix) and domain[len(prefix):].isdigit():
+                return int(domain[len(prefix):])
+
+        resolved = self._resolved_ids[kind]
+        if domain in resolved:
+            return resolved[domain]
+
+        cached = self._cache_get('resolve.' + kind, {'domain': domain})
+        if cached is not MISSING:
+            resolved[domain] = cached
+        return cached
+
+    def _remember(self, kind: str, domain, object_id: Optional[int]) -> None:
+        self._resolved_ids[kind][str(domain)] = object_id
+        self._cache_set('resolve.' + kind, {'domain': str(domain)}, object_id)
+
+    def _match_resolved(self, kind: str, domains: Sequence[str], items: Sequence[dict]) -> None:
+        """
+        Запоминает id из ответа users.get/groups.getById на запрос domains
+
+        Удаленные страницы и дубликаты могут выпасть из ответа, поэтому
+        сопоставление идет по screen_name, а по порядку - только если длины совпали
+        """
+
+        if len(items) == len(domains):
+            pairs = zip(domains, items)
+        else:
+            by_name = {str(item.get('screen_name', '')).lower(): item for item in items}
+            pairs = ((domain, by_name[domain.lower()]) for domain in domains if domain.lower() in by_name)
+
+        for domain, item in pairs:
+            self._remember(kind, domain, item['id'])
+
+    def _resolve_calls(self, kind: str, domains: Sequence) -> Tuple[list, list]:
+        """
+        Возвращает domain-ы, id которых неизвестны, разбитые на куски, и вызовы для их получения
+        """
+
+        unknown = list(dict.fromkeys(str(domain) for domain in domains
+                                     if self._resolved(kind, domain) is MISSING))
+        chunks = self._chunks(unknown, 1000 if kind == 'user' else 500)
+        return chunks, [self._resolve_call(kind, chunk) for chunk in chunks]
+
+    @staticmethod
+    def _resolve_call(kind: str, chunk: Sequence[str]) -> Tuple[str, dict]:
+        if kind == 'user':
+            return 'users.get', {'user_ids': ','.join(chunk), 'fields': 'screen_name'}
+        return 'groups.getById', {'group_ids': ','.join(chunk)}
+
+    def _match_resolve_results(self, kind: str, chunks: Sequence[list], results: Sequence) -> list:
+        """
+        Запоминает id из ответов на вызовы _resolve_calls и возвращает куски для повторного запроса
+
+        Если в куске есть несуществующий domain, весь вызов падает с ошибкой 100 или 113.
+        Тогда domain-ы такого куска запрашиваются заново по одному (все одиночные вызовы
+        идут одним списком в execute), а domain, на котором упал одиночный вызов,
+        запоминается как несуществующий
+        """
+
+        retry = []
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, RequestFailed):
+                # 100, 113 - неверный параметр, то есть в куске есть несуществующий domain
+                if result.code not in (100, 113):
+                    raise result
+                if len(chunk) > 1:
+                    retry.extend([domain] for domain in chunk)
+                else:
+                    self._remember(kind, chunk[0], None)
+                continue
+            self._match_resolved(kind, chunk, result)
+        return retry
+
+    def _known_ids(self, kind: str, domains: Sequence) -> dict:
+        ids = {}
+        for domain in domains:
+            object_id = self._resolved(kind, domain)
+            if object_id is not MISSING and object_id is not None:
+                ids[str(domain)] = object_id
+        return ids
+
+    def _get_post_ids(self, posts):
+
+        post_ids = [post['id'] for post in posts]
+
+        return post_ids
+
+    @staticmethod
+    def _split_subscriptions(subscriptions) -> Tuple[Sequence[dict], Sequence[dict], Sequence[dict]]:
+        pages, users = [], []
+        for subscription in subscriptions:
+            if subscription.get('type') == 'profile':
+                users.append(subscription)
+            else:
+                pages.append(subscription)
+
+        return tuple(users), tuple(pages), tuple(subscriptions)
+
+    @staticmethod
+    def _photo_url(photo: dict) -> str:
+        return photo['sizes'][-1]['url']
+
+    def _photo_urls(self, items, timestamp=False) -> list:
+        """
+        Собирает url фотографий из вложений постов или комментариев
+        """
+
+        urls = []
+        for item in items:
+            attachments = item.get('attachments', [])
+            for attachment in attachments:
+                if attachment['type'] == 'photo':
+                    url = self._photo_url(attachment['photo'])
+
+                    if timestamp:
+                        urls.append((url, attachment['photo']['date']))
+                    else:
+                        urls.append(url)
+
+        return urls
+
+    def get_photo_urls_from_posts(self, posts, timestamp=False):
+        return self._photo_urls(posts, timestamp)
+
+    # коды ошибок, при которых комментарии поста просто недоступны (закрыты, пост удален)
+    _NO_COMMENTS_CODES = (15, 18, 100, 212)
+
+    @staticmethod
+    def _comment_calls(posts, page_size: int = 100, thread_items: int = 10) -> list:
+        """
+        Вызовы первых страниц комментариев к постам, сразу с первыми thread_items ответами в ветках
+
+        Стена берется из owner_id каждого поста, так что посты могут быть с разных стен
+        """
+
+        return [('wall.getComments', {'owner_id': post['owner_id'], 'post_id': post['id'], 'offset': 0,
+                                      'count': page_size, 'thread_items_count': thread_items})
+                for post in posts]
+
+    def _collect_comments(self, params: dict, result, comments: list, page_size: int = 100) -> list:
+        """
+        Складывает комментарии (и ответы из веток) из ответа wall.getComments в comments
+
+        Возвращает вызовы, которые еще нужны: остальные страницы комментариев
+        поста и ответы в ветках, не поместившиеся в thread_items
+        """
+
+        if isinstance(result, RequestFailed):
+            if result.code in self._NO_COMMENTS_CODES:
+                return []
+            raise result
+
+        items = result.get('items', [])
+        follow_up = []
+        reply_params = {key: value for key, value in params.items() if key != 'thread_items_count'}
+
+        if 'comment_id' not in params:
+            total = result.get('current_level_count', result.get('count', 0))
+            if params['offset'] == 0:
+                follow_up += [('wall.getComments', dict(params, offset=offset))
+                              for offset in range(page_size, total, page_size)]
+
+            for comment in items:
+                thread = comment.get('thread', {})
+                replies = thread.get('items', [])
+                comments.append(comment)
+                comments.extend(replies)
+                follow_up += [('wall.getComments', dict(reply_params, comment_id=comment['id'], offset=offset))
+                              for offset in range(len(replies), thread.get('count', 0), page_size)]
+        else:
+            comments.extend(items)
+
+        return follow_up
+
+    def _probe_calls(self, params: dict, lo: int, hi: int) -> Tuple[list, list]:
+        """
+        Пробы для поиска по стене в [lo; hi): до execute_limit равноотстоящих смещений по одному посту
+
+        Возвращает (смещения, вызовы)
+        """
+
+        step = max(1, -(-(hi - lo) // self.execute_limit))
+        offsets = list(range(lo, hi, step))
+        probe = {key: value for key, value in params.items() if key != 'extended'}
+        return offsets, [('wall.get', dict(probe, offset=offset, count=1)) for offset in offsets]
+
+    @staticmethod
+    def _narrow(offsets, results, lo: int, hi: int, predicate) -> Tuple[int, int]:
+        """
+        Сужает [lo; hi) по результатам проб до промежутка между последней
+        пробой, где predicate ложен, и первой, где он истинен
+
+        За концом стены (пустой ответ) predicate считается истинным,
+        закрепленный пост стоит вне порядка и считается ложным
+        """
+
+        for offset, result in zip(offsets, results):
+            if isinstance(result, RequestFailed):
+                raise result
+            items = result.get('items', [])
+            if not items or (not items[0].get('is_pinned') and predicate(items[0])):
+                return lo, offset
+            lo = offset + 1
+        return lo, hi
+
+    @staticmethod
+    def _post_window_bounds(first: dict, offset: int, start, end):
+        """
+        Что искать после первой страницы стены: (смещение после нее, искать ли начало окна по end)
+        """
+
+        items = first.get('items', [])
+        after_first = offset + len(items)
+        seek_end = end is not None and bool(items) and not items[-1].get('is_pinned') and items[-1]['date'] > end
+        return after_first, seek_end
+
+    @staticmethod
+    def _post_page_calls(params: dict, lo: int, stop: int, page_size: int) -> list:
+        return [('wall.get', dict(params, offset=offset, count=min(page_size, stop - offset)))
+                for offset in range(lo, stop, page_size)]
+
+    @staticmethod
+    def _last_seen_time(user: dict, tz: Optional[tzinfo] = DEFAULT_TIMEZONE) -> datetime:
+        """
+        Время последнего посещения в часовом поясе tz (None - локальный)
+        """
+
+        timestamp = user.get('last_seen', {}).get('time', 0)  # int
+        return datetime.fromtimestamp(timestamp, tz=tz).astimezone(tz)
+
+    def _mutual_calls(self, source_id: int, target_ids: Sequence[int]) -> list:
+        _max_count = 100  # максимальное кол-во целей в одном friends.getMutual
+
+        return [('friends.getMutual', {'source_uid': source_id, 'target_uids': ','.join(map(str, chunk))})
+                for chunk in self._chunks(list(target_ids), _max_count)]
+
+    @staticmethod
+    def _parse_mutual(target_ids: Sequence[int], result) -> dict:
+        """
+        Разбирает ответ friends.getMutual с target_uids: список {id, common_friends}
+        """
+
+        mutual = {target_id: [] for target_id in target_ids}
+        for item in result:
+            if isinstance(item, dict):
+                mutual[item['id']] = item.get('common_friends', [])
+        return mutual
+
+    @staticmethod
+    def _intersect_friends(source_friends: set, friends: Sequence) -> list:
+        return [friend for friend in friends if friend in source_friends]
+
+    @staticmethod
+    def _common_friends_info(people) -> list:
+        common = []
+        for person in people:
+            name = '{} {}'.format(person['last_name'], person['first_name'])
+            city = person.get('city', {}).get('title', '')
+            country = person.get('country', {}).get('title', '')
+            university = person.get('university_name', '')
+
+            info = {'name': name, 'city': city, 'country': country, 'university': university}
+            common.append(info)
+        return common
+
+    @staticmethod
+    def _dogs(users) -> list:
+        dogs = []
+        for user in users:
+            if user.get('deactivated', None) is not None:
+                dogs.append(user['id'])
+        return dogs
+
+    def process_people(self, people, sort_by='name', filter_by={}, filter_reverse=False) -> list:
+        """
+        Обрабатывает список people
 
-        if response.status_code == http.HTTPStatus.OK:
-            content = response.json()
-            if 'response' in content.keys():
-                content = content['response']
+        filter_by:
+        задается словарем
+        {'param': 'value1,value2'}
+        param - параметр person
+        value1,value2,... значения для фильтрации(одно из значений, которое принимает/непринимает параметр person)
+        (записывать строго через запятую, без пробелов и т.д.)
+
+        filter_reverse:
+        False только persons с переданные значения будут возвращены
+        True будут возвращены все persons, кроме имеющих переданные значения
+
+        sort_by:
+        заадется строкой, которая является параметром person
+        """
+
+        people_keys = people[0].keys()  # Список параметров person
+
+        # for person in people:
+        #     for key in people_keys:
+
+        # Выполняем сортировку по укзанному в sort_by параметру
+        if sort_by in people_keys:
+            people.sort(key=lambda x: x[sort_by])
+        else:
+            print('Неизвестный ключ сортировки')
+
+        # Выполняем фильтрацию данных по указанным в filter_by параметрам и их значениям
+        if filter_by != {}:  # Если filter_by не пустой
+            filter_by_keys = filter_by.keys()  # списко параметров filter_by
+            _people = []  # список людей отвечающих критериям
+            for person in people:  # проходимся по списку people
+                _bool = True  # проверяет одновременность выполнения всех условий
+                for _filter in filter_by_keys:  # проходимся по всем параметрам filter_by
+                    values = filter_by[_filter].split(',')  # разбиваем строку значений на список возможных значений
+                    __bool = False  # проверяет выполнение хотя бы одного условия из списка значений
+                    for value in values:
+                        __bool = __bool or (filter_reverse ^ (person[_filter] == value))
+                    _bool = _bool and __bool
+                if _bool:  # если все условия выполнятся, то добавляем в список отвечающих критериям
+                    _people.append(person)
+            people = _people  # переприсваеваем people
+
+        return people
+
+
+
+class VkBatch:
+    """
+    Пакет вызовов VK API, выполняемых через execute
+
+    Вызовы копятся до execute_limit штук, после чего отправляются одним
+    запросом. Оставшиеся отправляются при flush() или выходе из with
+    """
+
+    def __init__(self, vkapi: 'VkAPI'):
+        self.vkapi = vkapi
+        self._queue = []
+
+    def call(self, method: str, params: dict) -> Future:
+        """
+        Добавляет вызов в пакет и возвращает Future с его результатом
+        """
+
+        future = Future()
+        self._queue.append((method, params, future))
+        if len(self._queue) >= self.vkapi.execute_limit:
+            self.flush()
+        return future
+
+    def flush(self) -> None:
+        queue, self._queue = self._queue, []
+        if not queue:
+            return
+
+        try:
+            results = self.vkapi.execute([(method, params) for method, params, _ in queue])
+        except Exception as e:
+            for _, _, future in queue:
+                future.set_exception(e)
+            return
+
+        for (_, _, future), result in zip(queue, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
             else:
-                error_code = content['error']['error_code']
-                error_msg = content['error']['error_msg']
-                raise RequestFailed(
-                        f'VK API: method: {method} | params: {params} | code: {error_code} | msg: {error_msg}')
+                future.set_result(result)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+class VkAPI(BaseVkAPI):
+    def __init__(self, token, *, pool_size: int = 10, keep_alive: bool = True,
+                 timeout: Union[float, Tuple[float, float]] = (5, 30), retries: int = 0,
+                 api_url: str = 'https://api.vk.com/method/', session: Optional[requests.Session] = None,
+                 execute_limit: int = 25, token_type: str = 'user', rate: Optional[float] = None,
+                 burst: Optional[int] = None, flood_retries: int = 5, rate_limiter: Optional[RateLimiter] = None,
+                 page_workers: int = 4, cache: Optional[ResponseCache] = None,
+                 foaf_url: str = 'https://vk.com/foaf.php'):
+        """
+        token - авторизационный токен
+        pool_size - размер пула соединений
+        keep_alive - переиспользовать ли соединения между запросами
+        timeout - таймаут запроса в секундах (connect, read)
+        retries - кол-во повторов при ошибках соединения
+        api_url - адрес VK API (можно подменить, например, на локальный сервер)
+        session - готовая сессия requests (если не передана, создается своя)
+        execute_limit - максимальное кол-во вызовов в одном execute (у VK не более 25)
+        token_type - тип токена (user, group, service), определяет лимит запросов в секунду
+        rate, burst - явно заданные лимит запросов в секунду и размер пачки запросов без ожидания
+        flood_retries - сколько раз повторять запрос после ошибок 6 и 9
+        rate_limiter - готовый ограничитель (например, общий для нескольких клиентов с одним токеном)
+        page_workers - сколько пачек страниц одного списка запрашивать одновременно
+        cache - кеш ответов (если не передан, ответы не кешируются)
+        foaf_url - адрес foaf.php, откуда берутся даты регистрации
+        """
+
+        super().__init__(token, timeout=timeout, api_url=api_url, execute_limit=execute_limit,
+                         token_type=token_type, rate=rate, burst=burst, flood_retries=flood_retries,
+                         rate_limiter=rate_limiter, page_workers=page_workers, cache=cache, foaf_url=foaf_url)
+        self.session = session if session is not None else make_session(pool_size, keep_alive, retries)
+
+    def close(self) -> None:
+        """
+        Закрывает все соединения пула
+        """
+
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _send(self, method, params) -> dict:
+        """
+        Отправляет запрос и возвращает распарсенный JSON ответа целиком
+
+        execute отправляется POST-ом, тк код может не поместиться в url
+        """
+
+        url = self.api_url + method
+        if method == 'execute':
+            response = self.session.post(url, data=params, timeout=self.timeout)
         else:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+
+        if response.status_code != http.HTTPStatus.OK:
             raise RequestFailed('Код ответа: {}'.format(response.status_code))
 
-        return content
+        return response.json()
+
+    def _call(self, method, params) -> dict:
+        """
+        Отправляет запрос с учетом лимита запросов в секунду
+
+        При ошибках 6 и 9 снижает темп и повторяет запрос (не более flood_retries раз)
+        """
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            content = self._send(method, params)
+
+            delay = self._flood_delay(content, attempt)
+            if delay is None:
+                return content
+            time.sleep(delay)
+            attempt += 1
 
-    def _is_user_id(self, domain: str) -> bool:
+    def _make_request(self, method, params, cached: bool = True) -> Optional[Union[dict, list]]:
         """
-        Проверяет, ялвяется ли переданная строка - id пользователя (числом)
+        Совершает запрос к заданному методу VK API с переданными параметрами 
         
-        domain - часть url страницы после vk.com/ 
+        method - название метода VK API [str] (подробнее на сайте https://vk.com/dev/methods)
+        params - данные, передаваемые в запросе [dict]
+
+        В случаем неудачного запроса поднимает RequestFailed
+        """
+
+        response = self._cache_get(method, params) if cached else MISSING
+        if response is not MISSING:
+            return response
+
+        content = self._call(method, self._prepare_params(params))
+        response = self._parse_content(method, params, content)
+        self._cache_set(method, params, response)
+        return response
+
+    # ПАКЕТНЫЕ ЗАПРОСЫ
+    def execute(self, calls: Sequence[Tuple[str, dict]], cached: bool = True) -> list:
+        """
+        Выполняет несколько методов VK API через execute (не более execute_limit за один запрос)
+
+        calls - список пар (метод, параметры)
+
+        Возвращает список результатов в том же порядке. Если отдельный вызов
+        завершился ошибкой, на его месте будет исключение RequestFailed
+        (оно не поднимается, чтобы не терять результаты остальных вызовов)
+
+        cached=False - не брать результаты из кеша (например, для отслеживания изменений)
+        """
+
+        results = []
+        for chunk in self._chunks(calls, self.execute_limit):
+            results.extend(self._execute_chunk(chunk, cached))
+        return results
+
+    def _execute_chunk(self, calls: Sequence[Tuple[str, dict]], cached: bool = True) -> list:
+        """
+        Выполняет не более execute_limit вызовов, отправляя только те, которых нет в кеше
+        """
+
+        results = [self._cache_get(method, params) if cached else MISSING for method, params in calls]
+        missing = [i for i, result in enumerate(results) if result is MISSING]
+        if missing:
+            fetched = self._execute_uncached([calls[i] for i in missing], cached)
+            for i, result in zip(missing, fetched):
+                results[i] = result
+                if not isinstance(result, RequestFailed):
+                    self._cache_set(*calls[i], result)
+        return results
+
+    def _execute_uncached(self, calls: Sequence[Tuple[str, dict]], cached: bool = True) -> list:
+        if len(calls) == 1:
+            method, params = calls[0]
+            try:
+                return [self._make_request(method, dict(params), cached)]
+            except RequestFailed as e:
+                return [e]
+
+        content = self._call('execute', self._prepare_params({'code': self._execute_code(calls)}))
+        response = self._parse_content('execute', {}, content)
+        return self._split_execute(calls, response, content.get('execute_errors', []))
+
+    def batch(self) -> 'VkBatch':
+        """
+        Возвращает пакет, в который можно складывать вызовы методов
+
+        with vkapi.batch() as batch:
+            friends = batch.call('friends.get', {'user_id': 1})
+        friends.result()
         """
 
-        return domain.startswith("id") and domain[:2].isdigit()
+        return VkBatch(self)
+
+    def _paginate(self, method, params, page_size: int, items_key: str = 'items'):
+        """
+        Генератор страниц (списков элементов) метода с пагинацией по offset
+
+        Первая страница запрашивается отдельно, чтобы узнать count. Остальные
+        запрашиваются пачками через execute, до page_workers пачек одновременно,
+        и отдаются по порядку по мере готовности
+        """
+
+        params = dict(params, count=page_size, offset=params.get('offset', 0))
+        response = self._make_request(method, dict(params))
+        yield response.get(items_key, [])
+
+        chunks = self._chunks(self._page_calls(method, params, page_size, response), self.execute_limit)
+        for results in map_concurrently(self._execute_chunk, chunks, self.page_workers):
+            for result in results:
+                if isinstance(result, RequestFailed):
+                    raise result
+                yield result.get(items_key, [])
 
     def _get_user_id(self, domain) -> int:
         """
@@ -76,18 +826,10 @@ class VkAPI():
         domain - часть url страницы после vk.com/ 
         """
 
-        if self._is_user_id(domain):
-            return domain[2:]
-        else:
-            params = {
-                'user_ids': domain
-            }
-            method = 'users.get'
-            response = self._make_request(method, params)
-            if not response:
-                raise NoSuchUser(f"User name {domain} doesn't exist")
-
-            return response[0]['id']
+        user_id = self.resolve_user_ids([domain]).get(str(domain))
+        if user_id is None:
+            raise NoSuchUser(f"User name {domain} doesn't exist")
+        return user_id
 
     def _get_group_id(self, domain) -> int:
         """
@@ -95,17 +837,35 @@ class VkAPI():
 
         """
 
-        try:
-            group_id = int(domain)
-        except ValueError:
-            params = {
-                'group_id': domain
-            }
-            response = self._make_request('groups.getById', params)
-            group_id = response[0]['id']
-
+        group_id = self.resolve_group_ids([domain]).get(str(domain))
+        if group_id is None:
+            raise NoSuchGroup(f"Group name {domain} doesn't exist")
         return group_id
 
+    def resolve_user_ids(self, domains: Sequence) -> dict:
+        """
+        Возвращает словарь {domain: id} для пользователей
+
+        Неизвестные id запрашиваются одним users.get на каждые 1000 domain-ов,
+        а найденные запоминаются. Несуществующих domain-ов в словаре не будет
+        """
+
+        return self._resolve('user', domains)
+
+    def resolve_group_ids(self, domains: Sequence) -> dict:
+        """
+        То же, что resolve_user_ids, но для групп (groups.getById по 500 domain-ов)
+        """
+
+        return self._resolve('group', domains)
+
+    def _resolve(self, kind: str, domains: Sequence) -> dict:
+        chunks, calls = self._resolve_calls(kind, domains)
+        while chunks:
+            chunks = self._match_resolve_results(kind, chunks, self.execute(calls))
+            calls = [self._resolve_call(kind, chunk) for chunk in chunks]
+        return self._known_ids(kind, domains)
+
     def _get_posts_count(self, domain):
         params = {
             'domain': domain,
@@ -118,12 +878,6 @@ class VkAPI():
         posts_count = response.get('count', 0)
         return posts_count
 
-    def _get_post_ids(self, posts):
-
-        post_ids = [post['id'] for post in posts]
-
-        return post_ids
-
     def get_user_name(self, domain) -> str:
 
         """
@@ -171,25 +925,24 @@ class VkAPI():
         https://vk.com/dev/friends.get
         """
 
+        friends = []
+        for page in self.iter_friends(domain, fields):
+            friends.extend(page)
+
+        return friends
+
+    def iter_friends(self, domain: str, fields: Sequence[str]):
+        """
+        Генератор страниц списка друзей (по 5000), см. get_friends
+        """
+
         params = {
             'user_id': self._get_user_id(domain),
-            'count': 5000,
-            'offset': 0,
             'fields': ",".join(fields)
         }  # order не использовать, тк по дефолту стоит сортировка по возрастанию id
         method = 'friends.get'
 
-        friends = []
-        while True:
-            response = self._make_request(method, params)
-            friends.extend(response.get('items', []))
-            friend_count = response.get('count', 0)
-
-            params['offset'] += params['count']
-            if params['offset'] >= friend_count:
-                break
-
-        return friends
+        return self._paginate(method, params, 5000)
 
     def get_followers(self, domain, fields=''):
         """
@@ -203,25 +956,39 @@ class VkAPI():
 
         """
 
+        followers = []
+        for page in self.iter_followers(domain, fields):
+            followers.extend(page)
+
+        return followers
+
+    def iter_followers(self, domain, fields=''):
+        """
+        Генератор страниц списка подписчиков (по 1000), см. get_followers
+        """
+
         params = {
             'user_id': self._get_user_id(domain),
-            'count': 1000,
-            'offset': 0,
-            'fields': fields
+            'fields': fields if isinstance(fields, str) else ','.join(fields)
         }
         method = 'users.getFollowers'
 
-        followers = []
-        while True:
-            response = self._make_request(method, params)
-            followers.extend(response.get('items', []))
-            follower_count = response.get('count', 0)
+        return self._paginate(method, params, 1000)
 
-            params['offset'] += params['count']
-            if params['offset'] >= follower_count:
-                break
+    def iter_members(self, domain, fields: Sequence[str] = tuple()):
+        """
+        Генератор страниц списка участников сообщества (по 1000)
 
-        return followers
+        Подробнее:
+        https://vk.com/dev/groups.getMembers
+        """
+
+        params = {
+            'group_id': self._get_group_id(domain),
+            'fields': ','.join(fields)
+        }
+
+        return self._paginate('groups.getMembers', params, 1000)
 
     def get_subscriptions(self, domain: str, fields: Sequence[str]) -> Tuple[
         Sequence[dict], Sequence[dict], Sequence[dict]]:
@@ -230,32 +997,24 @@ class VkAPI():
         Возвращет список подписок пользователя
         """
 
+        subscriptions = []
+        for page in self.iter_subscriptions(domain, fields):
+            subscriptions.extend(page)
+
+        return self._split_subscriptions(subscriptions)
+
+    def iter_subscriptions(self, domain: str, fields: Sequence[str]):
+        """
+        Генератор страниц списка подписок (по 200, пользователи и сообщества вперемешку)
+        """
+
         params = {
             'user_id': self._get_user_id(domain),
-            'count': 200,
             'extended': 1,
-            'offset': 0,
             'fields': ",".join(fields)
         }
 
-        subscriptions = []
-        while True:
-            response = self._make_request('users.getSubscriptions', params)
-            subscriptions.extend(response.get('items', []))
-            subscription_count = response.get('count', 0)
-
-            params['offset'] += params['count']
-            if params['offset'] >= subscription_count:
-                break
-
-        pages, users = [], []
-        for subscription in subscriptions:
-            if subscription.get('type') == 'profile':
-                users.append(subscription)
-            else:
-                pages.append(subscription)
-
-        return tuple(users), tuple(pages), tuple(subscriptions)
+        return self._paginate('users.getSubscriptions', params, 200)
 
     def get_groups(self, domain: str, fields: Sequence[str] = tuple()):
         params = {
@@ -295,124 +1054,150 @@ class VkAPI():
     def get_urls_from_album(self, domain, album_id):
         params = {
             'owner_id': self._get_user_id(domain),
-            'album_id': album_id,
-            'count': 1000,
-            'offset': 0
+            'album_id': album_id
         }
         method = 'photos.get'
 
         urls = []
-        received_count = 0
-        all_photos_count = 1
-        while received_count < all_photos_count:
-            response = self._make_request(method, params)
-
-            items = response.get('items', [])
-            for photo in items:
-                url = photo['sizes'][-1]['url']
-                urls.append(url)
-
-            all_photos_count = response.get('count', 0)
+        for page in self._paginate(method, params, 1000):
+            for photo in page:
+                urls.append(self._photo_url(photo))
 
-            received_count += params['count']
-            params['offset'] += params['count']
         return urls
 
     def get_urls_of_all_photos(self, domain):
-        albums = [album for album in self.get_albums(domain) if album != -9000]
+        return list(self.iter_photo_urls(domain))
 
-        all_urls = []
-        for album_id in albums:
-            album_urls = self.get_urls_from_album(domain, album_id)
-            all_urls.extend(album_urls)
-
-        return all_urls
-
-    def get_photo_urls_from_comments(self, posts, timestamp=False):
-
-        post_ids = self._get_post_ids(posts)
-        group_id = posts[0]['from_id']
-
-        params = {
-            'owner_id': group_id,
-            'post_id': '',
-            'count': 100,
-            'offset': 0
-        }
-        method = 'wall.getComments'
-
-        urls = []
+    def iter_photo_urls(self, domain, jobs: int = 4):
+        """
+        Url всех фотографий пользователя или группы по мере получения
 
-        for post_id in post_ids:
-            params['post_id'] = post_id
+        Альбомы перебираются в jobs потоков, url отдаются сразу, как пришла
+        очередная страница любого альбома, поэтому их обработка (скачивание)
+        начинается задолго до того, как перебраны все альбомы
+        """
 
-            while True:
-                response = self._make_request(method, params)
-                items = response.get('items', [])
-                comments_count = response.get('count', 0)
+        owner_id = self._get_user_id(domain)
+        albums = [album for album in self.get_albums(owner_id) if album != -9000]
 
-                for comment in items:
-                    attachments = comment.get('attachments', [])
+        def album_pages(album_id):
+            return self._paginate('photos.get', {'owner_id': owner_id, 'album_id': album_id}, 1000)
 
-                    for attachment in attachments:
-                        if attachment['type'] == 'photo':
-                            url = attachment['photo']['sizes'][-1]['url']
+        for page in merge_concurrently(album_pages, albums, jobs, buffer=2 * jobs):
+            for photo in page:
+                yield self._photo_url(photo)
 
-                            if timestamp:
-                                urls.append((url, attachment['date']))
-                            else:
-                                urls.append(url)
+    def get_photo_urls_from_comments(self, posts, timestamp=False):
+        return list(self.iter_photo_urls_from_comments(posts, timestamp))
 
-                params['offset'] += params['count']
-                if params['offset'] >= comments_count:
-                    break
+    def iter_photo_urls_from_comments(self, posts, timestamp=False):
+        for comments in self.iter_comments(posts):
+            yield from self._photo_urls(comments, timestamp)
 
-        return urls
+    def iter_comments(self, posts):
+        """
+        Генератор списков комментариев к постам posts, включая ответы в ветках
 
-    def get_photo_urls_from_posts(self, posts, timestamp=False):
-        urls = []
-        for post in posts:
-            attachments = post.get('attachments', [])
-            for attachment in attachments:
-                if attachment['type'] == 'photo':
-                    url = attachment['photo']['sizes'][-1]['url']
+        Посты обрабатываются пачками по execute_limit, до page_workers пачек одновременно:
+        первые страницы всех постов пачки идут одним execute, затем так же - оставшиеся
+        страницы и длинные ветки. Список отдается на каждую пачку постов по мере готовности
+        """
 
-                    if timestamp:
-                        urls.append((url, attachment['date']))
-                    else:
-                        urls.append(url)
+        chunks = self._chunks(self._comment_calls(posts), self.execute_limit)
+        yield from map_concurrently(self._harvest_comments, chunks, self.page_workers)
 
-        return urls
+    def _harvest_comments(self, calls) -> list:
+        comments = []
+        while calls:
+            results = self.execute(calls)
+            calls = [call for (_, params), result in zip(calls, results)
+                     for call in self._collect_comments(params, result, comments)]
+        return comments
 
     # ВРЕМЯ
-    def get_last_seen_time(self, domain) -> datetime:
+    def get_last_seen_time(self, domain, tz: Optional[tzinfo] = DEFAULT_TIMEZONE) -> datetime:
         """
-        Возвращает время последнего посещения пользователя
-        """
-        last_seen = None
+        Возвращает время последнего посещения пользователя в часовом поясе tz (None - локальный)
 
+        users.get сам понимает короткие имена, поэтому запрос один. Кеш ответов не читается:
+        время посещения из него могло устареть
+        """
         params = {
-            'user_ids': self._get_user_id(domain),
+            'user_ids': domain,
             'fields': 'last_seen'
         }
         method = 'users.get'
-        response = self._make_request(method, params)
+        response = self._make_request(method, params, cached=False)
+        if not response:
+            raise NoSuchUser(f"User name {domain} doesn't exist")
+
+        return self._last_seen_time(response[0], tz)
 
-        timestamp = response[0].get('last_seen', {}).get('time', 0)  # int
-        tz = timezone(timedelta(hours=3))
-        last_seen = datetime.fromtimestamp(timestamp, tz=tz)
+    def get_registration_time(self, domain) -> str:
+        """
+        Возвращает дату регистрации пользователя ("2006-09-23 20:27:12+03:00")
+        """
+
+        created = self._registration_time(self._get_user_id(domain))
+        if created is None:
+            raise NoSuchUser(f"User name {domain} has no registration date")
+        return created
+
+    def get_registration_times(self, domains: Sequence, jobs: int = 8,
+                               store=None) -> Iterator[Tuple[str, Optional[str]]]:
+        """
+        Даты регистрации многих пользователей: пары (domain, дата) в порядке domains
 
-        return last_seen
+        Короткие имена переводятся в id пачками через execute, затем foaf.php скачиваются
+        в jobs потоков через общий пул соединений (jobs не больше pool_size).
+        store - постоянное хранилище дат (registrations.RegistrationStore): даты из него
+        не запрашиваются, а новые сохраняются в него пачками. У удаленных и
+        несуществующих страниц дата - None (в хранилище она тоже попадает)
+        """
 
-    def get_registration_time(self, domain):
-        user_id = self._get_user_id(domain)
-        url = 'https://vk.com/foaf.php?id={}'.format(user_id)
+        domains = [str(domain) for domain in domains]
+        ids = self.resolve_user_ids(domains)
+        known = store.get_many(ids.values()) if store is not None else {}
 
-        content = requests.get(url).content
-        soup = bs(content, 'lxml')
-        time = soup.find('ya:created')['dc:date'].replace('T', ' ')
+        def lookup(domain):
+            user_id = ids.get(domain)
+            if user_id is None:
+                return domain, None, None, False
+            if user_id in known:
+                return domain, user_id, known[user_id], False
+            return domain, user_id, self._registration_time(user_id), True
 
-        return time
+        fetched = []
+        try:
+            for domain, user_id, created, new in map_concurrently(lookup, domains, jobs):
+                if store is not None and new:
+                    fetched.append((user_id, created))
+                    if len(fetched) >= 100:
+                        store.put_many(fetched)
+                        fetched = []
+                yield domain, created
+        finally:
+            if fetched:
+                store.put_many(fetched)
+
+    def _registration_time(self, user_id: int) -> Optional[str]:
+        """
+        Дата регистрации из foaf.php; None, если ее там нет
+
+        Кеш ответов здесь не используется: даты хранит RegistrationStore
+        """
+
+        scanner = RegistrationScanner()
+        created = None
+        with self.session.get(self.foaf_url, params={'id': user_id}, stream=True, timeout=self.timeout) as response:
+            if response.status_code != http.HTTPStatus.OK:
+                raise RequestFailed('Код ответа: {}'.format(response.status_code))
+            # после того как дата найдена, остаток только дочитывается (без поиска),
+            # чтобы соединение вернулось в пул
+            for chunk in response.iter_content(chunk_size=2 ** 12):
+                if created is None:
+                    created = scanner.feed(chunk)
+        return created
 
     def get_user(self, domain: str, fields: Sequence[str]):
         params = {
@@ -422,6 +1207,26 @@ class VkAPI():
         response = self._make_request('users.get', params)
         return response[0]
 
+    def get_users(self, domains: Sequence, fields: Sequence[str] = tuple(), cached: bool = True) -> list:
+        """
+        Возвращает информацию о нескольких пользователях
+
+        domains разбиваются на куски по 1000 (максимум для users.get),
+        куски отправляются пачками через execute
+        """
+        _max_count = 1000  # максимальное кол-во domain-ов в одном запросе
+
+        domains = [str(domain) for domain in domains]
+        calls = [('users.get', {'user_ids': ','.join(chunk), 'fields': ','.join(fields)})
+                 for chunk in self._chunks(domains, _max_count)]
+
+        users = []
+        for result in self.execute(calls, cached):
+            if isinstance(result, RequestFailed):
+                raise result
+            users.extend(result)
+        return users
+
     def get_extended_info(self, domain, fields=''):
 
         params = {
@@ -454,44 +1259,22 @@ class VkAPI():
         Собака - удаленный пользователь
         В качестве аргумента принимается спискок domain-ов для проверки
         """
-        _max_count = 1000  # максимальное кол-во domain-ов в одном запросе
-
-        # Проходимся по списку domains и разрезаем его на куски длиной _max_count
-        start, end, step = 0, len(domains), _max_count
-
-        dogs = []
-        while start < end:
-            # Делаем срез
-            _slice = domains[start:start + step]
-            start = start + step
-
-            _slice = map(str, _slice)
-            # Выполняем запрос к API
-            params = {
-                'user_ids': ','.join(_slice)
-            }
-            method = 'users.get'
-            response = self._make_request(method, params)
-
-            # Записываем в dogs список собак
-            for user in response:
-                if user.get('deactivated', None) is not None:
-                    dogs.append(user['id'])
-        return dogs
+        return self._dogs(self.get_users(domains))
 
-    def get_posts(self, domain, count=None, offset=0, start=None, end=None) -> list:
+    def get_posts(self, domain, count=None, offset=0, start=None, end=None, cached=True):
         """
         Возвращает генератор списков постов (не более 100 за раз)
 
         Выбор временного промежутка [start; end]:
-        start, end - timestamp-ы (int)
+        start, end - timestamp-ы (int), любой из них можно не указывать
 
         count - кол-во возвращаемых постов (None - вернуть все посты)
         offset - смещение
+        cached - брать ли ответы из кеша (False - всегда свежие данные)
 
-        Если переданы оба параметра start, end, то вначале получается список всех
-        пос
-
+        Стена отсортирована по убыванию даты (кроме закрепленного поста), поэтому границы
+        промежутка находятся поиском по смещениям: пробы по одному посту, до execute_limit
+        проб за запрос. Затем параллельно загружаются только страницы внутри промежутка
         """
         _max_count = 100  # максимально кол-во постов за 1 запрос
 
@@ -499,116 +1282,68 @@ class VkAPI():
             'domain': domain,
             'extended': 1,
             # 'filter': 'owner',
-            'offset': offset
+            'offset': offset,
+            'count': _max_count
         }
-
-        if count is None:
-            params['count'] = _max_count
-        else:
-            params['count'] = _max_count if (count > _max_count or count == 0) else count
-
         method = 'wall.get'
 
-        # задается количество и смещение
-        if start == end == None:
-            while True:
-                response = self._make_request(method, params)
-                posts = response['items']
-                params['offset'] += len(posts)
-
-                if count is not None:
-                    if len(posts) >= count:
-                        yield posts[:count]
-                        break
-                    else:
-                        yield posts
-                        count -= len(posts)
-                elif len(posts) != 0:
+        window = PostWindow(count, start, end)
+        if window.done:
+            return
+
+        # первая страница: общее кол-во постов и закрепленный пост
+        first = self._make_request(method, dict(params), cached)
+        posts = window.feed(first['items'])
+        if posts:
+            yield posts
+        if window.done:
+            return
+
+        total = first['count']
+        lo, seek_end = self._post_window_bounds(first, offset, start, end)
+        if seek_end:
+            lo = self._seek_posts(params, lo, total, lambda post: post['date'] <= end, cached)
+        hi = total
+        if start is not None:
+            hi = self._seek_posts(params, lo, total, lambda post: post['date'] < start, cached)
+        if window.count is not None:
+            hi = min(hi, lo + window.count)
+
+        # страница с первым постом за окном тоже нужна, чтобы window заметил конец
+        stop = min(hi + 1, total)
+        chunks = self._chunks(self._post_page_calls(params, lo, stop, _max_count), self.execute_limit)
+        for results in map_concurrently(partial(self._execute_chunk, cached=cached), chunks, self.page_workers):
+            for result in results:
+                if isinstance(result, RequestFailed):
+                    raise result
+                posts = window.feed(result['items'])
+                if posts:
                     yield posts
-                else:
-                    break
-
-                    # посты с таймстампом больше чем start
-        elif start is not None and end is None:
-            while True:
-                response = self._make_request(method, params)
-                posts = response['items']
-                params['offset'] += len(posts)
-                start_index = None
-
-                for i, post in enumerate(posts):
-                    if post['date'] >= start:
-                        start_index = i
-
-                if start_index is None:
-                    break
-                else:
-                    if count is None:
-                        if posts == []:
-                            break
-                        yield posts[:start_index + 1]
-                    else:
-                        if count < start_index + 1:
-                            print(start_index)
-                            yield posts[start_index + 1 - count:start_index + 1]
-                            break
-                        else:
-                            yield posts
-                            count -= start_index + 1
-        # посты с таймстампом меньше чем end
-        elif start is None and end is not None:
-            while True:
-                response = self._make_request(method, params)
-                posts = response['items']
-                params['offset'] += len(posts)
-
-                end_index = None
-
-                for i, post in enumerate(posts):
-                    if post['date'] <= end:
-                        end_index = i
-                        break
-
-                if end_index is not None:
-                    if count is None:
-                        yield posts[end_index:]
-                    else:
-                        if count < len(posts) - end_index:
-                            yield posts[end_index:end_index + count]
-                            break
-                        else:
-                            yield posts[end_index:]
-                            count -= len(posts) - end_index
-        # посты с таймстампом внутри отрезка [start, end]
-        else:
-            start_index = end_index = None
-            while True:
-                response = self._make_request(method, params)
-                posts = response['items']
-                params['offset'] += len(posts)
-
-                for i, post in enumerate(posts):
-                    if post['date'] <= end and end_index is None:
-                        end_index = i
-
-                    if post['date'] < start and start_index is None:
-                        start_index = i - 1
-
-                if end_index is not None:
-                    if end_index == -1:
-                        if start_index is not None:
-                            yield posts[:start_index + 1]
-                            break
-                        else:
-                            yield posts
-                    else:
-                        if start_index is not None:
-                            yield posts[end_index:start_index + 1]
-                            break
-                        else:
-                            yield posts[end_index:]
+                if window.done:
+                    return
 
-                    end_index = -1
+        # пока шла загрузка, новые посты могли сдвинуть стену - дочитываем до конца окна
+        params['offset'] = max(lo, stop)
+        while not window.done:
+            response = self._make_request(method, dict(params), cached)
+            posts = response['items']
+            params['offset'] += len(posts)
+
+            posts = window.feed(posts)
+            if posts:
+                yield posts
+
+    def _seek_posts(self, params: dict, lo: int, hi: int, predicate, cached: bool = True) -> int:
+        """
+        Наименьшее смещение в [lo; hi), на котором пост удовлетворяет predicate (или hi)
+
+        predicate должен быть монотонным по стене: ложь до некоторого смещения, дальше истина
+        """
+
+        while lo < hi:
+            offsets, calls = self._probe_calls(params, lo, hi)
+            lo, hi = self._narrow(offsets, self._execute_chunk(calls, cached), lo, hi, predicate)
+        return lo
 
     def get_common_friends(self, domain_1, domain_2, mode=0):
 
@@ -620,103 +1355,74 @@ class VkAPI():
         1: словарь с информацие о каждом друге
         """
 
-        fields = ''
+        user_id_2 = self._get_user_id(domain_2)
+        common = self.get_mutual_friends(domain_1, [user_id_2]).get(user_id_2, [])
+
         if mode == 1:
-            fields = 'city, country, education, universities'
+            common = self._common_friends_info(self.get_users(common, ('city', 'country', 'education')))
 
-        # Получаем список друзей каждого из пользователей
-        friends_1 = self.get_friends(domain_1, fields)
-        friends_2 = self.get_friends(domain_2)
+        return common
 
-        # Ищем общие элементы
-        common = []
-        if mode == 0:
-            for person in friends_1:
-                if person in friends_2:
-                    common.append(person)
-        elif mode == 1:
-            for person in friends_1:
-                if person['id'] in friends_2:
-                    common.append(person)
-            people = []
-            for person in common:
-                name = '{} {}'.format(person['last_name'], person['first_name'])
-                city = person.get('city', {}).get('title', '')
-                country = person.get('country', {}).get('title', '')
-                university = person.get('university_name', '')
-
-                info = {'name': name, 'city': city, 'country': country, 'university': university}
-                people.append(info)
-            common = people
-
-            return common
+    def get_mutual_friends(self, source, targets: Sequence) -> dict:
+        """
+        Возвращает словарь {id цели: список id общих друзей source и цели}
 
-    def process_people(self, people, sort_by='name', filter_by={}, filter_reverse=False) -> list:
+        Используется friends.getMutual (до 100 целей за вызов, вызовы пачками через execute).
+        Если метод недоступен (например, с сервисным токеном), общие друзья
+        считаются пересечением множеств id друзей
         """
-        Обрабатывает список people
 
-        filter_by:
-        задается словарем
-        {'param': 'value1,value2'}
-        param - параметр person
-        value1,value2,... значения для фильтрации(одно из значений, которое принимает/непринимает параметр person)
-        (записывать строго через запятую, без пробелов и т.д.)
+        source_id = self._get_user_id(source)
+        target_ids = list(self.resolve_user_ids(targets).values())
 
-        filter_reverse:
-        False только persons с переданные значения будут возвращены
-        True будут возвращены все persons, кроме имеющих переданные значения
+        mutual = {}
+        fallback = []
+        calls = self._mutual_calls(source_id, target_ids)
+        for (_, params), result in zip(calls, self.execute(calls)):
+            chunk = [int(target_id) for target_id in params['target_uids'].split(',')]
+            if isinstance(result, RequestFailed):
+                fallback.extend(chunk)
+            else:
+                mutual.update(self._parse_mutual(chunk, result))
 
-        sort_by:
-        заадется строкой, которая является параметром person
-        """
+        if fallback:
+            source_friends = set(self.get_friends(source_id, []))
+            for target_id, friends in zip(fallback, self.get_friend_ids(fallback)):
+                mutual[target_id] = self._intersect_friends(source_friends, friends)
 
-        people_keys = people[0].keys()  # Список параметров person
+        return mutual
 
-        # for person in people:
-        #     for key in people_keys:
+    def get_friend_ids(self, user_ids: Sequence[int]) -> list:
+        """
+        Возвращает списки id друзей пользователей (для закрытых страниц - пустые)
 
-        # Выполняем сортировку по укзанному в sort_by параметру
-        if sort_by in people_keys:
-            people.sort(key=lambda x: x[sort_by])
-        else:
-            print('Неизвестный ключ сортировки')
+        Первые 5000 друзей каждого запрашиваются пачками через execute,
+        остальные страницы - только у тех, у кого друзей больше
+        """
 
-        # Выполняем фильтрацию данных по указанным в filter_by параметрам и их значениям
-        if filter_by != {}:  # Если filter_by не пустой
-            filter_by_keys = filter_by.keys()  # списко параметров filter_by
-            _people = []  # список людей отвечающих критериям
-            for person in people:  # проходимся по списку people
-                _bool = True  # проверяет одновременность выполнения всех условий
-                for _filter in filter_by_keys:  # проходимся по всем параметрам filter_by
-                    values = filter_by[_filter].split(',')  # разбиваем строку значений на список возможных значений
-                    __bool = False  # проверяет выполнение хотя бы одного условия из списка значений
-                    for value in values:
-                        __bool = __bool or (filter_reverse ^ (person[_filter] == value))
-                    _bool = _bool and __bool
-                if _bool:  # если все условия выполнятся, то добавляем в список отвечающих критериям
-                    _people.append(person)
-            people = _people  # переприсваеваем people
+        calls = [('friends.get', {'user_id': user_id, 'count': 5000, 'offset': 0}) for user_id in user_ids]
+        friend_ids = []
+        for (_, params), result in zip(calls, self.execute(calls)):
+            if isinstance(result, RequestFailed):
+                friend_ids.append([])
+                continue
 
-        return people
+            friends = list(result.get('items', []))
+            for page in self.execute(self._page_calls('friends.get', params, 5000, result)):
+                if not isinstance(page, RequestFailed):
+                    friends.extend(page.get('items', []))
+            friend_ids.append(friends)
+        return friend_ids
 
     def get_likes(self, owner_id, item_id):
         params = {
             'owner_id': owner_id,
             'item_id': item_id,
-            'type': 'post',
-            'count': 1000,
-            'offset': 0
+            'type': 'post'
         }
         method = 'likes.getList'
         likes = []
-        while True:
-            response = self._make_request(method, params)
-            items = response.get('items', [])
-            likes.extend(items)
-            likes_count = response.get('count', 0)
-
-            params['offset'] += params['count']
-            if params['offset'] >= likes_count:
-                break
+        for page in self._paginate(method, params, 1000):
+            likes.extend(page)
 
         return likes
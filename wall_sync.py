@@ -0,0 +1,160 @@
+import json
+import os
+import time
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from cache import open_db
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "vk-tools", "posts.sqlite3")
+
+
+class WallState(NamedTuple):
+    last_id: Optional[int]
+    last_date: Optional[int]
+    synced: Optional[float]
+    refreshed: Optional[float]
+
+
+class SyncResult(NamedTuple):
+    new: List[dict]
+    updated: List[dict]
+
+
+class PostStore:
+    """
+    Локальное хранилище постов стен в SQLite
+
+    Посты хранятся по ключу (owner, id), где owner - domain стены, как он передан в wall.get.
+    Для каждой стены запоминается время последней синхронизации и обновления свежих постов
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._db, self._lock = open_db(path)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                owner TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                date INTEGER NOT NULL,
+                is_pinned INTEGER NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (owner, id)
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS posts_date ON posts (owner, date)")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS walls (
+                owner TEXT PRIMARY KEY,
+                synced REAL,
+                refreshed REAL
+            )
+        """)
+
+    def state(self, owner: str) -> WallState:
+        with self._lock:
+            last_id, last_date = self._db.execute(
+                "SELECT id, date FROM posts WHERE owner = ? ORDER BY date DESC, id DESC LIMIT 1", (owner,)
+            ).fetchone() or (None, None)
+            synced, refreshed = self._db.execute(
+                "SELECT synced, refreshed FROM walls WHERE owner = ?", (owner,)
+            ).fetchone() or (None, None)
+        return WallState(last_id, last_date, synced, refreshed)
+
+    def save(self, owner: str, posts: List[dict]) -> SyncResult:
+        """
+        Сохраняет посты, возвращает новые и изменившиеся (текст, лайки, закрепление и т.д.)
+        """
+
+        if not posts:
+            return SyncResult([], [])
+
+        values = {post["id"]: json.dumps(post, ensure_ascii=False, sort_keys=True) for post in posts}
+        new, updated = [], []
+        with self._lock:
+            placeholders = ",".join("?" * len(values))
+            stored = dict(self._db.execute(f"SELECT id, value FROM posts WHERE owner = ? AND id IN ({placeholders})",
+                                           (owner, *values)).fetchall())
+
+            self._db.execute("BEGIN")
+            try:
+                for post in posts:
+                    value = values[post["id"]]
+                    if stored.get(post["id"]) == value:
+                        continue
+                    (updated if post["id"] in stored else new).append(post)
+                    if post.get("is_pinned"):
+                        # закреплен может быть только один пост
+                        self._db.execute("UPDATE posts SET is_pinned = 0 WHERE owner = ? AND is_pinned = 1", (owner,))
+                    self._db.execute("INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?)",
+                                     (owner, post["id"], post["date"], int(bool(post.get("is_pinned"))), value))
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+        return SyncResult(new, updated)
+
+    def mark(self, owner: str, synced: float, refreshed: Optional[float] = None) -> None:
+        with self._lock:
+            self._db.execute("INSERT INTO walls (owner, synced, refreshed) VALUES (?, ?, ?) "
+                             "ON CONFLICT (owner) DO UPDATE SET synced = excluded.synced, "
+                             "refreshed = COALESCE(excluded.refreshed, refreshed)", (owner, synced, refreshed))
+
+    def posts(self, owner: str, since: Optional[int] = None) -> Iterator[dict]:
+        """
+        Сохраненные посты стены по убыванию даты, начиная с since (timestamp)
+        """
+
+        with self._lock:
+            rows = self._db.execute("SELECT value FROM posts WHERE owner = ? AND date >= ? ORDER BY date DESC, id DESC",
+                                    (owner, since or 0)).fetchall()
+        for value, in rows:
+            yield json.loads(value)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class WallSync:
+    """
+    Инкрементальная синхронизация стен с PostStore
+
+    Первая синхронизация забирает стену целиком, следующие - только посты не старше
+    последнего сохраненного (обычно одна страница wall.get). Раз в refresh_every секунд
+    заодно перечитываются посты за последние refresh_age секунд, чтобы подхватить
+    правки и изменившиеся счетчики лайков и комментариев.
+    Запросы идут мимо кеша ответов: синхронизации нужны свежие данные
+    """
+
+    def __init__(self, vkapi, store: PostStore, refresh_age: float = 24 * 3600, refresh_every: float = 3600):
+        self.vkapi = vkapi
+        self.store = store
+        self.refresh_age = refresh_age
+        self.refresh_every = refresh_every
+
+    def since(self, state: WallState, now: float) -> Tuple[Optional[int], bool]:
+        """
+        С какой даты нужно запросить посты и будет ли это обновлением свежих постов
+        """
+
+        if state.last_date is None:
+            return None, True
+
+        refresh = state.refreshed is None or now - state.refreshed >= self.refresh_every
+        if refresh:
+            return int(min(state.last_date, now - self.refresh_age)), True
+        return state.last_date, False
+
+    def sync(self, owner: str) -> SyncResult:
+        now = time.time()
+        since, refresh = self.since(self.store.state(owner), now)
+
+        new, updated = [], []
+        for posts in self.vkapi.get_posts(owner, start=since, cached=False):
+            result = self.store.save(owner, posts)
+            new.extend(result.new)
+            updated.extend(result.updated)
+
+        self.store.mark(owner, now, now if refresh else None)
+        return SyncResult(new, updated)